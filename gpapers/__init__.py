@@ -20,12 +20,12 @@
 #    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime, timedelta, date
+import functools
+import itertools
 import math
-import mimetypes
 import os
 import sys
 import thread
-import time
 import traceback
 
 from gi.repository import Gio
@@ -42,13 +42,29 @@ import gpapers.settings
 import django.core.management
 django.core.management.setup_environ(gpapers.settings)
 from django.core.exceptions import MultipleObjectsReturned
-from django.db.models import Q
 from django.template import defaultfilters
-from django.db.models.signals import post_save, post_delete
 
 from gpapers.logger import log_level_debug, log_warn, log_info, log_debug
-from gpapers.importer import bibtex, pdf_file
+from gpapers.importer import bibtex
+from gpapers.importer.extraction import ExtractionService
+from gpapers.importer.pipeline import ImportPipeline, MetadataImport
 from gpapers.gPapers.models import *
+from gpapers.gPapers import fulltext, schema, search
+from gpapers.gPapers.bookmarks import BookmarkIndex
+from gpapers.gPapers.changes import ChangeJournal
+from gpapers.gPapers.citations import CitationIndex
+from gpapers.gPapers.coauthors import CoauthorshipIndex
+from gpapers.gPapers.facets import FacetIndex
+from gpapers.gPapers.filterlist import (FilterListModel, author_filter_rows,
+                                        organization_filter_rows,
+                                        source_filter_rows, year_filter_rows,
+                                        rating_filter_rows)
+from gpapers.gPapers.graph import BOX, Graph
+from gpapers.gPapers.graphview import GraphWindow
+from gpapers.gPapers.monitor import DocumentMonitor
+from gpapers.gPapers.pagecache import PageCache
+from gpapers.gPapers.paperlist import PaperListModel
+from gpapers.gPapers.resolver import PaperKeyIndex, store_references
 import gpapers.importer as importer
 from gpapers.importer import pango_escape
 from gpapers.importer import pubmed, google_scholar, jstor, arxiv
@@ -119,44 +135,27 @@ def make_all_columns_resizeable_clickable_ellipsize(columns):
                 renderer.set_property('ellipsize', Pango.EllipsizeMode.END)
 
 
-def import_documents_via_filenames(filenames, callback):
+def import_documents_via_filenames(filenames):
     '''
     Adds existing files or directories to the database and copies the documents
     to the MEDIA_ROOT/papers directory.
     ``filenames`` is a sequence of filenames.
     '''
 
-    log_info('Starting filename import for %d documents' % len(filenames))
-
-    def get_all_files(basedir, filenames):
-        '''
-        Returns a flat list with all pdf files in the file/directory list
-        '''
-        results = []
-        for filename in filenames:
-            filename = os.path.join(basedir, filename)
-            if os.path.isdir(filename):
-                results.extend(get_all_files(filename, os.listdir(filename)))
-            elif mimetypes.guess_type(filename)[0] == 'application/pdf':
-                #TODO: Also allow other file types like ps.gz
-                results.append(filename)
-        return results
-
-    all_files = get_all_files('', filenames)
+    log_info('Starting filename import for %d files/directories' % len(filenames))
     # TODO: Show an error message if no file is found?
-
-    for filename in all_files:
-        gfile = Gio.File.new_for_path(filename)
-        # first argument is the `cancellable` object
-        gfile.load_contents_async(None, callback, filename)
+    ImportPipeline(filenames, main_gui.store_imported_document,
+                   main_gui.extraction_service,
+                   main_gui.active_threads).start()
 
     main_gui.refresh_middle_pane_search()
 
 
-def row_from_dictionary(info, provider=None):
+def row_from_dictionary(info, provider=None, has_full_text=False):
     assert info is not None
 
-    return (VirtualPaper(info, provider), )
+    paper = VirtualPaper(info, provider)
+    return (paper, PaperRow.for_virtual_paper(paper, has_full_text))
 
 
 def paper_from_dictionary(paper_info, paper=None):
@@ -216,64 +215,24 @@ def paper_from_dictionary(paper_info, paper=None):
     return paper
 
 
-def compare_papers(column, row1, row2, user_data):
+def get_paper_text_attribute(paper_row, attribute):
     '''
-    This function is used to compare two rows for the sorting in the table.
-    As our model does not have any columns, the sort column ids are ignored.
-    The argument `user_data` is used for specifying on which attribute
-    the sorting is to be done.
-    '''  
-    paper1 = column.get_value(row1, 0)
-    paper2 = column.get_value(row2, 0)
-    
-    if user_data == 'rating':
-        value1 = paper1.rating
-        value2 = paper2.rating
-    else:
-        value1 = get_paper_text_attribute(paper1, user_data)
-        value2 = get_paper_text_attribute(paper2, user_data)
-
-    if value1 < value2:
-        return -1
-    elif value1 == value2:
-        return 0
-    else:
-        return 1
-
-
-def get_paper_text_attribute(paper, attribute):
-    '''
-    Returns a string representation of an `attribute` of a certain `paper`. 
-    Used by the TreeView and for sorting.
+    Returns a string representation of an `attribute` of a
+    :class:`gpapers.gPapers.models.PaperRow`. Used by the TreeView and for
+    sorting.
     
     Note that `attribute` does not always correspond to a direct attribute of 
     the `Paper` class, it can also be `'Year'` (the year of the publication date
     of the source), `'Journal'` (the name of the source) or `'Authors'` (a
     combined string of all authors names).
     '''
-    
-    # special case some attributes that are not direct attributes of the paper object
-    if attribute == 'Authors':
-        authors = ', '.join([ author.name for author in
-                             paper.get_authors_in_order()])
-        return authors
-    elif attribute == 'Journal':
-        if paper.source:
-            journal = paper.source.name
-        else:
-            journal = ''
-        return journal
-    elif attribute == 'Year':
-        if paper.source and paper.source.publication_date:
-            pub_year = str(paper.source.publication_date.year)
-        else:
-            pub_year = ''
-        return pub_year
-    elif attribute == 'Created':
-        return paper.created.strftime('%x')
+    if attribute == 'Created':
+        if paper_row.created:
+            return paper_row.created.strftime('%x')
+        return ''
     else:
         # Get the value of the respective attribute
-        return unicode(getattr(paper, attribute.lower()))
+        return getattr(paper_row, attribute.lower())
 
 
 def render_paper_text_attribute(column, cell, model, iter, attribute):
@@ -281,8 +240,8 @@ def render_paper_text_attribute(column, cell, model, iter, attribute):
     This function is used by the view of the list of papers to display an 
     attribute for the paper object.
     '''
-    paper = model.get_value(iter, 0)
-    attribute_text = get_paper_text_attribute(paper, attribute)
+    paper_row = model.get_value(iter, 1)
+    attribute_text = get_paper_text_attribute(paper_row, attribute)
     cell.set_property('text', attribute_text)
 
 
@@ -292,8 +251,8 @@ def render_paper_rating_attribute(column, cell, model, iter, data):
     rating from a paper object and pass it to the progress bar renderer used
     to display it
     '''
-    paper = model.get_value(iter, 0)
-    cell.value = paper.rating
+    paper_row = model.get_value(iter, 1)
+    cell.value = paper_row.rating
 
 
 def render_paper_document_attribute(column, cell, model, iter, widget):
@@ -301,9 +260,9 @@ def render_paper_document_attribute(column, cell, model, iter, widget):
     This function is used by the view of the list of papers to display a little
     icon for papers that have the text in the library.
     '''
-    paper = model.get_value(iter, 0)
+    paper_row = model.get_value(iter, 1)
 
-    if paper.full_text and os.path.isfile(paper.full_text.path):
+    if paper_row.has_full_text:
         icon = widget.render_icon(Gtk.STOCK_DND, Gtk.IconSize.MENU)
     else:
         icon = None
@@ -361,20 +320,79 @@ class MainGUI:
                 if not key in paper_info:
                         paper_info[key] = paper_obj.paper_info[key]
 
-        if paper_data is not None:            
-            # Get some info from the PDF:
-            self.active_threads[str(user_data)] = 'Extracting data from PDF'
-            # FIXME: This extraction should be done asynchronously
-            paper_info_pdf = pdf_file.get_paper_info_from_pdf(paper_data)
-            del self.active_threads[str(user_data)]
-            
-            # The info directly taken from the PDF is generally not very good,
-            # overwrite conflicting info with any additionally given info
-            paper_info_pdf.update(paper_info)            
-            paper_info = paper_info_pdf
-            
+        if paper_data is not None:
+            paper_id = find_paper_by_data(paper_data)
+            if paper_id is not None:
+                log_info('Document is already in the library (paper %d)' %
+                         paper_id)
+                self.merge_paper_info(Paper.objects.get(id=paper_id),
+                                      paper_info)
+                return
+
+            # Get some info from the PDF (in a separate process), the document
+            # is stored when the extraction has finished
+            def pdf_info_extracted(paper_info_pdf):
+                # The info directly taken from the PDF is generally not very
+                # good, overwrite conflicting info with any additionally given
+                # info
+                paper_info_pdf.update(paper_info)
+                self.store_imported_document(paper_info_pdf, paper_data)
+
+            def pdf_info_failed(message):
+                # Still import the document, with the info we have
+                self.store_imported_document(paper_info, paper_data)
+
+            job_id = self.extraction_service.submit(pdf_info_extracted,
+                                                    data=paper_data,
+                                                    error_callback=pdf_info_failed)
+            if job_id is None:
+                # Too many documents are waiting for the extraction, import
+                # the document without the info from the PDF
+                self.store_imported_document(paper_info, paper_data)
+        else:
+            self.store_imported_document(paper_info)
+
+    def merge_paper_info(self, paper, paper_info):
+        '''
+        Adds the information in `paper_info` to an existing `paper` (after
+        importing its document a second time), keeping what is already set.
+        '''
+        # keys of paper_info that do not directly correspond to attributes
+        present = {'journal': paper.source, 'issue': paper.source,
+                   'year': paper.source, 'location': paper.source,
+                   'pages': paper.source_pages,
+                   'authors': paper.authors.exists()}
+        missing_info = dict([(key, value) for key, value in paper_info.items()
+                             if not present.get(key, getattr(paper, key, None))])
+        if missing_info:
+            log_debug('Adding %s to paper %d' % (missing_info.keys(),
+                                                 paper.id))
+            paper_from_dictionary(missing_info, paper=paper)
+
+    def store_imported_document(self, paper_info, paper_data=None):
+        '''
+        Creates a paper from the `paper_info` dictionary and stores the
+        document `paper_data` (the PDF itself) if given. If the document is
+        already part of the library (e.g. when the same file was imported
+        twice at the same time), `paper_info` is merged into the existing
+        paper instead (see :meth:`merge_paper_info`). Returns
+        ``(paper, created)``.
+        '''
+        if paper_data is not None:
+            paper_id = find_paper_by_data(paper_data)
+            if paper_id is not None:
+                log_info('Document is already in the library (paper %d)' %
+                         paper_id)
+                paper = Paper.objects.get(id=paper_id)
+                self.merge_paper_info(paper, paper_info)
+                return paper, False
+
         paper = paper_from_dictionary(paper_info)
 
+        if paper_info.get('references'):
+            store_references(paper, paper_info['references'],
+                             self.paper_key_index, self.citation_index)
+
         # If we have a PDF file, save the file
         if paper_data is not None:
             #TODO: What is a good filename? Make this configurable?
@@ -396,6 +414,7 @@ class MainGUI:
             importer.get_bibtex_for_doi(paper.doi, self.bibtex_received)
 
         paper.save()
+        return paper, True
 
     def import_url_dialog(self, o):
         '''
@@ -467,16 +486,7 @@ class MainGUI:
         dialog.show_all()
         response = dialog.run()
         if response == Gtk.ResponseType.OK:
-
-            def mycallback(file_object, asyncresult, user_data):
-                # Get the actual file content 
-                file_content = file_object.load_contents_finish(asyncresult)[1]
-
-                self.document_imported(paper_data=file_content, paper_info=None,
-                                       user_data=user_data)
-
-            import_documents_via_filenames(dialog.get_filenames(),
-                                           mycallback)
+            import_documents_via_filenames(dialog.get_filenames())
         dialog.destroy()
 
     def import_directory_dialog(self, o):
@@ -496,26 +506,81 @@ class MainGUI:
         dialog.show_all()
         response = dialog.run()
         if response == Gtk.ResponseType.OK:
+            import_documents_via_filenames(dialog.get_filenames())
+        dialog.destroy()
 
-            def mycallback(file_object, asyncresult, user_data):
-                # Get the actual file content 
-                file_content = file_object.load_contents_finish(asyncresult)[1]
+    def import_paper_info(self, paper_info):
+        '''
+        Imports a single paper described by `paper_info`. If the paper info
+        contains an URL or a DOI, :meth:`importer.import_from_url` is called
+        for this URL. In either case, :meth:`document_imported` is called in
+        the end.
+        '''
+        url = paper_info.get('import_url')
+        if not url:
+            url = paper_info.get('doi')
+            if url:
+                url = 'http://dx.doi.org/' + url
 
-                self.document_imported(paper_data=file_content, paper_info=None,
-                                       user_data=user_data)
+        if url:
+            importer.import_from_url(url, self.document_imported,
+                                     paper_info=paper_info)
+        else:
+            self.document_imported(paper_info=paper_info)
+
+    def import_bibtex(self, source, finished_callback=None):
+        '''
+        Imports all entries of the BibTeX `source` (a string or a file
+        object). A single entry is imported with :meth:`import_paper_info`,
+        several entries are only stored with their metadata, in batches (see
+        :class:`gpapers.importer.pipeline.MetadataImport` and
+        :func:`gpapers.gPapers.models.bulk_import_papers`). Returns ``False``
+        if the source does not contain any entries. `finished_callback` is
+        called without arguments after the import.
+        '''
+        paper_infos = bibtex.paper_infos_from_bibtex(source)
+        first = next(paper_infos, None)
+        if first is None:
+            if finished_callback is not None:
+                finished_callback()
+            return False
+        second = next(paper_infos, None)
+        if second is None:
+            self.import_paper_info(first)
+            if finished_callback is not None:
+                finished_callback()
+            return True
+
+        def store(batch):
+            # one notification for the complete import, see below
+            return bulk_import_papers(batch, notify=False)
 
-            import_documents_via_filenames(dialog.get_filenames(),
-                                           mycallback)
+        def finished(paper_ids):
+            if paper_ids:
+                library_changed.send(sender=Paper, paper_ids=paper_ids)
+            if finished_callback is not None:
+                finished_callback()
+
+        MetadataImport(itertools.chain([first, second], paper_infos), store,
+                       self.active_threads, finished_callback=finished).start()
+        return True
+
+    def show_error_message(self, markup):
+        '''
+        Shows an error dialog with the given Pango `markup`.
+        '''
+        dialog = Gtk.MessageDialog(parent=self.main_window,
+                                   type=Gtk.MessageType.ERROR,
+                                   buttons=Gtk.ButtonsType.CLOSE,
+                                   flags=Gtk.DialogFlags.MODAL)
+        dialog.set_markup(markup)
+        dialog.run()
         dialog.destroy()
 
     def import_bibtex_dialog(self, o):
         '''
-        Opens a dialog for entering/pasting BibTex information. The given
-        information is first converted into a ``paper_info`` dictionary via
-        :func:`bibtex.paper_info_from_bibtex`. If the returned paper info
-        contains an URL or a DOI, :meth:`importer.import_from_url` is called
-        for this URL. In either case, :meth:`document_imported` is called in
-        the end.
+        Opens a dialog for entering/pasting BibTex information. All entries
+        are imported with :meth:`import_bibtex`.
         '''
         dialog = Gtk.MessageDialog(parent=self.main_window,
                                    type=Gtk.MessageType.QUESTION,
@@ -540,19 +605,7 @@ class MainGUI:
                 text_buffer = entry.get_buffer()
                 bibtex_data = text_buffer.get_text(text_buffer.get_start_iter(),
                                               text_buffer.get_end_iter(), False)
-                paper_info = bibtex.paper_info_from_bibtex(bibtex_data)
-                if len(paper_info):
-                    url = paper_info.get('import_url')
-                    if not url:
-                        url = paper_info.get('doi')
-                        if url:
-                            url = 'http://dx.doi.org/' + url
-        
-                    if url:
-                        importer.import_from_url(url, self.document_imported,
-                                                 paper_info=paper_info)
-                    else:
-                        self.document_imported(paper_info=paper_info)
+                if self.import_bibtex(bibtex_data):
                     done = True
                 else:
                     statuslabel.set_markup('<span foreground="red" font-style="italic">Could not parse BibTeX.</span>')
@@ -586,15 +639,21 @@ class MainGUI:
         self.init_middle_top_pane()
         self.init_paper_information_pane()
         self.init_busy_notifier()
+        self.extraction_service = ExtractionService(self.active_threads)
         self.pdf_preview = PDFPreview(self.ui)
         self.refresh_left_pane()
+        self.coauthorship_index = CoauthorshipIndex()
+        self.citation_index = CitationIndex()
+        self.citation_index.start()
+        self.paper_key_index = PaperKeyIndex()
 
         # make sure the GUI updates on database changes
-        def receiver_wrapper(sender, **kwargs):
-            self.handle_library_updates()
+        self.change_journal = ChangeJournal(self.handle_library_changes)
+        self.change_journal.start()
 
-        post_save.connect(receiver_wrapper, sender=Paper, weak=False)
-        post_delete.connect(receiver_wrapper, sender=Paper, weak=False)
+        # ... and on changes to the documents in the library
+        self.document_monitor = DocumentMonitor(self.handle_document_updates)
+        self.document_monitor.start()
 
         self.main_window.maximize()
         self.main_window.show()
@@ -608,7 +667,6 @@ class MainGUI:
         if (not self.pdf_preview.displayed_paper is None and
             self.pdf_preview.notes_edited):
             log_info('Saving displayed paper (changed notes)')
-            post_save.receivers = []
             self.pdf_preview.displayed_paper.save()
         
         if (not self.pdf_preview.displayed_bookmark is None and
@@ -616,6 +674,12 @@ class MainGUI:
             log_info('Saving displayed bookmarked (unsaved changes)')
             self.pdf_preview.displayed_bookmark.save()
         
+        self.change_journal.stop()
+        self.citation_index.stop()
+        self.pdf_preview.page_cache.stop()
+        self.document_monitor.stop()
+        self.extraction_service.shutdown()
+
         # really quit
         Gtk.main_quit()
 
@@ -786,93 +850,202 @@ class MainGUI:
         left_pane.connect("drag-motion", self.handle_left_pane_drag_motion_event)
 
     def init_my_library_filter_pane(self):
+        self.sorting_filter_pane = False
+        self.facet_index = FacetIndex()
 
         author_filter = self.ui.get_object('author_filter')
         # id, author, paper_count
-        self.author_filter_model = Gtk.ListStore(int, str, int)
+        self.author_filter_model = FilterListModel(author_filter_rows,
+                                                   (int, str, int))
         author_filter.set_model(self.author_filter_model)
         author_filter.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
         column = Gtk.TreeViewColumn("Author", Gtk.CellRendererText(), text=1)
-        column.set_sort_column_id(1)
+        column.connect('clicked', self.sort_filter_pane, author_filter, 1)
         column.set_expand(True)
         author_filter.append_column(column)
         column = Gtk.TreeViewColumn("Papers", Gtk.CellRendererText(), text=2)
-        column.set_sort_column_id(2)
+        column.connect('clicked', self.sort_filter_pane, author_filter, 2)
         author_filter.append_column(column)
         make_all_columns_resizeable_clickable_ellipsize(author_filter.get_columns())
-        author_filter.get_selection().connect('changed', lambda x: self.refresh_middle_pane_from_my_library(False))
+        author_filter.get_selection().connect('changed', self.handle_filter_pane_selection_changed)
         author_filter.connect('row-activated', self.handle_author_filter_row_activated)
         author_filter.connect('button-press-event', self.handle_author_filter_button_press_event)
 
         organization_filter = self.ui.get_object('organization_filter')
         # id, org, author_count, paper_count
-        self.organization_filter_model = Gtk.ListStore(int, str, int, int)
+        self.organization_filter_model = FilterListModel(organization_filter_rows,
+                                                         (int, str, int, int))
         organization_filter.set_model(self.organization_filter_model)
         organization_filter.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
         column = Gtk.TreeViewColumn("Organization", Gtk.CellRendererText(), text=1)
-        column.set_sort_column_id(1)
+        column.connect('clicked', self.sort_filter_pane, organization_filter, 1)
         column.set_expand(True)
         organization_filter.append_column(column)
         column = Gtk.TreeViewColumn("Authors", Gtk.CellRendererText(), text=2)
-        column.set_sort_column_id(2)
+        column.connect('clicked', self.sort_filter_pane, organization_filter, 2)
         organization_filter.append_column(column)
         column = Gtk.TreeViewColumn("Papers", Gtk.CellRendererText(), text=3)
-        column.set_sort_column_id(3)
+        column.connect('clicked', self.sort_filter_pane, organization_filter, 3)
         organization_filter.append_column(column)
         make_all_columns_resizeable_clickable_ellipsize(organization_filter.get_columns())
-        organization_filter.get_selection().connect('changed', lambda x: self.refresh_middle_pane_from_my_library(False))
+        organization_filter.get_selection().connect('changed', self.handle_filter_pane_selection_changed)
         organization_filter.connect('row-activated', self.handle_organization_filter_row_activated)
         organization_filter.connect('button-press-event', self.handle_organization_filter_button_press_event)
 
         source_filter = self.ui.get_object('source_filter')
-        # id, name, issue, location, publisher, date
-        self.source_filter_model = Gtk.ListStore(int, str, str, str, str, str)
+        # id, name, issue, location, publisher, date, paper_count
+        self.source_filter_model = FilterListModel(source_filter_rows,
+                                                   (int, str, str, str, str, str, int))
         source_filter.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
         source_filter.set_model(self.source_filter_model)
         column = Gtk.TreeViewColumn("Source", Gtk.CellRendererText(), text=1)
-        column.set_sort_column_id(1)
+        column.connect('clicked', self.sort_filter_pane, source_filter, 1)
         column.set_expand(True)
         source_filter.append_column(column)
         column = Gtk.TreeViewColumn("Issue", Gtk.CellRendererText(), text=2)
-        column.set_sort_column_id(2)
+        column.connect('clicked', self.sort_filter_pane, source_filter, 2)
         source_filter.append_column(column)
         column = Gtk.TreeViewColumn("Location", Gtk.CellRendererText(), text=3)
-        column.set_sort_column_id(3)
+        column.connect('clicked', self.sort_filter_pane, source_filter, 3)
         source_filter.append_column(column)
         column = Gtk.TreeViewColumn("Publisher", Gtk.CellRendererText(), text=4)
-        column.set_sort_column_id(4)
+        column.connect('clicked', self.sort_filter_pane, source_filter, 4)
+        source_filter.append_column(column)
+        column = Gtk.TreeViewColumn("Papers", Gtk.CellRendererText(), text=6)
+        column.connect('clicked', self.sort_filter_pane, source_filter, 6)
         source_filter.append_column(column)
         make_all_columns_resizeable_clickable_ellipsize(source_filter.get_columns())
-        source_filter.get_selection().connect('changed', lambda x: self.refresh_middle_pane_from_my_library(False))
+        source_filter.get_selection().connect('changed', self.handle_filter_pane_selection_changed)
         source_filter.connect('row-activated', self.handle_source_filter_row_activated)
         source_filter.connect('button-press-event', self.handle_source_filter_button_press_event)
 
-    def refresh_my_library_filter_pane(self):
-        # clear all selections for now
-        # TODO: Handle all additions/removals to the models more gracefully,
-        # i.e. add and remove objects from the existing model instead of clearing
-        # and filling it up again on every refresh
-        self.ui.get_object('author_filter').get_selection().unselect_all()
-        self.ui.get_object('source_filter').get_selection().unselect_all()
-        self.ui.get_object('organization_filter').get_selection().unselect_all()
-        self.author_filter_model.clear()
-        for author in Author.objects.order_by('name'):
-            self.author_filter_model.append((author.id, author.name, author.paper_set.count()))
+        # year and rating: value, label, paper_count
+        self.year_filter_model = FilterListModel(functools.partial(year_filter_rows,
+                                                                   self.facet_index),
+                                                 (int, str, int))
+        self.rating_filter_model = FilterListModel(functools.partial(rating_filter_rows,
+                                                                     self.facet_index),
+                                                   (int, str, int))
+        for name, title, model in [('year_filter', 'Year', self.year_filter_model),
+                                   ('rating_filter', 'Rating', self.rating_filter_model)]:
+            treeview = self.ui.get_object(name)
+            treeview.set_model(model)
+            treeview.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
+            column = Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=1)
+            column.connect('clicked', self.sort_filter_pane, treeview, 1)
+            column.set_expand(True)
+            treeview.append_column(column)
+            column = Gtk.TreeViewColumn("Papers", Gtk.CellRendererText(), text=2)
+            column.connect('clicked', self.sort_filter_pane, treeview, 2)
+            treeview.append_column(column)
+            make_all_columns_resizeable_clickable_ellipsize(treeview.get_columns())
+            treeview.get_selection().connect('changed', self.handle_filter_pane_selection_changed)
+
+        # facet, tree view, model, column with the number of papers
+        self.facet_panes = [('author', 'author_filter', self.author_filter_model, 2),
+                            ('source', 'source_filter', self.source_filter_model, 6),
+                            ('organization', 'organization_filter',
+                             self.organization_filter_model, 3),
+                            ('year', 'year_filter', self.year_filter_model, 2),
+                            ('rating', 'rating_filter', self.rating_filter_model, 2)]
+
+    def sort_filter_pane(self, column, treeview, index):
+        model = treeview.get_model()
+        descending = model.sort_column == index and not model.descending
+        for other_column in treeview.get_columns():
+            other_column.set_sort_indicator(other_column == column)
+        if descending:
+            column.set_sort_order(Gtk.SortType.DESCENDING)
+        else:
+            column.set_sort_order(Gtk.SortType.ASCENDING)
+
+        # sort the model while it is not connected to the view, keeping the
+        # selection
+        selection = treeview.get_selection()
+        selected = [model.get_id(path)
+                    for path in selection.get_selected_rows()[1]]
+        self.sorting_filter_pane = True
+        try:
+            treeview.set_model(None)
+            model.sort(index, descending)
+            treeview.set_model(model)
+            for row_id in selected:
+                selection.select_path(Gtk.TreePath((model.ids.index(row_id), )))
+        finally:
+            self.sorting_filter_pane = False
+
+    def handle_filter_pane_selection_changed(self, selection):
+        if not self.sorting_filter_pane:
+            self.refresh_middle_pane_from_my_library(False)
+            self.update_facet_counts()
+
+    def get_facet_selections(self):
+        '''
+        Returns the values selected in the filter panes as a dictionary
+        mapping the facets to sets of values (see :class:`FacetIndex`).
+        '''
+        selections = {}
+        for facet, name, model, count_column in self.facet_panes:
+            paths = self.ui.get_object(name).get_selection().get_selected_rows()[1]
+            selections[facet] = set([model.get_id(path) for path in paths])
+        return selections
 
-        self.organization_filter_model.clear()
-        for organization in Organization.objects.order_by('name'):
-            self.organization_filter_model.append((organization.id, organization.name, organization.author_set.count(), organization.paper_set.count()))
+    def update_facet_counts(self):
+        '''
+        Shows the number of papers matching the selections in the other
+        filter panes for every row of the filter panes.
+        '''
+        if not self.facet_index.built:
+            return
+        selections = self.get_facet_selections()
+        for facet, name, model, count_column in self.facet_panes:
+            model.set_counts(count_column,
+                             self.facet_index.counts(facet, selections))
 
-        self.source_filter_model.clear()
-        for source in Source.objects.order_by('name'):
-            if source.publication_date:
-                publication_date = source.publication_date.strftime('%Y-%m-%d')
-            else:
-                publication_date = ''
-            self.source_filter_model.append((source.id, source.name,
-                                             source.issue, source.location,
-                                             source.publisher,
-                                             publication_date))
+    def refresh_my_library_filter_pane(self):
+        '''
+        Clears the selections in the filter panes. The panes are filled when
+        they are shown for the first time and afterwards kept up to date by
+        :meth:`update_my_library_filter_pane`.
+        '''
+        if not self.facet_index.built:
+            self.facet_index.build()
+        for facet, name, model, count_column in self.facet_panes:
+            treeview = self.ui.get_object(name)
+            treeview.get_selection().unselect_all()
+            if not model.loaded:
+                treeview.set_model(None)
+                model.load()
+                treeview.set_model(model)
+        self.update_facet_counts()
+
+    def update_my_library_filter_pane(self, changed_models):
+        '''
+        Updates the filter panes for the given models (:class:`Paper`,
+        :class:`Author`, :class:`Source` or :class:`Organization`). Changed
+        papers only add the rows for authors, sources and organizations that
+        are new to the :class:`FacetIndex`, the numbers of papers are taken
+        from the index.
+        '''
+        if Author in changed_models:
+            self.author_filter_model.update()
+        if Author in changed_models or Organization in changed_models:
+            self.organization_filter_model.update()
+        if Source in changed_models:
+            self.source_filter_model.update()
+        if Paper in changed_models:
+            # e.g. authors and sources created by a bulk import
+            for facet, model in [('author', self.author_filter_model),
+                                 ('source', self.source_filter_model),
+                                 ('organization',
+                                  self.organization_filter_model)]:
+                new_ids = [value for value in self.facet_index.postings[facet]
+                           if not value in model.rows]
+                if new_ids:
+                    model.update(new_ids)
+            self.year_filter_model.update()
+            self.rating_filter_model.update()
+        self.update_facet_counts()
 
     def init_paper_information_pane(self):
         paper_notes = self.ui.get_object('paper_notes')
@@ -906,16 +1079,51 @@ class MainGUI:
             width = treeview.get_column(1).get_width() - 16
         treeview.get_column(1).get_cells()[0].set_property('wrap-width', width)
 
-    def handle_library_updates(self):
-        log_debug('handle_libray_updates called')
+    def handle_library_changes(self, changed_ids, removed_ids, changed_models):
+        '''
+        Called by the :class:`ChangeJournal` with the ids of the papers that
+        were added, changed or removed and the other models that changed.
+        Only the affected rows of the paper list and the filter panes are
+        updated.
+        '''
         selection = self.ui.get_object('left_pane_selection')
         liststore, row = selection.get_selected()
         self.refresh_my_library_count()
-        
-        if liststore[row][4] == 'local':
-            log_debug('handle_libray_updates on local library')
-            # Re-select to force a refresh                        
-            self.select_left_pane_item(self.ui.get_object('left_pane_selection'))
+
+        models = set(changed_models)
+        if changed_ids or removed_ids or Author in models:
+            self.coauthorship_index.invalidate()
+        if changed_ids or removed_ids:
+            self.facet_index.update_papers(changed_ids, removed_ids)
+            self.paper_key_index.update_papers(changed_ids, removed_ids)
+            models.add(Paper)
+        self.update_my_library_filter_pane(models)
+
+        if row is None or liststore[row][4] != 'local':
+            return
+        self.middle_top_pane_model.update_papers(self.get_library_paper_ids(),
+                                                 changed_ids)
+
+        paper_selection = self.ui.get_object('middle_top_pane').get_selection()
+        model, rows = paper_selection.get_selected_rows()
+        if len(rows) == 1:
+            paper = model.get_paper(rows[0].get_indices()[0])
+            if paper is not None and paper.id in changed_ids:
+                self.select_middle_top_pane_item(paper_selection)
+
+    def handle_document_updates(self, paper_ids):
+        '''
+        Called by the :class:`DocumentMonitor` when the documents of the papers
+        with the given ids appeared or disappeared.
+        '''
+        self.middle_top_pane_model.refresh_papers(paper_ids)
+        states = dict(Paper.objects.filter(id__in=paper_ids).values_list('id',
+                                                                         'has_full_text'))
+        if self.pdf_preview.displayed_paper and \
+                self.pdf_preview.displayed_paper.id in states:
+            self.pdf_preview.displayed_paper.has_full_text = \
+                states[self.pdf_preview.displayed_paper.id]
+            self.pdf_preview.refresh_pdf_preview_pane()
 
     def refresh_left_pane(self):
         log_debug('Refreshing left pane...')
@@ -989,7 +1197,7 @@ class MainGUI:
             self.ui.get_object('middle_pane_label').set_markup('<i>nothing selected</i>')
             return
         self.ui.get_object('middle_pane_label').set_markup(liststore[row][0])
-        self.middle_top_pane_model.clear()
+        self.set_middle_top_pane_papers([])
 
         button = Gtk.ToolButton(stock_id=Gtk.STOCK_ADD)
         button.set_tooltip_text('Create a new document collection...')
@@ -1056,8 +1264,12 @@ class MainGUI:
 
     def init_middle_top_pane(self):
         middle_top_pane = self.ui.get_object('middle_top_pane')
-        # We directly save Paper objects in the model
-        self.middle_top_pane_model = Gtk.ListStore(object)
+        # The model contains Paper objects, together with a PaperRow object
+        # containing the displayed information. A new model is created for
+        # every new list of papers (see set_middle_top_pane_papers)
+        self.middle_top_pane_model = PaperListModel()
+        # The column used for sorting as (attribute, descending) or None
+        self.middle_top_pane_sort = None
         middle_top_pane.set_model(self.middle_top_pane_model)
         middle_top_pane.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
         middle_top_pane.connect('button-press-event',
@@ -1074,26 +1286,21 @@ class MainGUI:
         columns['Title'].pack_start(renderer, True)
         columns['Title'].set_cell_data_func(renderer, render_paper_text_attribute, 
                                   'Title')
-        columns['Title'].set_sort_column_id(0)
-        self.middle_top_pane_model.set_sort_func(0, compare_papers, 'Title')
+        columns['Title'].connect('clicked', self.sort_middle_top_pane, 'Title')
                           
         middle_top_pane.append_column(columns['Title'])
                
-        for c_idx, attribute in enumerate(['Authors', 'Journal', 'Year',
-                                           'Created']):
+        for attribute in ['Authors', 'Journal', 'Year', 'Created']:
             columns[attribute] = Gtk.TreeViewColumn(attribute)            
             renderer = Gtk.CellRendererText()
             columns[attribute].pack_start(renderer, True)
             columns[attribute].set_cell_data_func(renderer,
                                                   render_paper_text_attribute,
                                                   attribute)
-            # We fake some column indices here that do actually not correspond
-            # to column indices in the model (the model has only one column
-            # containing the paper object). We use a custom sort function to
-            # make the sorting work
-            columns[attribute].set_sort_column_id(c_idx + 1)
-            self.middle_top_pane_model.set_sort_func(c_idx + 1, compare_papers,
-                                                     attribute)
+            # The model does not have a column per attribute, sorting is
+            # done by the model itself
+            columns[attribute].connect('clicked', self.sort_middle_top_pane,
+                                       attribute)
         
             middle_top_pane.append_column(columns[attribute])
 
@@ -1118,6 +1325,7 @@ class MainGUI:
         columns['Title'].set_expand(True)        
         columns['Authors'].set_expand(True)
         
+        self.middle_top_pane_columns = columns
         middle_top_pane.connect('row-activated', self.handle_middle_top_pane_row_activated)
         middle_top_pane.get_selection().connect('changed', self.select_middle_top_pane_item)
         middle_top_pane.enable_model_drag_source(Gdk.ModifierType.BUTTON1_MASK,
@@ -1133,6 +1341,38 @@ class MainGUI:
         middle_top_pane.drag_source_add_text_targets()        
         middle_top_pane.connect('drag-data-received', self.handle_middle_top_pane_drag_data_received_event)
 
+    def set_middle_top_pane_papers(self, paper_ids=None, sort_order=None,
+                                   papers=None):
+        '''
+        Displays the papers of the library with the given `paper_ids` or the
+        given list of ``(paper, paper_row)`` tuples `papers` in the list of
+        papers. `sort_order` is the order of `paper_ids`, if known (see
+        :class:`PaperListModel`).
+        '''
+        model = PaperListModel(paper_ids, papers, sort_order)
+        if self.middle_top_pane_sort:
+            model.sort(*self.middle_top_pane_sort)
+        self.middle_top_pane_model = model
+        self.ui.get_object('middle_top_pane').set_model(model)
+
+    def sort_middle_top_pane(self, column, attribute):
+        if self.middle_top_pane_sort == (attribute, False):
+            self.middle_top_pane_sort = (attribute, True)
+        else:
+            self.middle_top_pane_sort = (attribute, False)
+        for other_column in self.middle_top_pane_columns.values():
+            other_column.set_sort_indicator(other_column == column)
+        if self.middle_top_pane_sort[1]:
+            column.set_sort_order(Gtk.SortType.DESCENDING)
+        else:
+            column.set_sort_order(Gtk.SortType.ASCENDING)
+
+        # sort the model while it is not connected to the view
+        middle_top_pane = self.ui.get_object('middle_top_pane')
+        middle_top_pane.set_model(None)
+        self.middle_top_pane_model.sort(*self.middle_top_pane_sort)
+        middle_top_pane.set_model(self.middle_top_pane_model)
+
     def handle_middle_top_pane_row_activated(self, treeview, path, view_column):
         liststore, rows = treeview.get_selection().get_selected()
         paper = treeview.get_model().get_value(treeview.get_model().get_iter(path), 0)
@@ -1195,7 +1435,7 @@ class MainGUI:
                 treeview.set_cursor(path, col, 0)
                 paper = self.middle_top_pane_model.get_value(self.middle_top_pane_model.get_iter(path), 0)
                 menu = Gtk.Menu()
-                if paper and paper.full_text and os.path.isfile(paper.full_text.path):
+                if paper and paper.has_full_text:
                     button = Gtk.ImageMenuItem.new_from_stock(Gtk.STOCK_OPEN, None)
                     button.connect('activate', lambda x: paper.open())
                     menu.append(button)
@@ -1320,37 +1560,28 @@ class MainGUI:
         try:
             data = selection.get_data()
             if data.startswith('file://'):
-                filename = data[7:].strip() # remove trailing newline
+                # decodes the URI (remove trailing newline)
+                filename = Gio.File.new_for_uri(data.strip()).get_path()
                 content_type = importer.determine_content_type(filename)
                 if content_type == 'application/pdf':
-                    
-                    def mycallback(file_object, asyncresult, user_data):
-                        # Get the actual file content 
-                        file_content = file_object.load_contents_finish(asyncresult)[1]
-        
-                        self.document_imported(paper_data=file_content,
-                                               user_data=user_data)
-    
-                    import_documents_via_filenames([filename], mycallback)
+                    import_documents_via_filenames([filename])
                 elif content_type == 'text/x-bibtex':
-                    
-                    def mycallback(file_object, asyncresult, user_data):
-                        # Get the actual file content 
-                        file_content = file_object.load_contents_finish(asyncresult)[1]
-                        paper_info = bibtex.paper_info_from_bibtex(file_content)
-                        url = paper_info.get('import_url')
-                        if not url:
-                            url = paper_info.get('doi')
-                            if url:
-                                url = 'http://dx.doi.org/' + url            
-                        if url:
-                            importer.import_from_url(url, self.document_imported,
-                                                     paper_info=paper_info)
-                        else:
-                            self.document_imported(paper_info=paper_info)
-                    gfile = Gio.File.new_for_uri(data.strip())
-                    # first argument is the `cancellable` object
-                    gfile.load_contents_async(None, mycallback, data.strip())                                    
+                    # The entries are read from the file while importing
+                    try:
+                        bibtex_file = open(filename, 'rb')
+                    except IOError as ex:
+                        log_warn('Could not open %s: %s' % (filename, str(ex)))
+                        self.show_error_message(
+                            'Could not open <i>%s</i>: %s' %
+                            (pango_escape(filename),
+                             pango_escape(ex.strerror or str(ex))))
+                        return
+                    if not self.import_bibtex(bibtex_file,
+                                              bibtex_file.close):
+                        log_warn('No BibTeX entries found in %s' % filename)
+                        self.show_error_message('No BibTeX entries found in '
+                                                '<i>%s</i>.' %
+                                                pango_escape(filename))
             elif data.startswith('http://') or data.startswith('https://'):
                 importer.active_threads[url] = 'Importing URL'
                 importer.import_from_url(data, self.document_imported)
@@ -1451,7 +1682,7 @@ class MainGUI:
                 self.paper_information_pane_model.append(('<b>Import URL:</b>',
                                                           pango_escape(paper.import_url) ,))
             status = []
-            if paper and paper.full_text and os.path.isfile(paper.full_text.path):
+            if paper and paper.has_full_text:
                 status.append('Full text saved in local library.')
                 button = Gtk.ToolButton(stock_id=Gtk.STOCK_OPEN)
                 button.set_tooltip_text('Open the full text of this paper in a new window...')
@@ -1508,7 +1739,7 @@ class MainGUI:
                 for i in range(0, len(references)):
                     if i == 0: col1 = '<b>References:</b>'
                     else: col1 = ''
-                    if references[i].url_from_referencing_paper and not references[i].referenced_paper:
+                    if references[i].url_from_referencing_paper and not references[i].referenced_paper_id:
                         importable_references.add(references[i])
                     self.paper_information_pane_model.append((col1, '<i>' + str(i + 1) + ':</i> ' + pango_escape(references[i].line_from_referencing_paper)))
                 importable_citations = set()
@@ -1517,9 +1748,15 @@ class MainGUI:
                 for i in range(0, len(citations)):
                     if i == 0: col1 = '<b>Citations:</b>'
                     else: col1 = ''
-                    if citations[i].url_from_referenced_paper and not citations[i].referencing_paper:
+                    if citations[i].url_from_referenced_paper and not citations[i].referencing_paper_id:
                         importable_citations.add(citations[i])
                     self.paper_information_pane_model.append((col1, '<i>' + str(i + 1) + ':</i> ' + pango_escape(citations[i].line_from_referenced_paper)))
+                related = self.citation_index.related_papers(paper.id, limit=5)
+                titles = dict(Paper.objects.filter(id__in=[paper_id for paper_id, score in related]).values_list('id', 'title'))
+                for i, (paper_id, score) in enumerate(related):
+                    if i == 0: col1 = '<b>Related papers:</b>'
+                    else: col1 = ''
+                    self.paper_information_pane_model.append((col1, pango_escape(titles.get(paper_id, '')) + ' <i>(%d)</i>' % score))
 
                 self.pdf_preview.update_bookmark_pane_from_paper(paper)
 
@@ -1634,77 +1871,47 @@ class MainGUI:
 
     def graph_papers_and_authors(self, paper_ids=None):
         log_debug('paper_ids: %s' % str(paper_ids))
-        g = []
-        g.append('graph G {')
-        g.append('\toverlap=false;')
-        g.append('\tnode [shape=box,style=filled,fillcolor=lightgray,fontsize=10,fontname=loma];')
-        #g.append('\tsize ="10,10";')
+        g = Graph()
         if paper_ids:
             papers = Paper.objects.in_bulk(paper_ids).values()
         else:
             papers = Paper.objects.all()
+        papers = list(papers)
+        authors = authors_in_order_for([paper.id for paper in papers])
         for paper in papers:
-            short_title = truncate_long_str(str(paper.id) + ': ' + paper.title, max_length=32)
-            for author in paper.authors.all():
-                g.append('\t{node [shape=oval,style=filled] "%s"};' % (author.name))
-                g.append('\t"%s" -- "%s";' % (short_title, author.name))
-        g.append('}')
-        self.show_graph('\n'.join(g))
+            g.add_node(('paper', paper.id),
+                       truncate_long_str(str(paper.id) + ': ' + paper.title,
+                                         max_length=32), shape=BOX)
+            for author in authors[paper.id]:
+                g.add_node(('author', author.id), author.name)
+                g.add_edge(('paper', paper.id), ('author', author.id))
+        self.show_graph(g, 'Papers and authors')
 
     def graph_authors(self, author_ids=None):
-        g = []
-        g.append('graph G {')
-        g.append('\toverlap=false;')
-        g.append('\tnode [style=filled,fillcolor=lightgray,fontsize=10,fontname=loma];')
-        #g.append('\tsize ="10,10";')
-        if author_ids:
-            authors = Author.objects.in_bulk(author_ids).values()
-        else:
-            authors = Author.objects.all()
-        print authors
-        seen_relationships = set()
-        for a1 in authors:
-            for paper in a1.paper_set.all():
-                for a2 in paper.authors.all():
-                    if a1 != a2 and (a2.id, paper.id, a1.id) not in seen_relationships:
-                        #g.append('\t{node [shape=oval,style=filled] "%s"};' % (a.name))
-                        g.append('\t"%s" -- "%s";' % (a1.name, a2.name))
-                        seen_relationships.add((a1.id, paper.id, a2.id))
-        g.append('}')
-        self.show_graph('\n'.join(g))
+        self.show_graph(self.coauthorship_index.graph(author_ids), 'Authors')
 
     def graph_papers(self, paper_ids=None):
-        g = []
-        g.append('digraph G {')
-        g.append('\toverlap=false;')
-        g.append('\tnode [shape=box,style=filled,fillcolor=lightgray,fontsize=10,fontname=loma];')
-        #g.append('\tsize ="10,10";')
-        if paper_ids:
-            papers = Paper.objects.in_bulk(paper_ids).values()
-        else:
-            papers = Paper.objects.all()
-        for paper in papers:
-            for reference in paper.reference_set.all():
-                if reference.referenced_paper:
-                    g.append('\t"%s" -> "%s";' % (truncate_long_str(str(paper.id) + ': ' + paper.title, max_length=32), truncate_long_str(str(reference.referenced_paper.id) + ': ' + reference.referenced_paper.title, max_length=32)))
-#                elif reference.doi_from_referenced_paper:
-#                    g.append('\t"%s" -> "%s";' % (truncate_long_str(str(paper.id)+': '+paper.title, max_length=32), reference.doi_from_referenced_paper))
-#                else:
-#                    g.append('\t"%s" -> "%s";' % (truncate_long_str(str(paper.id)+': '+paper.title, max_length=32), 'R:'+str(reference.id)))
-        g.append('}')
-        self.show_graph('\n'.join(g))
-
-    def show_graph(self, graph, command='neato'):
-        import tempfile
-        file = tempfile.mktemp('.pdf')
-        stdin, stdout = os.popen4(command + ' -Tpdf -o"%s"' % file)
-        stdin.write(graph)
-        stdin.close()
-        stdout.readlines()
-        stdout.close()
-        time.sleep(.1)
-        Gtk.show_uri(None, 'file://' + file, Gdk.CURRENT_TIME)
-
+        g = Graph(directed=True)
+        edges = sorted(self.citation_index.edges(paper_ids))
+        titles = {}
+        for chunk in chunks(set(itertools.chain(*edges))):
+            titles.update(Paper.objects.filter(id__in=chunk).values_list('id', 'title'))
+        for citing, cited in edges:
+            for paper_id in (citing, cited):
+                g.add_node(paper_id,
+                           truncate_long_str(str(paper_id) + ': ' + titles.get(paper_id, ''), max_length=32),
+                           shape=BOX)
+            g.add_edge(citing, cited)
+        self.show_graph(g, 'Papers')
+
+    def show_graph(self, graph, title='Graph'):
+        '''
+        Shows the :class:`gpapers.gPapers.graph.Graph` `graph` in a new
+        window, the layout is computed in the background.
+        '''
+        window = GraphWindow(graph, title=title)
+        window.set_transient_for(self.main_window)
+        window.show_all()
 
     def delete_papers(self, paper_ids):
         '''
@@ -1772,7 +1979,7 @@ class MainGUI:
         '''
         obj = Author.objects.get(id=id)
         MainGUI.delete_object('Really delete this author?', obj,
-                           self.refresh_my_library_filter_pane())
+                           self.refresh_my_library_filter_pane)
 
     def delete_source(self, id):
         '''
@@ -1792,122 +1999,58 @@ class MainGUI:
 
     def refresh_middle_pane_from_my_library(self, refresh_library_filter_pane=True):
         try:
-            rows = []
             my_library_filter_pane = self.ui.get_object('my_library_filter_pane')
-
-            if not self.current_playlist and self.current_papers == None:
-
-                search_text = self.ui.get_object('middle_pane_search').get_text().strip()
-                if search_text:
-                    my_library_filter_pane.hide()
-                    paper_ids = set()
-                    for s in search_text.split():
-                        for paper in Paper.objects.filter(Q(title__icontains=s) | Q(doi__icontains=s) | Q(source_session__icontains=s) | Q(abstract__icontains=s) | Q(extracted_text__icontains=s)):
-                            paper_ids.add(paper.id)
-                        for sponsor in Sponsor.objects.filter(name__icontains=s):
-                            for paper in sponsor.paper_set.all(): paper_ids.add(paper.id)
-                        for author in Author.objects.filter(Q(name__icontains=s) | Q(location__icontains=s)):
-                            for paper in author.paper_set.all(): paper_ids.add(paper.id)
-                        for source in Source.objects.filter(Q(name__icontains=s) | Q(issue__icontains=s) | Q(location__icontains=s)):
-                            for paper in source.paper_set.all(): paper_ids.add(paper.id)
-                        for organization in Organization.objects.filter(Q(name__icontains=s) | Q(location__icontains=s)):
-                            for paper in organization.paper_set.all(): paper_ids.add(paper.id)
-                        for publisher in Publisher.objects.filter(name__icontains=s):
-                            for source in publisher.source_set.all():
-                                for paper in source.paper_set.all(): paper_ids.add(paper.id)
-                        for reference in Reference.objects.filter(Q(line_from_referencing_paper__icontains=s) | Q(doi_from_referencing_paper__icontains=s)):
-                            paper_ids.add(reference.referencing_paper.id)
-                        for reference in Reference.objects.filter(Q(line_from_referenced_paper__icontains=s) | Q(doi_from_referenced_paper__icontains=s)):
-                            paper_ids.add(reference.referenced_paper.id)
-                        for bookmark in Bookmark.objects.filter(notes__icontains=s):
-                            paper_ids.add(bookmark.paper.id)
-                    papers = Paper.objects.in_bulk(list(paper_ids)).values()
-                else:
-                    if refresh_library_filter_pane:
-                        self.refresh_my_library_filter_pane()
-                        my_library_filter_pane.show()
-                    paper_query = Paper.objects.order_by('title')
-
-                    filter_liststore, filter_rows = self.ui.get_object('author_filter').get_selection().get_selected_rows()
-                    q = None
-                    for treepath in filter_rows:
-                        row = filter_liststore[treepath]
-                        log_debug('row[0]: %s' % row[0])
-                        if q == None: q = Q(authors__id=row[0])
-                        else: q = q | Q(authors__id=row[0])
-                    log_debug('q: %s' % str(q))
-                    if q: paper_query = paper_query.filter(q)
-
-                    filter_liststore, filter_rows = self.ui.get_object('source_filter').get_selection().get_selected_rows()
-                    q = None
-                    for treepath in filter_rows:
-                        row = filter_liststore[treepath]
-                        if q == None: q = Q(source__id=row[0])
-                        else: q = q | Q(source__id=row[0])
-                    if q: paper_query = paper_query.filter(q)
-
-                    filter_liststore, filter_rows = self.ui.get_object('organization_filter').get_selection().get_selected_rows()
-                    q = None
-                    for treepath in filter_rows:
-                        row = filter_liststore[treepath]
-                        if q == None: q = Q(organizations__id=row[0])
-                        else: q = q | Q(organizations__id=row[0])
-                    if q: paper_query = paper_query.filter(q)
-
-                    papers = paper_query.distinct()
-
-            else:
+            search_text = self.ui.get_object('middle_pane_search').get_text().strip()
+            if (self.current_playlist or self.current_papers != None or
+                search_text):
                 my_library_filter_pane.hide()
-                if self.current_playlist:
-                    papers = self.current_playlist.get_papers_in_order()
-                elif self.current_papers != None:
-                    papers = self.current_papers
-                else:
-                    papers = []
-
-            log_debug('papers: %s' % str(papers))
-            for paper in papers:
-                authors = []
-                for author in paper.authors.order_by('id'):
-                    authors.append(unicode(author.name))
-                if paper.full_text and os.path.isfile(paper.full_text.path):
-                    icon = self.ui.get_object('middle_top_pane').render_icon(Gtk.STOCK_DND, Gtk.IconSize.MENU)
-                else:
-                    icon = None
-                if paper.source:
-                    journal = paper.source.name
-                    if paper.source.publication_date:
-                        pub_year = str(paper.source.publication_date.year)
-                    else:
-                        pub_year = ''
-                else:
-                    journal = ''
-                    pub_year = ''
-                rows.append((
-                    paper.id,
-                    pango_escape(', '.join(authors)),
-                    pango_escape(paper.title),
-                    pango_escape(journal),
-                    pub_year,
-                    (paper.rating + 10) * 5,
-                    paper.abstract,
-                    icon, # icon
-                    paper.import_url, # import_url
-                    paper.doi, # doi
-                    paper.created.strftime(DATE_FORMAT), # created
-                    paper.updated.strftime(DATE_FORMAT), # updated
-                    '', # empty_str
-                    paper.pubmed_id, # pubmed_id
-                    None,
-                    None
-                ))
-            self.middle_top_pane_model.clear()
-            for paper in papers:
-                self.middle_top_pane_model.append((paper, ))
+            elif refresh_library_filter_pane:
+                self.refresh_my_library_filter_pane()
+                my_library_filter_pane.show()
+
+            paper_ids = self.get_library_paper_ids()
+            log_debug('%d papers' % len(paper_ids))
+            self.set_middle_top_pane_papers(paper_ids,
+                                            self.get_library_sort_order())
             self.refresh_my_library_count()
         except:
             traceback.print_exc()
 
+    def get_library_paper_ids(self):
+        '''
+        Returns the ids of the papers in the currently displayed part of the
+        library: the current collection, the search results or the papers
+        matching the values selected in the filter panes.
+        '''
+        if self.current_playlist:
+            return self.current_playlist.get_paper_ids_in_order()
+        elif self.current_papers != None:
+            return list(self.current_papers.values_list('id', flat=True))
+
+        search_text = self.ui.get_object('middle_pane_search').get_text().strip()
+        if search_text:
+            return list(search.search_paper_ids(search_text))
+
+        selections = self.get_facet_selections()
+        if any(selections.values()):
+            return self.facet_index.matching_paper_ids(selections)
+        return list(Paper.objects.order_by('title').values_list('id', flat=True))
+
+    def get_library_sort_order(self):
+        '''
+        Returns the order of the papers returned by
+        :meth:`get_library_paper_ids` as ``(attribute, descending)``: by title
+        unless they are the papers of a collection or the results of a
+        full-text search (ordered by relevance). Returns ``None`` if the order
+        is not known.
+        '''
+        if self.current_playlist or self.current_papers != None:
+            return None
+        search_text = self.ui.get_object('middle_pane_search').get_text().strip()
+        if search_text and fulltext.is_available():
+            return None
+        return ('Title', False)
+
     def refresh_my_library_count(self):
         selection = self.ui.get_object('left_pane_selection')
         liststore, rows = selection.get_selected()
@@ -1950,32 +2093,24 @@ class MainGUI:
 
         log_info('Results are still wanted, processing further...')
 
+        # mark the papers that are already in the library, using one query
+        unique_key = search_provider.unique_key
+        existing_papers = find_papers_by_key(unique_key,
+                                             [info.get(unique_key)
+                                              for info in results])
         rows = []
         for info in results:
-            try:
-                unique_key = search_provider.unique_key
-                kwds = {unique_key : info.get(unique_key)}
-                existing_paper = Paper.objects.filter(**kwds)
-                if not existing_paper:
-                    raise Paper.DoesNotExist()
-                existing_paper = existing_paper[0]
-                info['id'] = existing_paper.id
-                info['created'] = existing_paper.created
-                info['updated'] = existing_paper.updated
-                if existing_paper.full_text and \
-                           os.path.isfile(existing_paper.full_text.path):
-                    info['icon'] = self.ui.get_object('middle_top_pane').\
-                                    render_icon(Gtk.STOCK_DND,
-                                    Gtk.IconSize.MENU)
-            except Paper.DoesNotExist:
-                pass
+            has_full_text = False
+            existing_paper = existing_papers.get(info.get(unique_key))
+            if existing_paper is not None:
+                (info['id'], info['created'], info['updated'],
+                 has_full_text) = existing_paper
 
             # Add information to table 
-            rows.append(row_from_dictionary(info, search_provider))
+            rows.append(row_from_dictionary(info, search_provider,
+                                            has_full_text))
 
-        self.middle_top_pane_model.clear()
-        for row in rows:
-            self.middle_top_pane_model.append(row)
+        self.set_middle_top_pane_papers(papers=rows)
 
 class PDFPreview(object):
     '''
@@ -1993,6 +2128,8 @@ class PDFPreview(object):
         self.displayed_bookmark = None
         self.notes_edited = False
         self.bookmark_edited = False
+        self.page_cache = PageCache()
+        self.bookmarks = BookmarkIndex()
         self.init_pdf_preview_pane()
         self.init_bookmark_pane()
         
@@ -2026,8 +2163,9 @@ class PDFPreview(object):
 
     def refresh_pdf_preview_pane(self):
         pdf_preview = self.ui.get_object('pdf_preview')
-        if self.displayed_paper and self.displayed_paper.full_text and os.path.isfile(self.displayed_paper.full_text.path):
-            self.pdf_preview['document'] = Poppler.Document.new_from_file ('file://' + self.displayed_paper.full_text.path, None)
+        if self.displayed_paper and self.displayed_paper.has_full_text:
+            self.pdf_preview['document'] = self.page_cache.get_document(self.displayed_paper.id,
+                                                                        self.displayed_paper.full_text.path)
             self.pdf_preview['n_pages'] = self.pdf_preview['document'].get_n_pages()
             self.pdf_preview['scale'] = None
             self.goto_pdf_page(self.pdf_preview['current_page_number'], new_doc=True)
@@ -2091,17 +2229,24 @@ class PDFPreview(object):
     def on_draw_pdf_preview(self, widget, event):
         if not self.displayed_paper or not self.pdf_preview.get('current_page'): return
         cr = widget.get_window().cairo_create()
-        cr.set_source_rgb(1, 1, 1)
         scale = self.pdf_preview['scale']
         if scale == None:
             scale = (self.ui.get_object('pdf_preview').get_parent().get_allocation().width - 2.0) / self.pdf_preview['width']
-        if scale != 1:
-            cr.scale(scale, scale)
-        cr.rectangle(0, 0, self.pdf_preview['width'], self.pdf_preview['height'])
-        cr.fill()
-        self.pdf_preview['current_page'].render(cr)
+        paper_id = self.displayed_paper.id
+        path = self.displayed_paper.full_text.path
+        page_number = self.pdf_preview['current_page_number']
+        # rendered pages are cached, the neighbouring pages are rendered in
+        # the background so that they can be shown immediately
+        surface = self.page_cache.render(paper_id, path, page_number, scale)
+        if surface is not None:
+            cr.set_source_surface(surface, 0, 0)
+            cr.paint()
+        self.page_cache.prerender(paper_id, path,
+                                  [number for number in (page_number + 1, page_number - 1)
+                                   if 0 <= number < self.pdf_preview['n_pages']],
+                                  scale)
         if self.pdf_preview.get('current_page_number') != None:
-            for bookmark in Bookmark.objects.filter(paper=self.displayed_paper, page=self.pdf_preview.get('current_page_number')):
+            for bookmark in self.bookmarks.bookmarks_on_page(self.pdf_preview.get('current_page_number')):
                 x_pos = int(bookmark.x * widget.get_allocated_width())
                 y_pos = int(bookmark.y * widget.get_allocated_height())
                 if bookmark.notes:
@@ -2121,12 +2266,9 @@ class PDFPreview(object):
         current_page_number = self.pdf_preview.get('current_page_number')
         self.current_bookmark = bookmark = None
         if self.displayed_paper and current_page_number >= 0:
-            for b in self.displayed_paper.bookmark_set.filter(paper=self.displayed_paper, page=current_page_number):
-                x_delta = x - b.x * pdf_preview.get_allocated_width()
-                y_delta = y - b.y * pdf_preview.get_allocated_height()
-                if x_delta > 0 and x_delta < 16:
-                    if y_delta > 0 and y_delta < 16:
-                        self.current_bookmark = bookmark = b
+            self.current_bookmark = bookmark = self.bookmarks.find(current_page_number, x, y,
+                                                                   pdf_preview.get_allocated_width(),
+                                                                   pdf_preview.get_allocated_height())
 
         if event.button == 1 and bookmark:
             self.select_bookmark_pane_item(None, bookmark_id=bookmark.id)
@@ -2177,6 +2319,8 @@ class PDFPreview(object):
             self.current_bookmark.x = x_percent
             self.current_bookmark.y = y_percent
             self.current_bookmark.save()
+            self.bookmarks.update(self.current_bookmark)
+            pdf_preview.queue_draw()
 
     ###########################################################################
     # Bookmarks
@@ -2209,10 +2353,11 @@ class PDFPreview(object):
         bookmark = Bookmark.objects.get(id=bookmark_id)
         bookmark.page = page
         bookmark.save()
+        self.bookmarks.update(bookmark)
 
-    def add_bookmark(self, paper, page, x, y):
+    def add_bookmark(self, paper, page, x=0.01, y=0.01):
         bookmark = Bookmark.objects.create(paper=paper, page=page, x=x, y=y)
-        bookmark.save()
+        self.bookmarks.add(bookmark)
         self.update_bookmark_pane_from_paper(self.displayed_paper)
         self.select_bookmark_pane_item(None, bookmark_id=bookmark.id)
 
@@ -2222,7 +2367,8 @@ class PDFPreview(object):
         '''
         obj = Bookmark.objects.get(id=id)
         MainGUI.delete_object('Really delete this bookmark?', obj,
-                              lambda : self.update_bookmark_pane_from_paper(self.displayed_paper))
+                              lambda : self.bookmarks.remove(id) or
+                                       self.update_bookmark_pane_from_paper(self.displayed_paper))
 
     def move_bookmark(self, bookmark, page=None, x=None, y=None):
         if bookmark:
@@ -2233,6 +2379,7 @@ class PDFPreview(object):
             if y != None:
                 bookmark.y = y
             bookmark.save()
+            self.bookmarks.update(bookmark)
             self.update_bookmark_pane_from_paper(self.displayed_paper)
 
     def handle_treeview_bookmarks_button_press_event(self, treeview, event):
@@ -2269,14 +2416,14 @@ class PDFPreview(object):
             self.displayed_paper != paper and self.notes_edited): 
             # we had another paper selected and the notes have changed, save it
             log_debug('Saving paper with notes: ' + unicode(self.displayed_paper.notes))
-            # deconnect the post_save hooks
-            post_save_receivers = post_save.receivers 
-            post_save.receivers = []
             self.displayed_paper.save()
-            post_save.receivers = post_save_receivers
             self.notes_edited = False
 
         self.displayed_paper = paper
+        if paper is None or paper.id != self.bookmarks.paper_id:
+            # the bookmarks of a paper are read once, afterwards the index is
+            # updated by add_bookmark etc.
+            self.bookmarks.load(paper)
 
         toolbar_bookmarks = self.ui.get_object('toolbar_bookmarks')
         for child in toolbar_bookmarks.get_children():
@@ -2317,7 +2464,10 @@ class PDFPreview(object):
             self.update_paper_notes_handler_id = None
 
         if selected_bookmark_id != -1:
-                bookmark = Bookmark.objects.get(id=selected_bookmark_id)
+                # use the object from the index, so that the preview shows
+                # the edited notes
+                bookmark = (self.bookmarks.get(selected_bookmark_id) or
+                            Bookmark.objects.get(id=selected_bookmark_id))
                 if bookmark != self.displayed_bookmark and self.bookmark_edited:
                     # we changed from an edited bookmark, save the bookmark
                     bookmark.save()                    
@@ -2339,7 +2489,7 @@ class PDFPreview(object):
         if self.displayed_paper:
             button = Gtk.ToolButton(stock_id=Gtk.STOCK_ADD)
             button.set_tooltip_text('Add a new page note...')
-            button.connect('clicked', lambda x, paper: Bookmark.objects.create(paper=paper, page=self.pdf_preview['current_page_number']).save() or self.update_bookmark_pane_from_paper(self.displayed_paper), self.displayed_paper)
+            button.connect('clicked', lambda x, paper: self.add_bookmark(paper, self.pdf_preview['current_page_number']), self.displayed_paper)
             button.show()
             toolbar_bookmarks.insert(button, -1)
 
@@ -2808,13 +2958,20 @@ class PaperEditGUI:
         self.edit_dialog.show()
 
     def toolbutton_refresh_extracted_text_from_pdf(self):
-        if self.paper.full_text:
-            fp = open(self.paper.full_text.path, 'rb')
-            paper_info = pdf_file.get_paper_info_from_pdf(fp.read())
-            fp.close()
-        self.paper.extracted_text = paper_info.get('extracted_text')
-        self.ui.get_object('textview_extracted_text').get_buffer().set_text(self.paper.extracted_text)
-        self.paper.save()
+        if not self.paper.full_text:
+            return
+
+        def pdf_info_extracted(paper_info):
+            self.paper.extracted_text = paper_info.get('extracted_text')
+            self.ui.get_object('textview_extracted_text').get_buffer().set_text(self.paper.extracted_text)
+            self.paper.save()
+
+        job_id = main_gui.extraction_service.submit(pdf_info_extracted,
+                                                    filename=self.paper.full_text.path)
+        if job_id is None:
+            main_gui.show_error_message('Too many documents are waiting for '
+                                        'the text extraction, please try '
+                                        'again later.')
 
     def init_references_tab(self):
         treeview_references = self.ui.get_object('treeview_references')
@@ -2836,7 +2993,7 @@ class PaperEditGUI:
         treeview_references.connect('button-press-event', self.handle_references_button_press_event)
         references = self.paper.reference_set.order_by('id')
         for i in range(0, len(references)):
-            if references[i].referenced_paper and references[i].referenced_paper.full_text and os.path.isfile(references[i].referenced_paper.full_text.path):
+            if references[i].referenced_paper and references[i].referenced_paper.has_full_text:
                 icon = treeview_references.render_icon(Gtk.STOCK_DND, Gtk.IconSize.MENU)
             else:
                 icon = None
@@ -2870,7 +3027,7 @@ class PaperEditGUI:
         treeview_citations.connect('button-press-event', self.handle_citations_button_press_event)
         references = self.paper.citation_set.order_by('id')
         for i in range(0, len(references)):
-            if references[i].referencing_paper and references[i].referencing_paper.full_text and os.path.isfile(references[i].referencing_paper.full_text.path):
+            if references[i].referencing_paper and references[i].referencing_paper.has_full_text:
                 icon = treeview_citations.render_icon(Gtk.STOCK_DND, Gtk.IconSize.MENU)
             else:
                 icon = None
@@ -2965,7 +3122,7 @@ class PaperEditGUI:
                 if id >= 0:
                     reference = Reference.objects.get(id=id)
                     menu = Gtk.Menu()
-                    if reference.referenced_paper and reference.referenced_paper.full_text and os.path.isfile(reference.referenced_paper.full_text.path):
+                    if reference.referenced_paper and reference.referenced_paper.has_full_text:
                         menu_item = Gtk.ImageMenuItem.new_from_stock(Gtk.STOCK_OPEN, None)
                         menu_item.connect('activate', lambda x: reference.referenced_paper.open())
                         menu.append(menu_item)
@@ -2990,7 +3147,7 @@ class PaperEditGUI:
                 if id >= 0:
                     reference = Reference.objects.get(id=id)
                     menu = Gtk.Menu()
-                    if reference.referencing_paper and reference.referencing_paper.full_text and os.path.isfile(reference.referencing_paper.full_text.path):
+                    if reference.referencing_paper and reference.referencing_paper.has_full_text:
                         menu_item = Gtk.ImageMenuItem.new_from_stock(Gtk.STOCK_OPEN, None)
                         menu_item.connect('activate', lambda x: reference.referenced_paper.open())
                         menu.append(menu_item)
@@ -3025,6 +3182,10 @@ class PaperEditGUI:
 def init_db():
     from django.core import management
     management.call_command('syncdb', verbosity=0, interactive=False)
+    schema.upgrade_schema()
+    sync_has_full_text()
+    fill_full_text_sizes()
+    fulltext.init_index()
 
 
 def main(argv):
@@ -0,0 +1,129 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+An in-memory index of the bookmarks of the paper shown in the PDF preview,
+so that drawing a page or clicking on it does not need a database query.
+'''
+
+from gpapers.gPapers.models import Bookmark
+
+# The number of grid cells per page dimension used for the hit-testing
+GRID_SIZE = 32
+
+
+def _cell(bookmark):
+    return (int(bookmark.x * GRID_SIZE), int(bookmark.y * GRID_SIZE))
+
+
+class BookmarkIndex(object):
+    '''
+    The bookmarks of one paper by page. Within a page, the bookmarks are
+    stored in a grid of :data:`GRID_SIZE` x :data:`GRID_SIZE` cells (their
+    positions are relative to the page size), so that :meth:`find` only has
+    to look at the bookmarks close to the given position.
+
+    The index is filled with :meth:`load`, changes to the bookmarks have to be
+    reported with :meth:`add`, :meth:`update` and :meth:`remove`.
+    '''
+
+    def __init__(self):
+        self.paper_id = None
+        # page -> cell -> list of bookmarks
+        self.pages = {}
+        # bookmark id -> (page, cell)
+        self.locations = {}
+
+    def load(self, paper):
+        '''
+        Reads the bookmarks of `paper` (or removes all bookmarks if it is
+        ``None``).
+        '''
+        self.pages = {}
+        self.locations = {}
+        if paper is None:
+            self.paper_id = None
+            return
+        self.paper_id = paper.id
+        for bookmark in Bookmark.objects.filter(paper=paper):
+            self.add(bookmark)
+
+    def add(self, bookmark):
+        location = (bookmark.page, _cell(bookmark))
+        self.locations[bookmark.id] = location
+        cells = self.pages.setdefault(location[0], {})
+        cells.setdefault(location[1], []).append(bookmark)
+
+    def remove(self, bookmark_id):
+        location = self.locations.pop(bookmark_id, None)
+        if location is None:
+            return
+        page, cell = location
+        cells = self.pages[page]
+        cells[cell] = [bookmark for bookmark in cells[cell]
+                       if bookmark.id != bookmark_id]
+        if not cells[cell]:
+            del cells[cell]
+            if not cells:
+                del self.pages[page]
+
+    def update(self, bookmark):
+        '''
+        Moves `bookmark` to its current page and position.
+        '''
+        self.remove(bookmark.id)
+        self.add(bookmark)
+
+    def get(self, bookmark_id):
+        '''
+        Returns the bookmark object with the given id or ``None``.
+        '''
+        location = self.locations.get(bookmark_id)
+        if location is None:
+            return None
+        page, cell = location
+        for bookmark in self.pages[page][cell]:
+            if bookmark.id == bookmark_id:
+                return bookmark
+
+    def bookmarks_on_page(self, page):
+        return [bookmark for bookmarks in self.pages.get(page, {}).values()
+                for bookmark in bookmarks]
+
+    def find(self, page, x, y, width, height, icon_size=16):
+        '''
+        Returns the bookmark whose icon (`icon_size` pixels large, with its
+        top left corner at the bookmark position) contains the point `x`,
+        `y` of the page shown with `width` x `height` pixels, or ``None``.
+        '''
+        cells = self.pages.get(page)
+        if not cells or width <= 0 or height <= 0:
+            return None
+        found = None
+        # the cells that contain positions up to one icon left/above the point
+        for cell_x in xrange(int((x - icon_size) * GRID_SIZE / width),
+                             int(x * GRID_SIZE / width) + 1):
+            for cell_y in xrange(int((y - icon_size) * GRID_SIZE / height),
+                                 int(y * GRID_SIZE / height) + 1):
+                for bookmark in cells.get((cell_x, cell_y), ()):
+                    x_delta = x - bookmark.x * width
+                    y_delta = y - bookmark.y * height
+                    if 0 < x_delta < icon_size and 0 < y_delta < icon_size:
+                        found = bookmark
+        return found
@@ -0,0 +1,162 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Collects the changes to the papers in the library. Instead of reacting to
+every single save, the user interface is notified once per iteration of the
+main loop with the ids of all papers that were added, changed or removed in
+the meantime -- saving a paper several times or importing many papers at
+once leads to a single notification.
+'''
+
+from django.db.models.signals import (post_save, pre_delete, post_delete,
+                                      m2m_changed)
+from gi.repository import GObject
+
+from gpapers.gPapers.models import (Author, Organization, Paper, Playlist,
+                                    Source, library_changed)
+from gpapers.logger import log_debug
+
+
+class ChangeJournal(object):
+    '''
+    Calls ``callback(changed_ids, removed_ids, changed_models)`` from an
+    idle callback after the library has been changed. `changed_ids` and
+    `removed_ids` are sets of paper ids: new papers are part of
+    `changed_ids`, a paper that was changed and removed afterwards is only
+    part of `removed_ids`. Changes to authors, sources, the authors of a
+    paper and the papers in a collection are reported as changes of the
+    affected papers. `changed_models` is the set of the classes
+    (:class:`Author`, :class:`Source` or :class:`Organization`) of which
+    objects were created, changed or deleted; changes to the organizations
+    of an author count as a change of :class:`Organization`.
+    '''
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.changed = set()
+        self.removed = set()
+        self.models = set()
+        self.idle_id = None
+
+    def _connections(self):
+        return [(post_save, self.paper_saved, Paper),
+                (post_delete, self.paper_deleted, Paper),
+                (post_save, self.related_saved, Author),
+                (post_save, self.related_saved, Source),
+                (post_save, self.related_saved, Organization),
+                (pre_delete, self.related_deleting, Author),
+                (pre_delete, self.related_deleting, Organization),
+                (post_delete, self.related_deleted, Author),
+                (post_delete, self.related_deleted, Source),
+                (post_delete, self.related_deleted, Organization),
+                (m2m_changed, self.relation_changed, Paper.authors.through),
+                (m2m_changed, self.relation_changed, Playlist.papers.through),
+                (m2m_changed, self.organizations_changed,
+                 Author.organizations.through),
+                (library_changed, self.library_changed, Paper)]
+
+    def start(self):
+        for signal, receiver, sender in self._connections():
+            signal.connect(receiver, sender=sender, weak=False)
+
+    def stop(self):
+        '''
+        Stops following the changes, changes that have not been reported yet
+        are reported immediately.
+        '''
+        for signal, receiver, sender in self._connections():
+            signal.disconnect(receiver, sender=sender)
+        if self.idle_id is not None:
+            GObject.source_remove(self.idle_id)
+            self.flush()
+
+    def add_changes(self, changed=(), removed=(), models=()):
+        '''
+        Records changes to the papers with the given ids and to objects of
+        the given `models`, the callback is called once all pending events
+        are handled.
+        '''
+        self.changed.update(changed)
+        self.removed.update(removed)
+        self.models.update(models)
+        if self.idle_id is None:
+            self.idle_id = GObject.idle_add(self.flush)
+
+    def flush(self):
+        self.idle_id = None
+        changed = self.changed - self.removed
+        removed = self.removed
+        models = self.models
+        self.changed = set()
+        self.removed = set()
+        self.models = set()
+        if changed or removed or models:
+            log_debug('Library changes: %d changed, %d removed papers' %
+                      (len(changed), len(removed)))
+            self.callback(changed, removed, models)
+        return False  # do not call again
+
+    # Signal receivers
+
+    def paper_saved(self, sender, instance, **kwargs):
+        self.add_changes(changed=[instance.id])
+
+    def paper_deleted(self, sender, instance, **kwargs):
+        self.add_changes(removed=[instance.id])
+
+    def related_saved(self, sender, instance, created, **kwargs):
+        if created:
+            self.add_changes(models=[sender])
+        else:
+            self.add_changes(changed=instance.paper_set.values_list('id',
+                                                                    flat=True),
+                             models=[sender])
+
+    def related_deleting(self, sender, instance, **kwargs):
+        # the papers stay in the library but lose their author/organization
+        self.add_changes(changed=instance.paper_set.values_list('id',
+                                                                flat=True))
+
+    def related_deleted(self, sender, instance, **kwargs):
+        self.add_changes(models=[sender])
+
+    def relation_changed(self, sender, instance, action, reverse, pk_set,
+                         **kwargs):
+        if isinstance(instance, Paper):
+            if action.startswith('post_'):
+                self.add_changes(changed=[instance.id])
+        elif action == 'pre_clear':
+            # the papers of an author or a collection are about to be
+            # removed, remember them
+            if isinstance(instance, Playlist):
+                papers = instance.papers
+            else:
+                papers = instance.paper_set
+            self.add_changes(changed=papers.values_list('id', flat=True))
+        elif action.startswith('post_') and pk_set:
+            self.add_changes(changed=pk_set)
+
+    def organizations_changed(self, sender, action, **kwargs):
+        # changes the number of authors of the organizations
+        if action.startswith('post_'):
+            self.add_changes(models=[Organization])
+
+    def library_changed(self, sender, paper_ids, **kwargs):
+        self.add_changes(changed=paper_ids)
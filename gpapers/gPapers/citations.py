@@ -0,0 +1,324 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+The citation graph of the library, i.e. the references between papers in the
+library. :class:`CitationIndex` reads all references with a single query and
+stores the graph in compressed sparse row (CSR) arrays: for every paper, the
+papers it cites (and the papers citing it) are stored contiguously in one
+array, starting at the offset stored for the paper. Saved and deleted
+references are applied to the index without reading the graph again.
+'''
+
+from array import array
+from collections import deque
+
+from django.db.models.signals import post_save, post_delete
+
+from gpapers.gPapers.models import Reference
+from gpapers.logger import log_debug
+
+# Changed references are kept outside of the arrays until there are this many
+# (or more than a tenth of all references), then the arrays are rebuilt
+MIN_REBUILD_CHANGES = 1000
+
+
+def _csr(count, edges):
+    '''
+    Returns the offsets and the ``(reference id, target)`` arrays for the
+    `edges` (``(reference id, source, target)`` tuples with source and target
+    between 0 and `count`), sorted by source.
+    '''
+    offsets = array('l', [0] * (count + 1))
+    for _, source, _ in edges:
+        offsets[source + 1] += 1
+    for index in xrange(count):
+        offsets[index + 1] += offsets[index]
+    reference_ids = array('l', [0] * len(edges))
+    targets = array('l', [0] * len(edges))
+    position = array('l', offsets[:-1])
+    for reference_id, source, target in edges:
+        reference_ids[position[source]] = reference_id
+        targets[position[source]] = target
+        position[source] += 1
+    return offsets, reference_ids, targets
+
+
+class CitationIndex(object):
+    '''
+    The references between papers of the library (references without a
+    referencing or referenced paper are ignored). The index is built with
+    :meth:`build` (methods that need it build it when necessary); after
+    :meth:`start` has been called, it follows the changes to
+    :class:`gpapers.gPapers.models.Reference` objects.
+
+    All methods take and return paper ids.
+    '''
+
+    def __init__(self):
+        self.built = False
+        # reference id -> (citing paper id, cited paper id)
+        self.references = {}
+        # paper id <-> index in the arrays
+        self.paper_ids = []
+        self.indices = {}
+        # CSR arrays for the outgoing (references) and incoming (citations)
+        # edges
+        self.out_offsets = self.out_reference_ids = self.out_targets = None
+        self.in_offsets = self.in_reference_ids = self.in_targets = None
+        # changes since the arrays were built: references whose entries in
+        # the arrays are no longer valid and new entries per paper id
+        self.stale = set()
+        self.extra_references = {}
+        self.extra_citations = {}
+        self.extra_count = 0
+
+    def start(self):
+        post_save.connect(self.reference_saved, sender=Reference, weak=False)
+        post_delete.connect(self.reference_deleted, sender=Reference,
+                            weak=False)
+
+    def stop(self):
+        post_save.disconnect(self.reference_saved, sender=Reference)
+        post_delete.disconnect(self.reference_deleted, sender=Reference)
+
+    def build(self):
+        '''
+        Reads all references between papers of the library.
+        '''
+        self.references = dict([(reference_id, (citing, cited))
+                                for reference_id, citing, cited in
+                                Reference.objects.filter(
+                                    referencing_paper__isnull=False,
+                                    referenced_paper__isnull=False
+                                ).values_list('id', 'referencing_paper',
+                                              'referenced_paper')])
+        self.compact()
+        self.built = True
+        log_debug('Built citation index with %d references between %d '
+                  'papers' % (len(self.references), len(self.paper_ids)))
+
+    def compact(self):
+        '''
+        Rebuilds the arrays from the current references.
+        '''
+        paper_ids = set()
+        for citing, cited in self.references.itervalues():
+            paper_ids.add(citing)
+            paper_ids.add(cited)
+        self.paper_ids = sorted(paper_ids)
+        self.indices = dict([(paper_id, index) for index, paper_id
+                             in enumerate(self.paper_ids)])
+        indices = self.indices
+        edges = [(reference_id, indices[citing], indices[cited])
+                 for reference_id, (citing, cited)
+                 in self.references.iteritems()]
+        (self.out_offsets, self.out_reference_ids,
+         self.out_targets) = _csr(len(self.paper_ids), edges)
+        (self.in_offsets, self.in_reference_ids,
+         self.in_targets) = _csr(len(self.paper_ids),
+                                 [(reference_id, cited, citing)
+                                  for reference_id, citing, cited in edges])
+        self.stale = set()
+        self.extra_references = {}
+        self.extra_citations = {}
+        self.extra_count = 0
+
+    def ensure_built(self):
+        if not self.built:
+            self.build()
+
+    # Incremental updates
+
+    def remove_reference(self, reference_id):
+        edge = self.references.pop(reference_id, None)
+        if edge is None:
+            return
+        citing, cited = edge
+        extra = self.extra_references.get(citing, [])
+        if (reference_id, cited) in extra:
+            extra.remove((reference_id, cited))
+            self.extra_citations[cited].remove((reference_id, citing))
+            self.extra_count -= 1
+        else:
+            self.stale.add(reference_id)
+
+    def add_reference(self, reference_id, citing, cited):
+        self.remove_reference(reference_id)
+        if citing is None or cited is None:
+            return
+        self.references[reference_id] = (citing, cited)
+        self.extra_references.setdefault(citing, []).append((reference_id,
+                                                             cited))
+        self.extra_citations.setdefault(cited, []).append((reference_id,
+                                                           citing))
+        self.extra_count += 1
+        if len(self.stale) + self.extra_count > \
+                max(MIN_REBUILD_CHANGES, len(self.references) / 10):
+            self.compact()
+
+    def add_references(self, references):
+        '''
+        Adds `references` that were stored without sending signals (see
+        :func:`gpapers.gPapers.resolver.store_references`).
+        '''
+        if self.built:
+            for reference in references:
+                self.add_reference(reference.id,
+                                   reference.referencing_paper_id,
+                                   reference.referenced_paper_id)
+
+    def reference_saved(self, sender, instance, **kwargs):
+        if self.built:
+            self.add_reference(instance.id, instance.referencing_paper_id,
+                               instance.referenced_paper_id)
+
+    def reference_deleted(self, sender, instance, **kwargs):
+        if self.built:
+            self.remove_reference(instance.id)
+
+    # Queries
+
+    def _neighbours(self, paper_id, offsets, reference_ids, targets, extra):
+        result = [other for _, other in extra.get(paper_id, ())]
+        index = self.indices.get(paper_id)
+        if index is None:
+            return result
+        paper_ids, stale = self.paper_ids, self.stale
+        for position in xrange(offsets[index], offsets[index + 1]):
+            if not stale or not reference_ids[position] in stale:
+                result.append(paper_ids[targets[position]])
+        return result
+
+    def cited_papers(self, paper_id):
+        '''
+        Returns the ids of the papers cited by the paper `paper_id` (once
+        for every reference).
+        '''
+        self.ensure_built()
+        return self._neighbours(paper_id, self.out_offsets,
+                                self.out_reference_ids, self.out_targets,
+                                self.extra_references)
+
+    def citing_papers(self, paper_id):
+        '''
+        Returns the ids of the papers citing the paper `paper_id` (once for
+        every reference).
+        '''
+        self.ensure_built()
+        return self._neighbours(paper_id, self.in_offsets,
+                                self.in_reference_ids, self.in_targets,
+                                self.extra_citations)
+
+    def neighbourhood(self, paper_ids, hops=1, references=True,
+                      citations=True):
+        '''
+        Returns a dictionary mapping the ids of all papers that can be reached
+        from the papers with `paper_ids` in at most `hops` steps to their
+        distance. Steps follow references (to cited papers) and/or citations
+        (to citing papers).
+        '''
+        self.ensure_built()
+        distances = dict([(paper_id, 0) for paper_id in paper_ids])
+        queue = deque(distances)
+        while queue:
+            paper_id = queue.popleft()
+            distance = distances[paper_id]
+            if distance >= hops:
+                continue
+            neighbours = []
+            if references:
+                neighbours.extend(self.cited_papers(paper_id))
+            if citations:
+                neighbours.extend(self.citing_papers(paper_id))
+            for neighbour in neighbours:
+                if not neighbour in distances:
+                    distances[neighbour] = distance + 1
+                    queue.append(neighbour)
+        return distances
+
+    def edges(self, paper_ids=None):
+        '''
+        Returns the ``(citing paper id, cited paper id)`` pairs (without
+        duplicates) of all references, or only of those made by the papers
+        with `paper_ids`.
+        '''
+        self.ensure_built()
+        if paper_ids is None:
+            return set(self.references.itervalues())
+        return set([(paper_id, cited) for paper_id in paper_ids
+                    for cited in self.cited_papers(paper_id)])
+
+    def degrees(self, citations=True):
+        '''
+        Returns a dictionary mapping paper ids to the number of papers citing
+        them (or cited by them, if `citations` is ``False``).
+        '''
+        self.ensure_built()
+        degrees = {}
+        for citing, cited in self.references.itervalues():
+            paper_id = cited if citations else citing
+            degrees[paper_id] = degrees.get(paper_id, 0) + 1
+        return degrees
+
+    def ranking(self, citations=True, limit=None):
+        '''
+        Returns ``(paper id, degree)`` tuples for the most cited papers (or
+        the papers with the most references), see :meth:`degrees`.
+        '''
+        ranked = sorted(self.degrees(citations).iteritems(),
+                        key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit is not None else ranked
+
+    def cocitation(self, paper_id):
+        '''
+        Returns a dictionary mapping paper ids to the number of papers that
+        cite them together with the paper `paper_id`.
+        '''
+        scores = {}
+        for citing in set(self.citing_papers(paper_id)):
+            for cited in set(self.cited_papers(citing)):
+                if cited != paper_id:
+                    scores[cited] = scores.get(cited, 0) + 1
+        return scores
+
+    def coupling(self, paper_id):
+        '''
+        Returns a dictionary mapping paper ids to the number of papers they
+        cite together with the paper `paper_id` (bibliographic coupling).
+        '''
+        scores = {}
+        for cited in set(self.cited_papers(paper_id)):
+            for citing in set(self.citing_papers(cited)):
+                if citing != paper_id:
+                    scores[citing] = scores.get(citing, 0) + 1
+        return scores
+
+    def related_papers(self, paper_id, limit=10):
+        '''
+        Returns ``(paper id, score)`` tuples for the papers most related to
+        the paper `paper_id`, the score is the sum of the co-citation and the
+        bibliographic coupling counts.
+        '''
+        scores = self.cocitation(paper_id)
+        for other, score in self.coupling(paper_id).iteritems():
+            scores[other] = scores.get(other, 0) + score
+        ranked = sorted(scores.iteritems(),
+                        key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
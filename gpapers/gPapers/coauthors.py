@@ -0,0 +1,98 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+The co-authorship relation between the authors in the library, used for the
+author graph. All pairs of authors with joint papers are read with a single
+self-join of the paper/author table and kept until the library changes.
+'''
+
+from django.db import connection
+
+from gpapers.gPapers.graph import Graph
+from gpapers.gPapers.models import Author, Paper
+from gpapers.logger import log_debug
+
+
+def coauthorship_edges():
+    '''
+    Returns a list of ``(author id, author id, number of joint papers)``
+    tuples for all pairs of authors that have written a paper together, the
+    smaller author id comes first.
+    '''
+    table = Paper.authors.through._meta.db_table
+    cursor = connection.cursor()
+    cursor.execute('SELECT a.author_id, b.author_id, COUNT(*) '
+                   'FROM %s a JOIN %s b ON a.paper_id = b.paper_id '
+                   'AND a.author_id < b.author_id '
+                   'GROUP BY a.author_id, b.author_id;' % (table, table))
+    return cursor.fetchall()
+
+
+class CoauthorshipIndex(object):
+    '''
+    Caches the result of :func:`coauthorship_edges` and the names of all
+    authors. :meth:`invalidate` has to be called when papers or authors
+    change, the data is read again when it is needed the next time.
+    '''
+
+    def __init__(self):
+        self.edges = None
+        # author id -> list of (co-author id, number of joint papers)
+        self.coauthors = None
+        self.names = None
+
+    def invalidate(self):
+        self.edges = self.coauthors = self.names = None
+
+    def load(self):
+        if self.edges is not None:
+            return
+        self.edges = coauthorship_edges()
+        self.coauthors = {}
+        for author1, author2, weight in self.edges:
+            self.coauthors.setdefault(author1, []).append((author2, weight))
+            self.coauthors.setdefault(author2, []).append((author1, weight))
+        self.names = dict(Author.objects.values_list('id', 'name'))
+        log_debug('Read %d co-authorships of %d authors' % (len(self.edges),
+                                                           len(self.names)))
+
+    def graph(self, author_ids=None):
+        '''
+        Returns a :class:`gpapers.gPapers.graph.Graph` of the authors with
+        the given ids and their co-authors or, without `author_ids`, of all
+        authors with co-authors. The edges are weighted with the number of
+        joint papers.
+        '''
+        self.load()
+        g = Graph()
+        if author_ids is None:
+            for author1, author2, weight in self.edges:
+                g.add_node(author1, self.names.get(author1, ''))
+                g.add_node(author2, self.names.get(author2, ''))
+                g.add_edge(author1, author2, weight)
+            return g
+        for author_id in author_ids:
+            if not author_id in self.names:
+                continue
+            g.add_node(author_id, self.names[author_id])
+            for other, weight in self.coauthors.get(author_id, ()):
+                g.add_node(other, self.names.get(other, ''))
+                g.add_edge(author_id, other, weight)
+        return g
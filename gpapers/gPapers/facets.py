@@ -0,0 +1,187 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Faceted filtering of the library. :class:`FacetIndex` keeps, for every facet
+(author, source, organization, year and rating), the set of paper ids for
+each value in memory. Selected values are combined with "or" within a facet
+and with "and" between facets, the number of matching papers for every value
+is computed from these sets without querying the database.
+'''
+
+from gpapers.gPapers.models import Paper, chunks
+from gpapers.logger import log_debug
+
+FACETS = ('author', 'source', 'organization', 'year', 'rating')
+
+# The value used for papers without a known year
+UNKNOWN_YEAR = 0
+
+
+class FacetIndex(object):
+    '''
+    The facet values of all papers in the library. The index is built with
+    :meth:`build` and kept up to date by calling :meth:`update_papers` with
+    the ids of changed papers.
+
+    Selections are given as a dictionary mapping facet names (see
+    :data:`FACETS`) to sets of selected values (ids for authors, sources and
+    organizations, the year or :data:`UNKNOWN_YEAR`, the rating).
+    '''
+
+    def __init__(self):
+        self.built = False
+        # facet -> value -> set of paper ids
+        self.postings = dict([(facet, {}) for facet in FACETS])
+        # facet -> paper id -> tuple of values
+        self.values = dict([(facet, {}) for facet in FACETS])
+        # paper id -> title, for sorting the results
+        self.titles = {}
+        # facet -> value -> number of papers, computed when needed
+        self.totals = {}
+
+    def build(self):
+        '''
+        Reads the facet values of all papers, using three queries.
+        '''
+        for facet in FACETS:
+            self.postings[facet].clear()
+            self.values[facet].clear()
+        self.titles.clear()
+        self.totals.clear()
+        self._read(Paper.objects.all(), Paper.authors.through.objects.all(),
+                   Paper.organizations.through.objects.all())
+        self.built = True
+        log_debug('Built facet index for %d papers' % len(self.titles))
+
+    def _read(self, papers, paper_authors, paper_organizations):
+        values = {}
+        for paper_id, title, source_id, date, rating in papers.values_list(
+                'id', 'title', 'source', 'source__publication_date',
+                'rating'):
+            self.titles[paper_id] = title
+            values[paper_id] = {'author': [], 'organization': [],
+                                'source': [source_id] if source_id else [],
+                                'year': [date.year if date else UNKNOWN_YEAR],
+                                'rating': [rating or 0]}
+        for facet, query, field in [('author', paper_authors, 'author'),
+                                    ('organization', paper_organizations,
+                                     'organization')]:
+            for paper_id, value in query.values_list('paper', field):
+                if paper_id in values:
+                    values[paper_id][facet].append(value)
+
+        for paper_id, paper_values in values.iteritems():
+            for facet in FACETS:
+                self.values[facet][paper_id] = tuple(paper_values[facet])
+                postings = self.postings[facet]
+                for value in paper_values[facet]:
+                    if value in postings:
+                        postings[value].add(paper_id)
+                    else:
+                        postings[value] = set([paper_id])
+
+    def remove_paper(self, paper_id):
+        self.titles.pop(paper_id, None)
+        for facet in FACETS:
+            postings = self.postings[facet]
+            for value in self.values[facet].pop(paper_id, ()):
+                papers = postings.get(value)
+                if papers is not None:
+                    papers.discard(paper_id)
+                    if not papers:
+                        del postings[value]
+
+    def update_papers(self, changed_ids, removed_ids=()):
+        '''
+        Reads the facet values of the papers with `changed_ids` again (new
+        papers are added) and removes the papers with `removed_ids`. Does
+        nothing if the index has not been built.
+        '''
+        if not self.built:
+            return
+        self.totals.clear()
+        for paper_id in set(changed_ids) | set(removed_ids):
+            self.remove_paper(paper_id)
+        authors = Paper.authors.through.objects
+        organizations = Paper.organizations.through.objects
+        for chunk in chunks(set(changed_ids) - set(removed_ids)):
+            self._read(Paper.objects.filter(id__in=chunk),
+                       authors.filter(paper__in=chunk),
+                       organizations.filter(paper__in=chunk))
+
+    def matching(self, selections, exclude=None):
+        '''
+        Returns the set of ids of the papers matching the `selections`,
+        ignoring the facet `exclude`. Returns ``None`` if nothing is selected,
+        i.e. all papers match.
+        '''
+        sets = []
+        for facet, selected in selections.iteritems():
+            if facet == exclude or not selected:
+                continue
+            postings = self.postings[facet]
+            papers = set()
+            for value in selected:
+                papers.update(postings.get(value, ()))
+            sets.append(papers)
+        if not sets:
+            return None
+        sets.sort(key=len)
+        result = sets[0]
+        for papers in sets[1:]:
+            result = result.intersection(papers)
+        return result
+
+    def matching_paper_ids(self, selections):
+        '''
+        Returns the ids of the papers matching `selections`, sorted by title.
+        '''
+        result = self.matching(selections)
+        if result is None:
+            result = self.titles.keys()
+        return sorted(result, key=self.titles.get)
+
+    def counts(self, facet, selections):
+        '''
+        Returns a dictionary mapping the values of `facet` to the number of
+        papers that have this value and match the selections in all other
+        facets, values without matching papers are left out.
+        '''
+        papers = self.matching(selections, exclude=facet)
+        postings = self.postings[facet]
+        if papers is None:
+            if not facet in self.totals:
+                self.totals[facet] = dict([(value, len(paper_ids))
+                                           for value, paper_ids
+                                           in postings.iteritems()])
+            return self.totals[facet]
+        counts = {}
+        if len(papers) > len(postings):
+            # many matching papers: intersect the sets of all values
+            for value, paper_ids in postings.iteritems():
+                count = len(papers.intersection(paper_ids))
+                if count:
+                    counts[value] = count
+        else:
+            paper_values = self.values[facet]
+            for paper_id in papers:
+                for value in paper_values.get(paper_id, ()):
+                    counts[value] = counts.get(value, 0) + 1
+        return counts
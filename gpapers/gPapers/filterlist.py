@@ -0,0 +1,261 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+The models behind the author, source, organization, year and rating filter
+panes. The rows of a pane are fetched with a single query (see
+:func:`author_filter_rows` etc.) and a :class:`FilterListModel` only emits
+signals for the rows that differ from the rows it already has. The numbers of
+papers are not part of the queries, they are set from the
+:class:`gpapers.gPapers.facets.FacetIndex` with
+:meth:`FilterListModel.set_counts`.
+'''
+
+from django.db.models import Count
+from gi.repository import GObject
+from gi.repository import Gtk
+
+from gpapers.gPapers.facets import UNKNOWN_YEAR
+from gpapers.gPapers.listmodel import ListModel
+from gpapers.gPapers.models import Author, Organization, Source, chunks
+
+
+def _values(query, fields, ids):
+    '''
+    Returns the `fields` of the objects in `query`, only for the given `ids`
+    if they are not ``None``.
+    '''
+    if ids is None:
+        return list(query.values_list(*fields))
+    values = []
+    for chunk in chunks(ids):
+        values.extend(query.filter(id__in=chunk).values_list(*fields))
+    return values
+
+
+def author_filter_rows(ids=None):
+    '''
+    Returns ``(id, name, number of papers)`` for all authors (or the authors
+    with the given `ids`). The number of papers is 0, see
+    :meth:`FilterListModel.set_counts`.
+    '''
+    return [(author_id, name, 0) for author_id, name
+            in _values(Author.objects.all(), ('id', 'name'), ids)]
+
+
+def organization_filter_rows(ids=None):
+    '''
+    Returns ``(id, name, number of authors, number of papers)`` for all
+    organizations (or the organizations with the given `ids`). The number of
+    papers is 0, see :meth:`FilterListModel.set_counts`.
+    '''
+    query = Organization.objects.annotate(author_count=Count('author'))
+    return [(organization_id, name, author_count, 0)
+            for organization_id, name, author_count
+            in _values(query, ('id', 'name', 'author_count'), ids)]
+
+
+def source_filter_rows(ids=None):
+    '''
+    Returns ``(id, name, issue, location, publisher, publication date, number
+    of papers)`` for all sources (or the sources with the given `ids`). The
+    number of papers is 0, see :meth:`FilterListModel.set_counts`.
+    '''
+    rows = []
+    for (source_id, name, issue, location, publisher,
+         publication_date) in _values(Source.objects.all(),
+                                      ('id', 'name', 'issue', 'location',
+                                       'publisher__name', 'publication_date'),
+                                      ids):
+        if publication_date:
+            publication_date = publication_date.strftime('%Y-%m-%d')
+        rows.append((source_id, name, issue, location, publisher or '',
+                     publication_date or '', 0))
+    return rows
+
+
+def year_filter_rows(facet_index):
+    '''
+    Returns ``(year, label, number of papers)`` for all years in the
+    :class:`gpapers.gPapers.facets.FacetIndex` `facet_index`.
+    '''
+    return [(year, str(year) if year != UNKNOWN_YEAR else 'Unknown', count)
+            for year, count in facet_index.counts('year', {}).iteritems()]
+
+
+def rating_filter_rows(facet_index):
+    '''
+    Returns ``(rating, label, number of papers)`` for all ratings in the
+    :class:`gpapers.gPapers.facets.FacetIndex` `facet_index`.
+    '''
+    return [(rating, str(rating), count)
+            for rating, count in facet_index.counts('rating', {}).iteritems()]
+
+
+class FilterListModel(ListModel):
+    '''
+    A list model with rows given as tuples (starting with the id of the
+    object) by the function `get_rows`. `column_types` are the types of the
+    values in a row (``int`` or ``str``). The rows are sorted by the second
+    column (the name) until :meth:`sort` is called.
+
+    The model is empty until :meth:`load` is called, afterwards it is brought
+    up to date with :meth:`update`. After :meth:`set_counts` has been
+    called, :meth:`update` keeps the counts shown in its column.
+    '''
+
+    def __init__(self, get_rows, column_types):
+        ListModel.__init__(self)
+        self.get_rows = get_rows
+        self.column_types = [GObject.TYPE_INT if column_type is int
+                             else GObject.TYPE_STRING
+                             for column_type in column_types]
+        self.loaded = False
+        # the ids in the displayed order and id -> row
+        self.ids = []
+        self.rows = {}
+        self.sort_column = 1
+        self.descending = False
+        # the column set with set_counts
+        self.count_column = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_value_at(self, index, column):
+        return self.rows[self.ids[index]][column]
+
+    def get_id(self, path):
+        return self.ids[path.get_indices()[0]]
+
+    def sort_key(self, row):
+        value = row[self.sort_column]
+        if isinstance(value, basestring):
+            return value.lower()
+        return value
+
+    def load(self):
+        '''
+        Fills the model, it has to be detached from its view while loading.
+        '''
+        self.rows = dict([(row[0], tuple(row)) for row in self.get_rows()])
+        self.ids = self.rows.keys()
+        self.loaded = True
+        self.sort(self.sort_column, self.descending)
+
+    def sort(self, column, descending=False):
+        '''
+        Sorts the rows by `column`. The model has to be detached from its view
+        while it is sorted.
+        '''
+        self.sort_column = column
+        self.descending = descending
+        self.ids.sort(key=lambda row_id: self.sort_key(self.rows[row_id]),
+                      reverse=descending)
+
+    def sorted_position(self, key):
+        low, high = 0, len(self.ids)
+        while low < high:
+            middle = (low + high) // 2
+            other = self.sort_key(self.rows[self.ids[middle]])
+            if (other >= key) if self.descending else (other <= key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def keep_count(self, row):
+        '''
+        Returns `row` with the count of the existing row with the same id (if
+        there is one and :meth:`set_counts` has been called).
+        '''
+        row = tuple(row)
+        old_row = self.rows.get(row[0])
+        column = self.count_column
+        if column is None or old_row is None:
+            return row
+        return row[:column] + (old_row[column], ) + row[column + 1:]
+
+    def update(self, row_ids=None):
+        '''
+        Fetches the rows again and removes, inserts and changes only the rows
+        that differ. If `row_ids` are given, only these rows are fetched
+        (passing the ids to `get_rows`) and the other rows are left alone.
+        Does nothing if the model has not been loaded yet.
+        '''
+        if not self.loaded:
+            return
+        if row_ids is None:
+            rows = self.get_rows()
+        else:
+            row_ids = set(row_ids)
+            rows = self.get_rows(row_ids)
+        new_rows = dict([(row[0], self.keep_count(row)) for row in rows])
+
+        # Remove rows from the end, so that the earlier indices stay valid.
+        # Rows that have to move to stay sorted are removed and inserted again
+        for index in xrange(len(self.ids) - 1, -1, -1):
+            row_id = self.ids[index]
+            if row_ids is not None and not row_id in row_ids:
+                continue
+            row = new_rows.get(row_id)
+            if row is not None and (self.sort_key(row) ==
+                                    self.sort_key(self.rows[row_id])):
+                continue
+            del self.ids[index]
+            del self.rows[row_id]
+            self.row_deleted(Gtk.TreePath((index, )))
+
+        changed = []
+        for row_id, row in new_rows.iteritems():
+            if not row_id in self.rows:
+                index = self.sorted_position(self.sort_key(row))
+                self.ids.insert(index, row_id)
+                self.rows[row_id] = row
+                path = Gtk.TreePath((index, ))
+                self.row_inserted(path, self.get_iter(path))
+            elif self.rows[row_id] != row:
+                self.rows[row_id] = row
+                changed.append(row_id)
+
+        self.rows_changed(changed)
+
+    def rows_changed(self, row_ids):
+        if row_ids:
+            row_ids = set(row_ids)
+            for index, row_id in enumerate(self.ids):
+                if row_id in row_ids:
+                    path = Gtk.TreePath((index, ))
+                    self.row_changed(path, self.get_iter(path))
+
+    def set_counts(self, column, counts):
+        '''
+        Sets the values of the `column` to the values in the dictionary
+        `counts` (mapping ids to numbers, missing ids are set to 0). The
+        order of the rows is not changed, so that selected rows stay where
+        they are.
+        '''
+        self.count_column = column
+        changed = []
+        for row_id, row in self.rows.iteritems():
+            count = counts.get(row_id, 0)
+            if row[column] != count:
+                self.rows[row_id] = row[:column] + (count, ) + row[column + 1:]
+                changed.append(row_id)
+        self.rows_changed(changed)
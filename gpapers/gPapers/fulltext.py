@@ -0,0 +1,201 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Full-text index of the library, using a SQLite FTS5 virtual table.
+
+Every paper is represented by one row in the ``gPapers_paper_fts`` table (the
+rowid is the paper id), containing the text of the paper itself and of the
+objects attached to it (authors, source, notes, ...). The index is kept up to
+date by the signal handlers in :mod:`gpapers.gPapers.models`. If the SQLite
+library was compiled without FTS5 support, :func:`is_available` returns
+``False`` and the caller has to fall back to a conventional search.
+'''
+
+from django.db import connection, transaction
+from django.db.utils import DatabaseError
+
+from gpapers.logger import log_debug, log_info, log_warn
+
+FTS_TABLE = 'gPapers_paper_fts'
+
+# The indexed columns and their weight for the BM25 ranking
+FTS_COLUMNS = (('title', 10.0),
+               ('authors', 5.0),
+               ('source', 2.0),
+               ('abstract', 2.0),
+               ('notes', 1.0),
+               ('extracted_text', 1.0),
+               ('related', 1.0))
+
+# One row of the index per paper, the columns are in the order of FTS_COLUMNS
+_DOCUMENT_SELECT = '''
+SELECT p.id,
+       p.title || ' ' || p.doi || ' ' || p.source_session,
+       COALESCE((SELECT group_concat(a.name || ' ' || a.location, ' ')
+                 FROM gPapers_paper_authors pa
+                 JOIN gPapers_author a ON a.id = pa.author_id
+                 WHERE pa.paper_id = p.id), ''),
+       COALESCE((SELECT s.name || ' ' || s.issue || ' ' || s.location || ' ' ||
+                        COALESCE(pub.name, '')
+                 FROM gPapers_source s
+                 LEFT JOIN gPapers_publisher pub ON pub.id = s.publisher_id
+                 WHERE s.id = p.source_id), ''),
+       p.abstract,
+       p.notes || ' ' ||
+       COALESCE((SELECT group_concat(b.notes, ' ')
+                 FROM gPapers_bookmark b
+                 WHERE b.paper_id = p.id), ''),
+       COALESCE((SELECT t.extracted_text
+                 FROM gPapers_papertext t
+                 WHERE t.paper_id = p.id), ''),
+       COALESCE((SELECT group_concat(sp.name, ' ')
+                 FROM gPapers_paper_sponsors ps
+                 JOIN gPapers_sponsor sp ON sp.id = ps.sponsor_id
+                 WHERE ps.paper_id = p.id), '') || ' ' ||
+       COALESCE((SELECT group_concat(o.name || ' ' || o.location, ' ')
+                 FROM gPapers_paper_organizations po
+                 JOIN gPapers_organization o ON o.id = po.organization_id
+                 WHERE po.paper_id = p.id), '') || ' ' ||
+       COALESCE((SELECT group_concat(r.line_from_referencing_paper || ' ' ||
+                                     r.doi_from_referencing_paper, ' ')
+                 FROM gPapers_reference r
+                 WHERE r.referencing_paper_id = p.id), '') || ' ' ||
+       COALESCE((SELECT group_concat(r.line_from_referenced_paper || ' ' ||
+                                     r.doi_from_referenced_paper, ' ')
+                 FROM gPapers_reference r
+                 WHERE r.referenced_paper_id = p.id), '')
+FROM gPapers_paper p
+'''
+
+_available = None
+
+
+def is_available():
+    '''
+    Returns whether the full-text index can be used, i.e. whether SQLite
+    supports FTS5 and :func:`init_index` succeeded.
+    '''
+    return bool(_available)
+
+
+def init_index():
+    '''
+    Creates the full-text index table if it does not exist yet and fills it
+    with all papers if it is out of sync with the paper table (e.g. on the
+    first start after an upgrade). Should be called once after the database
+    has been created.
+    '''
+    global _available
+    cursor = connection.cursor()
+    columns = ', '.join([name for name, _ in FTS_COLUMNS])
+    try:
+        cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS %s USING '
+                       'fts5(%s, tokenize="unicode61 remove_diacritics 1");' %
+                       (FTS_TABLE, columns))
+    except DatabaseError as ex:
+        log_warn('SQLite does not support FTS5, full-text index disabled (%s)'
+                 % str(ex))
+        transaction.rollback_unless_managed()
+        _available = False
+        return
+    _available = True
+
+    cursor.execute('SELECT COUNT(*) FROM gPapers_paper;')
+    paper_count = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM %s;' % FTS_TABLE)
+    indexed_count = cursor.fetchone()[0]
+    if paper_count != indexed_count:
+        rebuild_index()
+    else:
+        transaction.commit_unless_managed()
+
+
+def rebuild_index():
+    '''
+    Rebuilds the complete full-text index from the database.
+    '''
+    if not is_available():
+        return
+    log_info('Rebuilding the full-text index')
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s;' % FTS_TABLE)
+    cursor.execute('INSERT INTO %s (rowid, %s) %s;' % (FTS_TABLE,
+                                                       ', '.join([name for name, _ in FTS_COLUMNS]),
+                                                       _DOCUMENT_SELECT))
+    transaction.commit_unless_managed()
+
+
+def index_papers(paper_ids):
+    '''
+    (Re-)indexes the papers with the given ids.
+    '''
+    paper_ids = [int(paper_id) for paper_id in paper_ids if paper_id is not None]
+    if not paper_ids or not is_available():
+        return
+    log_debug('Updating full-text index for papers %s' % str(paper_ids))
+    placeholders = ', '.join(['%s'] * len(paper_ids))
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s WHERE rowid IN (%s);' % (FTS_TABLE,
+                                                            placeholders),
+                   paper_ids)
+    cursor.execute('INSERT INTO %s (rowid, %s) %s WHERE p.id IN (%s);' %
+                   (FTS_TABLE, ', '.join([name for name, _ in FTS_COLUMNS]),
+                    _DOCUMENT_SELECT, placeholders), paper_ids)
+    transaction.commit_unless_managed()
+
+
+def unindex_paper(paper_id):
+    '''
+    Removes the paper with the given id from the full-text index.
+    '''
+    if paper_id is None or not is_available():
+        return
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s WHERE rowid = %%s;' % FTS_TABLE,
+                   [paper_id])
+    transaction.commit_unless_managed()
+
+
+def match_expression(search_text):
+    '''
+    Converts a search string as entered by the user into an FTS5 match
+    expression. Every word is quoted (so that characters like ``-`` or ``:``
+    do not have a special meaning) and used as a prefix query, all words have
+    to match.
+    '''
+    words = search_text.split()
+    return ' AND '.join(['"%s"*' % word.replace('"', '""') for word in words])
+
+
+def search(search_text):
+    '''
+    Returns the ids of all papers matching `search_text`, the best match
+    (according to the BM25 ranking) first.
+    '''
+    expression = match_expression(search_text)
+    if not expression:
+        return []
+    weights = ', '.join([str(weight) for _, weight in FTS_COLUMNS])
+    cursor = connection.cursor()
+    cursor.execute('SELECT rowid FROM %s WHERE %s MATCH %%s '
+                   'ORDER BY bm25(%s, %s);' % (FTS_TABLE, FTS_TABLE,
+                                               FTS_TABLE, weights),
+                   [expression])
+    return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,418 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Graphs of papers and authors. :class:`Graph` holds the nodes and edges and
+can be exported in the DOT format of Graphviz, :func:`layout` computes the
+positions of the nodes with a force-directed algorithm. The repulsion between
+all pairs of nodes is approximated with a Barnes-Hut quadtree, so that the
+time for one iteration grows with ``n log n`` instead of ``n**2``.
+
+This module does not depend on GTK, the layout runs in a separate process
+(see :mod:`gpapers.gPapers.graphview`).
+'''
+
+import math
+import random
+import time
+
+# Node shapes, with their names in Graphviz
+BOX = 'box'
+OVAL = 'oval'
+
+# Ratio of cell size and distance below which a cell of the quadtree is
+# treated as a single body
+THETA = 1.2
+# Strength of the force pulling all nodes towards the center, keeps
+# disconnected parts of the graph together
+GRAVITY = 0.02
+# Cells smaller than this are not split further (for nodes at the same
+# position)
+MIN_CELL_SIZE = 1e-6
+# Graphs with more nodes are coarsened for the layout, unless coarsening does
+# not reduce the number of nodes below this ratio
+COARSEST_SIZE = 100
+COARSENING_RATIO = 0.8
+
+
+def _dot_string(s):
+    return '"%s"' % unicode(s).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def edge_width(weight):
+    '''
+    The line width for an edge with the given weight.
+    '''
+    return min(1 + math.log(weight, 2), 5)
+
+
+class Graph(object):
+    '''
+    A graph with labelled nodes, `directed` states whether the edges have a
+    direction (e.g. citations). Nodes are identified by a hashable key (e.g.
+    ``('author', 1)``), adding a node or an edge twice has no effect. Edges
+    can have a weight (e.g. the number of joint papers of two authors).
+    '''
+
+    def __init__(self, directed=False):
+        self.directed = directed
+        self.labels = []
+        self.shapes = []
+        self.edges = []
+        self.weights = []
+        self.node_indices = {}
+        self.edge_set = set()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add_node(self, key, label, shape=OVAL):
+        '''
+        Adds a node and returns its index.
+        '''
+        index = self.node_indices.get(key)
+        if index is None:
+            index = self.node_indices[key] = len(self.labels)
+            self.labels.append(label)
+            self.shapes.append(shape)
+        return index
+
+    def add_edge(self, key1, key2, weight=1):
+        '''
+        Adds an edge between two nodes that have already been added.
+        '''
+        edge = (self.node_indices[key1], self.node_indices[key2])
+        if edge[0] == edge[1]:
+            return
+        if not self.directed:
+            edge = (min(edge), max(edge))
+        if not edge in self.edge_set:
+            self.edge_set.add(edge)
+            self.edges.append(edge)
+            self.weights.append(weight)
+
+    def to_dot(self):
+        '''
+        Returns the graph in the DOT language, e.g. for ``neato``.
+        '''
+        if self.directed:
+            lines = ['digraph G {']
+            connector = '->'
+        else:
+            lines = ['graph G {']
+            connector = '--'
+        lines.append('\toverlap=false;')
+        lines.append('\tnode [style=filled,fillcolor=lightgray,fontsize=10,'
+                     'fontname=loma];')
+        for index, (label, shape) in enumerate(zip(self.labels, self.shapes)):
+            lines.append('\tn%d [label=%s,shape=%s];' % (index,
+                                                        _dot_string(label),
+                                                        shape))
+        for (source, target), weight in zip(self.edges, self.weights):
+            if weight == 1:
+                lines.append('\tn%d %s n%d;' % (source, connector, target))
+            else:
+                lines.append('\tn%d %s n%d [weight=%d,penwidth=%.1f];' %
+                             (source, connector, target, weight,
+                              edge_width(weight)))
+        lines.append('}')
+        return u'\n'.join(lines)
+
+
+class QuadTree(object):
+    '''
+    A Barnes-Hut quadtree over the points given by the lists `xs` and `ys`.
+    The cells are stored in flat lists, every cell knows the number of
+    points in it and their center of mass.
+    '''
+
+    def __init__(self, xs, ys):
+        min_x, max_x = min(xs), max(xs)
+        min_y, max_y = min(ys), max(ys)
+        size = max(max_x - min_x, max_y - min_y, MIN_CELL_SIZE) * 1.0001
+        # per cell: lower left corner, size, mass, sum of the positions, the
+        # first of the four child cells (or -1) and the points of a leaf
+        self.left = [min_x]
+        self.bottom = [min_y]
+        self.size = [size]
+        self.mass = [0]
+        self.sum_x = [0.0]
+        self.sum_y = [0.0]
+        self.children = [-1]
+        self.points = [[]]
+        for index in xrange(len(xs)):
+            self.insert(index, xs[index], ys[index], xs, ys)
+        self.center_x = [sum_x / mass if mass else 0.0
+                         for sum_x, mass in zip(self.sum_x, self.mass)]
+        self.center_y = [sum_y / mass if mass else 0.0
+                         for sum_y, mass in zip(self.sum_y, self.mass)]
+        self.theta = None
+
+    def split(self, cell):
+        first = len(self.size)
+        half = self.size[cell] / 2
+        left, bottom = self.left[cell], self.bottom[cell]
+        for quadrant in xrange(4):
+            self.left.append(left + half if quadrant & 1 else left)
+            self.bottom.append(bottom + half if quadrant & 2 else bottom)
+            self.size.append(half)
+            self.mass.append(0)
+            self.sum_x.append(0.0)
+            self.sum_y.append(0.0)
+            self.children.append(-1)
+            self.points.append([])
+        self.children[cell] = first
+
+    def child(self, cell, x, y):
+        half = self.size[cell] / 2
+        quadrant = 0
+        if x >= self.left[cell] + half:
+            quadrant += 1
+        if y >= self.bottom[cell] + half:
+            quadrant += 2
+        return self.children[cell] + quadrant
+
+    def insert(self, index, x, y, xs, ys):
+        cell = 0
+        while True:
+            self.mass[cell] += 1
+            self.sum_x[cell] += x
+            self.sum_y[cell] += y
+            if self.children[cell] >= 0:
+                cell = self.child(cell, x, y)
+                continue
+            points = self.points[cell]
+            if not points or self.size[cell] < MIN_CELL_SIZE:
+                points.append(index)
+                return
+            # move the point of the leaf into a child and continue
+            other = points.pop()
+            self.split(cell)
+            other_cell = self.child(cell, xs[other], ys[other])
+            self.mass[other_cell] += 1
+            self.sum_x[other_cell] += xs[other]
+            self.sum_y[other_cell] += ys[other]
+            self.points[other_cell].append(other)
+            cell = self.child(cell, x, y)
+
+    def repulsion(self, index, x, y, strength, theta=THETA):
+        '''
+        Returns the approximate sum of the forces ``strength / distance``
+        pushing the point `index` at `x`, `y` away from all other points.
+        '''
+        if self.theta != theta:
+            self.theta = theta
+            self.limits = [size * size / (theta * theta)
+                           for size in self.size]
+        force_x = force_y = 0.0
+        center_x, center_y = self.center_x, self.center_y
+        children, limits, mass = self.children, self.limits, self.mass
+        points = self.points
+        stack = [0]
+        pop, extend = stack.pop, stack.extend
+        while stack:
+            cell = pop()
+            dx = x - center_x[cell]
+            dy = y - center_y[cell]
+            distance2 = dx * dx + dy * dy
+            first = children[cell]
+            if first >= 0:
+                if limits[cell] >= distance2:
+                    extend((first, first + 1, first + 2, first + 3))
+                    continue
+                count = mass[cell]
+            else:
+                count = mass[cell]
+                if count == 0:
+                    continue
+                if index in points[cell]:
+                    count -= 1
+                    if count == 0:
+                        continue
+                if distance2 < 1e-12:
+                    # nodes at the same position, push in a random direction
+                    angle = random.random() * 2 * math.pi
+                    dx, dy = math.cos(angle) * 1e-3, math.sin(angle) * 1e-3
+                    distance2 = 1e-6
+            factor = strength * count / distance2
+            force_x += dx * factor
+            force_y += dy * factor
+        return force_x, force_y
+
+
+def default_iterations(n):
+    '''
+    The number of iterations used for a graph with `n` nodes, large graphs
+    get fewer iterations to keep the layout time acceptable.
+    '''
+    return int(max(10, min(300, 300000 / max(n, 1))))
+
+
+def refinement_iterations(n):
+    '''
+    The number of iterations used for a level with `n` nodes that starts from
+    the positions of a coarser level.
+    '''
+    return int(max(5, min(20, 50000 / max(n, 1))))
+
+
+def coarsen(n, edges, rng=random):
+    '''
+    Merges pairs of neighbouring nodes (a maximal matching in random order).
+    Returns the index of the merged node for every node, the number of merged
+    nodes and the edges between them.
+    '''
+    neighbours = [[] for _ in xrange(n)]
+    for source, target in edges:
+        neighbours[source].append(target)
+        neighbours[target].append(source)
+    parents = [-1] * n
+    order = range(n)
+    rng.shuffle(order)
+    count = 0
+    for node in order:
+        if parents[node] >= 0:
+            continue
+        parents[node] = count
+        for other in neighbours[node]:
+            if parents[other] < 0:
+                parents[other] = count
+                break
+        count += 1
+    coarse_edges = set()
+    for source, target in edges:
+        source, target = parents[source], parents[target]
+        if source != target:
+            coarse_edges.add((min(source, target), max(source, target)))
+    return parents, count, list(coarse_edges)
+
+
+def _refine(xs, ys, edges, iterations, temperature, progress):
+    n = len(xs)
+    neighbours = [[] for _ in xrange(n)]
+    for source, target in edges:
+        neighbours[source].append(target)
+        neighbours[target].append(source)
+    for iteration in xrange(iterations):
+        tree = QuadTree(xs, ys)
+        center_x = tree.center_x[0]
+        center_y = tree.center_y[0]
+        step = temperature * (1.0 - float(iteration) / iterations)
+        new_xs = list(xs)
+        new_ys = list(ys)
+        for index in xrange(n):
+            x, y = xs[index], ys[index]
+            force_x, force_y = tree.repulsion(index, x, y, 1.0)
+            for other in neighbours[index]:
+                dx = xs[other] - x
+                dy = ys[other] - y
+                distance = math.sqrt(dx * dx + dy * dy)
+                force_x += dx * distance
+                force_y += dy * distance
+            force_x += (center_x - x) * GRAVITY
+            force_y += (center_y - y) * GRAVITY
+            length = math.sqrt(force_x * force_x + force_y * force_y)
+            if length > step:
+                force_x *= step / length
+                force_y *= step / length
+            new_xs[index] = x + force_x
+            new_ys[index] = y + force_y
+        xs[:] = new_xs
+        ys[:] = new_ys
+        if progress(n) is False:
+            return False
+    return True
+
+
+def layout(n, edges, iterations=None, callback=None, seed=None,
+           callback_interval=1.0):
+    '''
+    Computes positions for `n` nodes connected by `edges` (pairs of node
+    indices) with the Fruchterman-Reingold algorithm, using a
+    :class:`QuadTree` for the repulsive forces. Returns the lists of x and y
+    coordinates, the ideal edge length is 1.
+
+    Large graphs are laid out on several levels: the graph is repeatedly
+    :func:`coarsen`-ed, the smallest graph is laid out with many iterations
+    and every finer level starts from the positions of the coarser one, so
+    that only a few (expensive) iterations are needed for the full graph.
+    `iterations` is the number of iterations for the full graph.
+
+    If `callback` is given, it is called with the progress (between 0 and 1)
+    and the intermediate positions ``(progress, xs, ys)`` at most every
+    `callback_interval` seconds, the layout stops (and returns ``None``) if
+    it returns ``False``.
+    '''
+    if n == 0:
+        return [], []
+    rng = random.Random(seed)
+
+    levels = [(n, edges)]
+    parents = []
+    while levels[-1][0] > COARSEST_SIZE:
+        level_parents, count, level_edges = coarsen(levels[-1][0],
+                                                    levels[-1][1], rng)
+        if count > COARSENING_RATIO * levels[-1][0]:
+            break
+        parents.append(level_parents)
+        levels.append((count, level_edges))
+
+    level_iterations = [refinement_iterations(count) for count, _ in levels]
+    level_iterations[-1] = default_iterations(levels[-1][0])
+    if iterations is not None:
+        level_iterations[0] = iterations
+    total = float(sum(count * level_iterations[level]
+                      for level, (count, _) in enumerate(levels)))
+    state = {'done': 0, 'last_callback': time.time()}
+
+    side = math.sqrt(levels[-1][0])
+    xs = [rng.uniform(0, side) for _ in xrange(levels[-1][0])]
+    ys = [rng.uniform(0, side) for _ in xrange(levels[-1][0])]
+
+    for level in xrange(len(levels) - 1, -1, -1):
+        count, level_edges = levels[level]
+        if level < len(levels) - 1:
+            # place the nodes at the position of their merged node, spread
+            # out so that the density stays the same
+            scale = math.sqrt(float(count) / levels[level + 1][0])
+            xs = [xs[parent] * scale + rng.uniform(-0.5, 0.5)
+                  for parent in parents[level]]
+            ys = [ys[parent] * scale + rng.uniform(-0.5, 0.5)
+                  for parent in parents[level]]
+            temperature = math.sqrt(count) / 40.0 + 1.0
+        else:
+            temperature = side / 10.0 + 1.0
+
+        def progress(count, level=level, xs=xs, ys=ys):
+            state['done'] += count
+            if callback is None or \
+                    time.time() - state['last_callback'] < callback_interval:
+                return True
+            state['last_callback'] = time.time()
+            # the positions of all nodes, given by their merged nodes
+            all_xs, all_ys = xs, ys
+            for level_parents in reversed(parents[:level]):
+                all_xs = [all_xs[parent] for parent in level_parents]
+                all_ys = [all_ys[parent] for parent in level_parents]
+            return callback(state['done'] / total, all_xs, all_ys)
+
+        if not _refine(xs, ys, level_edges, level_iterations[level],
+                       temperature, progress):
+            return None
+    return xs, ys
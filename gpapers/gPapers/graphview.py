@@ -0,0 +1,421 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Interactive display of a :class:`gpapers.gPapers.graph.Graph`. The layout is
+computed by :class:`LayoutJob` in a separate process and
+:class:`GraphWindow` shows the intermediate positions while it is running.
+The graph can be zoomed with the scroll wheel and moved by dragging it. If
+Graphviz is installed, the graph can also be exported as a PDF document (see
+:func:`export_graphviz`).
+'''
+
+from distutils.spawn import find_executable
+import math
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import traceback
+
+from gi.repository import GObject
+from gi.repository import Gdk
+from gi.repository import Gtk
+
+from gpapers.gPapers.graph import BOX, edge_width, layout
+from gpapers.logger import log_debug, log_error
+
+# The zoom factor for one step of the scroll wheel
+ZOOM_STEP = 1.25
+# Labels are shown if there are fewer nodes on the screen or if the nodes are
+# at least this many pixels apart
+MAX_LABELS = 300
+LABEL_SCALE = 60
+# Radius of a node (in pixels) when no labels are shown
+NODE_RADIUS = 3
+FONT_SIZE = 10
+
+
+def _layout_process(connection, n, edges):
+    '''
+    Runs in the worker process, sends ``(progress, xs, ys)`` tuples for the
+    intermediate and final positions or an error message.
+    '''
+    def send_positions(progress, xs, ys):
+        connection.send((progress, xs, ys))
+    try:
+        xs, ys = layout(n, edges, callback=send_positions)
+        connection.send((1.0, xs, ys))
+    except Exception:
+        connection.send(traceback.format_exc())
+    connection.close()
+
+
+class LayoutJob(object):
+    '''
+    Computes the layout of `graph` in a separate process. For the
+    intermediate and final positions, ``callback(progress, xs, ys)`` is
+    called in the GTK main loop (`progress` is 1 for the final positions).
+    '''
+
+    def __init__(self, graph, callback, poll_interval=200):
+        self.callback = callback
+        self.connection, child_connection = multiprocessing.Pipe(False)
+        self.process = multiprocessing.Process(target=_layout_process,
+                                               args=(child_connection,
+                                                     len(graph),
+                                                     graph.edges))
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+        log_debug('Started layout of %d nodes and %d edges' %
+                  (len(graph), len(graph.edges)))
+        self.timeout_id = GObject.timeout_add(poll_interval, self.poll)
+
+    def poll(self):
+        try:
+            while self.connection.poll():
+                message = self.connection.recv()
+                if isinstance(message, basestring):
+                    log_error('Graph layout failed:\n' + message)
+                    self.finish()
+                    return False
+                progress, xs, ys = message
+                self.callback(progress, xs, ys)
+                if progress >= 1:
+                    self.finish()
+                    return False
+        except (EOFError, IOError):
+            log_error('Graph layout process ended unexpectedly')
+            self.finish()
+            return False
+        return True
+
+    def finish(self):
+        self.timeout_id = None
+        self.connection.close()
+        self.process.join()
+
+    def cancel(self):
+        '''
+        Stops the layout process if it is still running.
+        '''
+        if self.timeout_id is not None:
+            GObject.source_remove(self.timeout_id)
+            self.timeout_id = None
+            self.process.terminate()
+            self.connection.close()
+
+
+def export_graphviz(graph, command='neato'):
+    '''
+    Lays out `graph` with the Graphviz program `command` and opens the
+    resulting PDF document. Graphviz runs in the background, returns
+    ``False`` if `command` is not installed.
+    '''
+    if find_executable(command) is None:
+        return False
+    fd, filename = tempfile.mkstemp('.pdf')
+    os.close(fd)
+    process = subprocess.Popen([command, '-Tpdf', '-o', filename],
+                               stdin=subprocess.PIPE)
+    process.stdin.write(graph.to_dot().encode('utf-8'))
+    process.stdin.close()
+
+    def check_finished():
+        if process.poll() is None:
+            return True
+        if process.returncode == 0:
+            Gtk.show_uri(None, 'file://' + filename, Gdk.CURRENT_TIME)
+        else:
+            log_error('%s failed with exit code %d' % (command,
+                                                       process.returncode))
+        return False
+    GObject.timeout_add(200, check_finished)
+    return True
+
+
+class GraphCanvas(Gtk.DrawingArea):
+    '''
+    Draws a graph with the given node positions, a point ``(x, y)`` of the
+    layout is shown at ``(x * scale + offset_x, y * scale + offset_y)``.
+    Until the user zooms or moves the graph, it is scaled to fit.
+    '''
+
+    def __init__(self, graph):
+        Gtk.DrawingArea.__init__(self)
+        self.graph = graph
+        self.xs = self.ys = None
+        self.scale = 1.0
+        self.offset_x = self.offset_y = 0.0
+        self.fitted = True
+        self.drag_start = None
+        self.add_events(Gdk.EventMask.SCROLL_MASK |
+                        Gdk.EventMask.BUTTON_PRESS_MASK |
+                        Gdk.EventMask.BUTTON_RELEASE_MASK |
+                        Gdk.EventMask.POINTER_MOTION_MASK)
+        self.set_has_tooltip(True)
+        self.connect('draw', self.on_draw)
+        self.connect('size-allocate', lambda widget, allocation:
+                        self.fitted and self.fit())
+        self.connect('scroll-event', self.on_scroll)
+        self.connect('button-press-event', self.on_button_press)
+        self.connect('button-release-event', self.on_button_release)
+        self.connect('motion-notify-event', self.on_motion)
+        self.connect('query-tooltip', self.on_query_tooltip)
+
+    def set_positions(self, xs, ys):
+        self.xs, self.ys = xs, ys
+        if self.fitted:
+            self.fit()
+        self.queue_draw()
+
+    def fit(self):
+        '''
+        Scales and moves the graph so that it fills the canvas.
+        '''
+        self.fitted = True
+        if not self.xs:
+            return
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        min_x, max_x = min(self.xs), max(self.xs)
+        min_y, max_y = min(self.ys), max(self.ys)
+        # leave a margin of one unit (the ideal edge length) around the graph
+        self.scale = min(width / (max_x - min_x + 2.0),
+                         height / (max_y - min_y + 2.0))
+        self.offset_x = width / 2.0 - (min_x + max_x) / 2.0 * self.scale
+        self.offset_y = height / 2.0 - (min_y + max_y) / 2.0 * self.scale
+        self.queue_draw()
+
+    def zoom(self, factor, x, y):
+        '''
+        Zooms by `factor`, keeping the point `x`, `y` of the canvas in place.
+        '''
+        self.fitted = False
+        self.offset_x = x - (x - self.offset_x) * factor
+        self.offset_y = y - (y - self.offset_y) * factor
+        self.scale *= factor
+        self.queue_draw()
+
+    def visible_nodes(self, width, height, margin):
+        scale, offset_x, offset_y = self.scale, self.offset_x, self.offset_y
+        return [index for index, (x, y) in enumerate(zip(self.xs, self.ys))
+                if -margin < x * scale + offset_x < width + margin and
+                -margin < y * scale + offset_y < height + margin]
+
+    def find_node(self, x, y):
+        '''
+        Returns the index of the node closest to the point `x`, `y` of the
+        canvas, if it is at most a few pixels away, or ``None``.
+        '''
+        if not self.xs:
+            return None
+        x = (x - self.offset_x) / self.scale
+        y = (y - self.offset_y) / self.scale
+        max_distance2 = (2.0 * NODE_RADIUS / self.scale) ** 2
+        found = None
+        for index, (node_x, node_y) in enumerate(zip(self.xs, self.ys)):
+            distance2 = (node_x - x) ** 2 + (node_y - y) ** 2
+            if distance2 <= max_distance2:
+                found = index
+                max_distance2 = distance2
+        return found
+
+    def on_draw(self, widget, cr):
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        cr.set_source_rgb(1, 1, 1)
+        cr.paint()
+        cr.set_font_size(FONT_SIZE)
+        if not self.xs:
+            cr.set_source_rgb(0.4, 0.4, 0.4)
+            cr.move_to(10, 20)
+            if self.xs is None:
+                cr.show_text('Computing layout...')
+            else:
+                cr.show_text('Empty graph')
+            return
+
+        scale, offset_x, offset_y = self.scale, self.offset_x, self.offset_y
+        screen_xs = [x * scale + offset_x for x in self.xs]
+        screen_ys = [y * scale + offset_y for y in self.ys]
+        visible = self.visible_nodes(width, height, 100)
+        show_labels = len(visible) <= MAX_LABELS or scale >= LABEL_SCALE
+
+        # edges, leaving out those that are completely outside of the canvas,
+        # grouped by their line width
+        segments = {}
+        for (source, target), weight in zip(self.graph.edges,
+                                            self.graph.weights):
+            x1, y1 = screen_xs[source], screen_ys[source]
+            x2, y2 = screen_xs[target], screen_ys[target]
+            if (x1 < 0 and x2 < 0) or (x1 > width and x2 > width) or \
+                    (y1 < 0 and y2 < 0) or (y1 > height and y2 > height):
+                continue
+            segments.setdefault(edge_width(weight), []).append((x1, y1,
+                                                                x2, y2))
+        cr.set_source_rgb(0.6, 0.6, 0.6)
+        for line_width, lines in segments.iteritems():
+            cr.set_line_width(line_width)
+            for x1, y1, x2, y2 in lines:
+                cr.move_to(x1, y1)
+                cr.line_to(x2, y2)
+                if self.graph.directed and show_labels:
+                    self.draw_arrow_head(cr, x1, y1, x2, y2)
+            cr.stroke()
+        cr.set_line_width(1)
+
+        labels, shapes = self.graph.labels, self.graph.shapes
+        for index in visible:
+            x, y = screen_xs[index], screen_ys[index]
+            if show_labels:
+                label = labels[index]
+                extents = cr.text_extents(label)
+                half_width = extents[4] / 2.0 + 4
+                half_height = FONT_SIZE / 2.0 + 3
+                if shapes[index] == BOX:
+                    cr.rectangle(x - half_width, y - half_height,
+                                 2 * half_width, 2 * half_height)
+                else:
+                    cr.save()
+                    cr.translate(x, y)
+                    cr.scale(half_width * 1.2, half_height * 1.2)
+                    cr.arc(0, 0, 1, 0, 2 * math.pi)
+                    cr.restore()
+                cr.set_source_rgb(0.83, 0.83, 0.83)
+                cr.fill_preserve()
+                cr.set_source_rgb(0, 0, 0)
+                cr.stroke()
+                cr.move_to(x - extents[4] / 2.0, y + FONT_SIZE / 2.0 - 2)
+                cr.show_text(label)
+            elif shapes[index] == BOX:
+                cr.rectangle(x - NODE_RADIUS, y - NODE_RADIUS,
+                             2 * NODE_RADIUS, 2 * NODE_RADIUS)
+            else:
+                cr.move_to(x + NODE_RADIUS, y)
+                cr.arc(x, y, NODE_RADIUS, 0, 2 * math.pi)
+        if not show_labels:
+            cr.set_source_rgb(0.3, 0.3, 0.5)
+            cr.fill()
+
+    def draw_arrow_head(self, cr, x1, y1, x2, y2, size=8):
+        length = math.hypot(x2 - x1, y2 - y1)
+        if length < 2 * size:
+            return
+        # end the arrow a bit before the center of the target node
+        ux, uy = (x2 - x1) / length, (y2 - y1) / length
+        tip_x, tip_y = x2 - ux * FONT_SIZE, y2 - uy * FONT_SIZE
+        cr.move_to(tip_x - ux * size - uy * size / 2.0,
+                   tip_y - uy * size + ux * size / 2.0)
+        cr.line_to(tip_x, tip_y)
+        cr.line_to(tip_x - ux * size + uy * size / 2.0,
+                   tip_y - uy * size - ux * size / 2.0)
+
+    def on_scroll(self, widget, event):
+        if event.direction == Gdk.ScrollDirection.UP:
+            self.zoom(ZOOM_STEP, event.x, event.y)
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            self.zoom(1 / ZOOM_STEP, event.x, event.y)
+        return True
+
+    def on_button_press(self, widget, event):
+        if event.button == 1:
+            self.drag_start = (event.x, event.y, self.offset_x, self.offset_y)
+        return True
+
+    def on_button_release(self, widget, event):
+        if event.button == 1:
+            self.drag_start = None
+        return True
+
+    def on_motion(self, widget, event):
+        if self.drag_start is not None:
+            x, y, offset_x, offset_y = self.drag_start
+            self.fitted = False
+            self.offset_x = offset_x + event.x - x
+            self.offset_y = offset_y + event.y - y
+            self.queue_draw()
+        return True
+
+    def on_query_tooltip(self, widget, x, y, keyboard_mode, tooltip):
+        if self.drag_start is not None:
+            return False
+        index = self.find_node(x, y)
+        if index is None:
+            return False
+        tooltip.set_text(self.graph.labels[index])
+        return True
+
+
+class GraphWindow(Gtk.Window):
+    '''
+    A window showing `graph` on a :class:`GraphCanvas`, starting the
+    :class:`LayoutJob` when it is created and stopping it when it is closed.
+    '''
+
+    def __init__(self, graph, title='Graph'):
+        Gtk.Window.__init__(self, title=title)
+        self.graph = graph
+        self.set_default_size(800, 600)
+        self.canvas = GraphCanvas(graph)
+
+        toolbar = Gtk.Toolbar()
+        button = Gtk.ToolButton(stock_id=Gtk.STOCK_ZOOM_FIT)
+        button.set_tooltip_text('Show the whole graph')
+        button.connect('clicked', lambda x: self.canvas.fit())
+        toolbar.insert(button, -1)
+        button = Gtk.ToolButton(stock_id=Gtk.STOCK_PRINT_PREVIEW)
+        button.set_tooltip_text('Lay out the graph with Graphviz and show it '
+                                'as a PDF document')
+        button.set_sensitive(find_executable('neato') is not None)
+        button.connect('clicked', lambda x: export_graphviz(self.graph))
+        toolbar.insert(button, -1)
+        self.progress = Gtk.ProgressBar()
+        self.progress.set_text('%d nodes, %d edges' % (len(graph),
+                                                       len(graph.edges)))
+        self.progress.set_show_text(True)
+        item = Gtk.ToolItem()
+        item.set_expand(True)
+        item.add(self.progress)
+        toolbar.insert(item, -1)
+
+        vbox = Gtk.VBox()
+        vbox.pack_start(toolbar, False, False, 0)
+        vbox.pack_start(self.canvas, True, True, 0)
+        self.add(vbox)
+
+        self.job = None
+        if len(graph):
+            self.job = LayoutJob(graph, self.positions_received)
+        else:
+            self.progress.set_fraction(1.0)
+            self.canvas.set_positions([], [])
+        self.connect('destroy', self.on_destroy)
+
+    def positions_received(self, progress, xs, ys):
+        self.progress.set_fraction(progress)
+        if progress >= 1:
+            self.job = None
+        self.canvas.set_positions(xs, ys)
+
+    def on_destroy(self, widget):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
@@ -0,0 +1,116 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+A base class for list models implemented in Python. In contrast to a
+``Gtk.ListStore``, no data is copied into GTK: the values are only requested
+when a row is displayed.
+'''
+
+from gi.repository import GObject
+from gi.repository import Gtk
+
+
+class ListModel(GObject.GObject, Gtk.TreeModel):
+    '''
+    Implements the ``Gtk.TreeModel`` interface for a flat list. Subclasses
+    set :attr:`column_types` and implement ``__len__`` and
+    :meth:`get_value_at`. They have to emit the ``row-inserted``,
+    ``row-deleted`` and ``row-changed`` signals when their contents change.
+    '''
+
+    column_types = ()
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+        self.stamp = id(self) & 0x7fffffff
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def get_value_at(self, index, column):
+        '''
+        Returns the value for the row `index` and the column `column`.
+        '''
+        raise NotImplementedError()
+
+    def create_iter(self, index):
+        if index < 0 or index >= len(self):
+            return (False, None)
+        tree_iter = Gtk.TreeIter()
+        tree_iter.stamp = self.stamp
+        # user_data must not be 0 (the NULL pointer)
+        tree_iter.user_data = index + 1
+        return (True, tree_iter)
+
+    # Gtk.TreeModel interface
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return len(self.column_types)
+
+    def do_get_column_type(self, column):
+        return self.column_types[column]
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if len(indices) != 1:
+            return (False, None)
+        return self.create_iter(indices[0])
+
+    def do_get_path(self, tree_iter):
+        return Gtk.TreePath((tree_iter.user_data - 1, ))
+
+    def do_get_value(self, tree_iter, column):
+        return self.get_value_at(tree_iter.user_data - 1, column)
+
+    def do_iter_next(self, tree_iter):
+        if tree_iter.user_data >= len(self):
+            return False
+        tree_iter.user_data += 1
+        return True
+
+    def do_iter_previous(self, tree_iter):
+        if tree_iter.user_data <= 1:
+            return False
+        tree_iter.user_data -= 1
+        return True
+
+    def do_iter_children(self, parent):
+        if parent is not None:
+            return (False, None)
+        return self.create_iter(0)
+
+    def do_iter_has_child(self, tree_iter):
+        return False
+
+    def do_iter_n_children(self, tree_iter):
+        if tree_iter is not None:
+            return 0
+        return len(self)
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is not None:
+            return (False, None)
+        return self.create_iter(n)
+
+    def do_iter_parent(self, child):
+        return (False, None)
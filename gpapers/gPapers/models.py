@@ -15,17 +15,37 @@
 #    with this program; if not, write to the Free Software Foundation, Inc.,
 #    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import hashlib, os
-from datetime import datetime
+import hashlib, os, re
+from datetime import date, datetime
 
-from django.db import models
+from django.db import connection, models, transaction
 import django.core.files.base
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db.models.signals import (post_save, pre_delete, post_delete,
+                                      m2m_changed)
+from django.dispatch import Signal
 
 from gi.repository import Gtk
 from gi.repository import Gdk
 
-from gpapers.logger import log_debug, log_error
+from gpapers.logger import log_debug, log_info, log_error
+from gpapers.gPapers import fulltext
+
+# Prefixes of DOIs written as URLs or with a label
+p_doi_prefix = re.compile(r'^(?:https?://(?:dx\.)?doi\.org/|doi:\s*|info:doi/)',
+                          re.IGNORECASE)
+
+
+def normalize_doi(doi):
+    '''
+    Returns the DOI in a form suitable for exact matching: without a
+    ``doi:`` or ``http://dx.doi.org/`` prefix and in lowercase (DOIs are
+    case-insensitive).
+    '''
+    if not doi:
+        return ''
+    return p_doi_prefix.sub('', doi.strip()).strip().lower()
+
 
 class Publisher(models.Model):
 
@@ -113,8 +133,13 @@ class Author(models.Model):
         cursor = connection.cursor()
         # we want to preserve the order of the authors, so do an update via SQL instead of using the built in set manipulators
         # FIXME: this will fail if you merge two authors of the same paper
+        paper_ids = list(other_author.paper_set.values_list('id', flat=True))
         cursor.execute("update gPapers_paper_authors set author_id=%s where author_id=%s;", [self.id, id])
         other_author.delete()
+        # the update did not send any signals
+        fulltext.index_papers(paper_ids)
+        if paper_ids:
+            library_changed.send(sender=Paper, paper_ids=paper_ids)
 
     class Admin:
         list_display = ('id', 'name', 'location')
@@ -140,6 +165,8 @@ class Paper(models.Model):
 
     title = models.CharField(max_length='1024')
     doi = models.CharField(max_length='1024', blank=True)
+    # The DOI as returned by normalize_doi, set when saving the paper
+    normalized_doi = models.CharField(max_length='1024', blank=True)
     pubmed_id = models.CharField(max_length='1024', blank=True)
     import_url = models.URLField(blank=True)
     source = models.ForeignKey(Source, null=True)
@@ -151,8 +178,15 @@ class Paper(models.Model):
     sponsors = models.ManyToManyField(Sponsor)
     organizations = models.ManyToManyField(Organization)
     full_text = models.FileField(upload_to=os.path.join('papers', '%Y', '%m'))
+    # Whether the file referenced by full_text exists, kept up to date by
+    # save_file, sync_has_full_text and the DocumentMonitor so that displaying
+    # a paper never has to check the file system
+    has_full_text = models.BooleanField(default=False)
     full_text_md5 = models.CharField(max_length='32', blank=True)
-    extracted_text = models.TextField(blank=True)
+    # Size and md5 sum of the beginning of the document, used to find
+    # duplicates without hashing complete documents (see find_paper_by_content)
+    full_text_size = models.IntegerField(default=0)
+    full_text_prefix_md5 = models.CharField(max_length='32', blank=True)
     page_count = models.IntegerField(default=0)
     rating = models.IntegerField(default=0)
     read_count = models.IntegerField(default=0)
@@ -163,32 +197,51 @@ class Paper(models.Model):
     def save_file(self, filename, raw_contents, save=True):
         log_debug('Generating md5 sum')
         self.full_text_md5 = hashlib.md5(raw_contents).hexdigest()
+        self.full_text_size = len(raw_contents)
+        self.full_text_prefix_md5 = prefix_md5(raw_contents)
+        self.has_full_text = True
         log_debug('Saving file content')
         self.full_text.save(filename,
                             django.core.files.base.ContentFile(raw_contents),
                             save)
         self.save()
 
+    def _get_extracted_text(self):
+        if not hasattr(self, '_extracted_text'):
+            self._extracted_text = ''
+            if self.id is not None:
+                texts = PaperText.objects.filter(paper=self.id).values_list('extracted_text',
+                                                                            flat=True)
+                if texts:
+                    self._extracted_text = texts[0]
+        return self._extracted_text
+
+    def _set_extracted_text(self, text):
+        self._extracted_text = text or ''
+        self._extracted_text_changed = True
+
+    # The extracted text is stored in a separate table (see PaperText) and
+    # only loaded when it is accessed
+    extracted_text = property(_get_extracted_text, _set_extracted_text)
+
+    def save(self, *args, **kwargs):
+        self.normalized_doi = normalize_doi(self.doi)
+        super(Paper, self).save(*args, **kwargs)
+        if getattr(self, '_extracted_text_changed', False):
+            paper_text, created = PaperText.objects.get_or_create(paper=self)
+            paper_text.extracted_text = self._extracted_text
+            paper_text.save()
+            self._extracted_text_changed = False
+
     def get_authors_in_order(self):
-        from django.db import connection
-        cursor = connection.cursor()
-        cursor.execute("select author_id from gPapers_paper_authors where paper_id=%s order by id;", [self.id])
-        rows = cursor.fetchall()
-        author_list = []
-        for row in rows:
-            author_list.append(Author.objects.get(id=row[0]))
-        return author_list
+        return authors_in_order_for([self.id]).get(self.id, [])
 
     def open(self):
         if self.full_text and os.path.isfile(self.full_text.path):
             uri = 'file://' + self.full_text.path
             if Gtk.show_uri(None, uri, Gdk.CURRENT_TIME):
                 self.read_count = self.read_count + 1
-                # temporary disable receivers getting notified by post_save
-                receivers = post_save.receivers
-                post_save.receivers = []
                 self.save()
-                post_save.receivers = receivers
             else:
                 log_error('Failed to open %s' % uri)
 
@@ -204,6 +257,19 @@ class Paper(models.Model):
         return '[' + ', '.join([ author.name for author in self.get_authors_in_order() ]) + '] ' + self.title
 
 
+class PaperText(models.Model):
+    '''
+    The text extracted from the document of a paper. It can be very long and
+    is only needed for searching and editing, it is therefore not part of the
+    paper table. Use :attr:`Paper.extracted_text` to access it.
+    '''
+    paper = models.OneToOneField(Paper)
+    extracted_text = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return 'PaperText<%i>' % self.paper_id
+
+
 class Reference(models.Model):
 
     referencing_paper = models.ForeignKey(Paper, null=True, blank=True)
@@ -251,15 +317,12 @@ class Playlist(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    def get_paper_ids_in_order(self):
+        return list(Playlist.papers.through.objects.filter(playlist=self).\
+                        order_by('id').values_list('paper', flat=True))
+
     def get_papers_in_order(self):
-        from django.db import connection
-        cursor = connection.cursor()
-        cursor.execute("select paper_id from gPapers_playlist_papers where playlist_id=%s order by id;", [self.id])
-        rows = cursor.fetchall()
-        paper_list = []
-        for row in rows:
-            paper_list.append(Paper.objects.get(id=row[0]))
-        return paper_list
+        return in_bulk_ordered(Paper, self.get_paper_ids_in_order())
 
     class Admin:
         list_display = ('id', 'title', 'parent', 'search_text')
@@ -316,6 +379,7 @@ class VirtualPaper(object):
         self.source = VirtualSource()
         self.source_pages = None
         self.full_text = None
+        self.has_full_text = False
         self.abstract = None
         self.title = None
         self.created = datetime.today()
@@ -341,3 +405,569 @@ class VirtualPaper(object):
 
     def get_authors_in_order(self):
         return self.authors
+
+
+###############################################################################
+# Loading of many objects at once
+###############################################################################
+
+# SQLite limits the number of variables in a statement (999 by default), long
+# lists of ids are therefore split into chunks of this size
+SQL_CHUNK_SIZE = 500
+
+
+def chunks(sequence, size=SQL_CHUNK_SIZE):
+    '''
+    Splits `sequence` into lists of at most `size` elements.
+    '''
+    sequence = list(sequence)
+    for start in xrange(0, len(sequence), size):
+        yield sequence[start:start + size]
+
+
+def in_bulk(model, ids):
+    '''
+    Like ``model.objects.in_bulk(ids)`` (returns a dictionary mapping ids to
+    objects) but works for any number of ids.
+    '''
+    objects = {}
+    for chunk in chunks(set(ids)):
+        objects.update(model.objects.in_bulk(chunk))
+    return objects
+
+
+def in_bulk_ordered(model, ids):
+    '''
+    Returns a list of the `model` objects with the given `ids`, in the order
+    of `ids`. Ids of objects that do not exist (anymore) are ignored.
+    '''
+    ids = list(ids)
+    objects = in_bulk(model, ids)
+    return [objects[object_id] for object_id in ids if object_id in objects]
+
+
+def authors_in_order_for(paper_ids):
+    '''
+    Returns a dictionary mapping each of the given `paper_ids` to the list of
+    its authors, in the order they were added to the paper. Needs two
+    queries for every :data:`SQL_CHUNK_SIZE` papers, papers without authors
+    are mapped to an empty list.
+    '''
+    author_ids = dict([(paper_id, []) for paper_id in paper_ids])
+    for chunk in chunks(author_ids.keys()):
+        through = Paper.authors.through.objects.filter(paper__in=chunk)
+        for paper_id, author_id in through.order_by('id').values_list('paper',
+                                                                      'author'):
+            author_ids[paper_id].append(author_id)
+
+    authors = in_bulk(Author, [author_id for ids in author_ids.values()
+                               for author_id in ids])
+    return dict([(paper_id, [authors[author_id] for author_id in ids
+                             if author_id in authors])
+                 for paper_id, ids in author_ids.items()])
+
+
+###############################################################################
+# Importing many papers at once
+###############################################################################
+
+# Sent (with the ids of the papers as `paper_ids`) after papers have been
+# added without sending signals for the individual objects
+library_changed = Signal(providing_args=['paper_ids'])
+
+# Keys of a paper_info dictionary that are stored directly in the paper
+PAPER_INFO_ATTRIBUTES = ('title', 'abstract', 'doi', 'bibtex')
+
+
+def _insert_objects(objects):
+    '''
+    Inserts the new, unsaved model `objects` (all of the same model) into the
+    database, without sending any signals, and sets their ids.
+    '''
+    if not objects:
+        return
+    meta = objects[0]._meta
+    fields = [field for field in meta.local_fields
+              if not isinstance(field, models.AutoField)]
+    quote_name = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (quote_name(meta.db_table),
+                                               ', '.join([quote_name(field.column)
+                                                          for field in fields]),
+                                               ', '.join(['%s'] * len(fields)))
+    cursor = connection.cursor()
+    for obj in objects:
+        cursor.execute(sql, [field.get_db_prep_save(field.pre_save(obj, True),
+                                                    connection=connection)
+                             for field in fields])
+        obj.id = connection.ops.last_insert_id(cursor, meta.db_table,
+                                               meta.pk.column)
+
+
+def _resolve_authors(names):
+    '''
+    Returns a dictionary mapping the author `names` to the ids of existing
+    authors with this name, creating authors for unknown names.
+    '''
+    author_ids = {}
+    for chunk in chunks(set(names)):
+        query = Author.objects.filter(name__in=chunk).order_by('-id')
+        # the author with the lowest id wins, as in get_or_create
+        author_ids.update(query.values_list('name', 'id'))
+    new_authors = [Author(name=name) for name in set(names)
+                   if not name in author_ids]
+    _insert_objects(new_authors)
+    author_ids.update([(author.name, author.id) for author in new_authors])
+    return author_ids
+
+
+def _resolve_sources(paper_infos):
+    '''
+    Returns a list with the source id (or ``None``) for each of the
+    `paper_infos`, creating and updating sources like
+    :func:`gpapers.paper_from_dictionary` does.
+    '''
+    names = set([info['journal'] for info in paper_infos if 'journal' in info])
+    # name -> source and (name, issue) -> source, where a source is the id of
+    # an existing or a new Source object. The source with the lowest id wins.
+    by_name, by_issue = {}, {}
+    for chunk in chunks(names):
+        query = Source.objects.filter(name__in=chunk).order_by('-id')
+        for source_id, name, issue in query.values_list('id', 'name', 'issue'):
+            by_name[name] = source_id
+            by_issue[(name, issue)] = source_id
+
+    sources = []
+    new_sources = []
+    for info in paper_infos:
+        if not 'journal' in info:
+            sources.append(None)
+            continue
+        name = info['journal']
+        if 'issue' in info:
+            source = by_issue.get((name, info['issue']))
+        else:
+            source = by_name.get(name)
+        if source is None:
+            source = Source(name=name, issue=info.get('issue', ''))
+            new_sources.append(source)
+            by_issue[(name, source.issue)] = source
+            by_name.setdefault(name, source)
+        sources.append(source)
+    _insert_objects(new_sources)
+
+    source_ids = [getattr(source, 'id', source) for source in sources]
+    # source id -> values, the last paper of a source determines them
+    updates = {}
+    for info, source_id in zip(paper_infos, source_ids):
+        if source_id is None:
+            continue
+        values = updates.setdefault(source_id, {})
+        values['location'] = info.get('location', '')
+        if 'year' in info:
+            try:
+                values['publication_date'] = date(int(info['year']), 1, 1)
+            except ValueError:
+                log_debug('Ignoring year "%s"' % info['year'])
+
+    # one query for all sources with the same new values
+    groups = {}
+    for source_id, values in updates.items():
+        groups.setdefault(tuple(sorted(values.items())), []).append(source_id)
+    for values, ids in groups.items():
+        for chunk in chunks(ids):
+            Source.objects.filter(id__in=chunk).update(updated=datetime.now(),
+                                                       **dict(values))
+    return source_ids
+
+
+def _import_chunk(paper_infos):
+    author_ids = _resolve_authors([name for info in paper_infos
+                                   for name in info.get('authors', [])])
+    source_ids = _resolve_sources(paper_infos)
+
+    papers = []
+    for info, source_id in zip(paper_infos, source_ids):
+        paper = Paper(source_id=source_id,
+                      source_pages=info.get('pages', ''))
+        for attribute in PAPER_INFO_ATTRIBUTES:
+            if attribute in info:
+                setattr(paper, attribute, info[attribute])
+        paper.normalized_doi = normalize_doi(paper.doi)
+        papers.append(paper)
+    _insert_objects(papers)
+
+    authors = []
+    texts = []
+    for info, paper in zip(paper_infos, papers):
+        seen = set()
+        for name in info.get('authors', []):
+            if not author_ids[name] in seen:
+                seen.add(author_ids[name])
+                authors.append((paper.id, author_ids[name]))
+        if info.get('extracted_text'):
+            texts.append(PaperText(paper_id=paper.id,
+                                   extracted_text=info['extracted_text']))
+    if authors:
+        cursor = connection.cursor()
+        # the id of the through table keeps the order of the authors
+        cursor.executemany('INSERT INTO %s (paper_id, author_id) VALUES (%%s, %%s)' %
+                           connection.ops.quote_name(Paper.authors.through._meta.db_table),
+                           authors)
+    _insert_objects(texts)
+
+    paper_ids = [paper.id for paper in papers]
+    fulltext.index_papers(paper_ids)
+    return paper_ids
+
+
+def bulk_import_papers(paper_infos, chunk_size=SQL_CHUNK_SIZE, notify=True):
+    '''
+    Creates a paper for every ``paper_info`` dictionary in the iterable
+    `paper_infos`, with the same result as calling
+    :func:`gpapers.paper_from_dictionary` for each of them. Authors and
+    sources are looked up for `chunk_size` papers at once and all papers are
+    inserted in a single transaction. No signals are sent for the
+    individual objects, instead :data:`library_changed` is sent once at the
+    end (unless `notify` is ``False``). Returns the ids of the new papers.
+    '''
+    paper_ids = []
+    with transaction.commit_on_success():
+        chunk = []
+        for paper_info in paper_infos:
+            chunk.append(paper_info)
+            if len(chunk) == chunk_size:
+                paper_ids.extend(_import_chunk(chunk))
+                chunk = []
+        if chunk:
+            paper_ids.extend(_import_chunk(chunk))
+    log_info('Imported %d papers' % len(paper_ids))
+    if notify and paper_ids:
+        library_changed.send(sender=Paper, paper_ids=paper_ids)
+    return paper_ids
+
+
+###############################################################################
+# Precomputed rows for the list of papers
+###############################################################################
+
+
+class PaperRow(object):
+    '''
+    The information displayed for a paper in the list of papers. It is
+    computed once when the list is filled (see :func:`get_paper_rows`), so that
+    drawing or sorting the list does not need any database queries.
+    '''
+
+    __slots__ = ('id', 'title', 'authors', 'journal', 'year', 'created',
+                 'rating', 'has_full_text')
+
+    def __init__(self, id, title='', authors='', journal='', year='',
+                 created=None, rating=0, has_full_text=False):
+        self.id = id
+        self.title = title or ''
+        self.authors = authors or ''
+        self.journal = journal or ''
+        self.year = year or ''
+        self.created = created
+        self.rating = rating or 0
+        self.has_full_text = has_full_text
+
+    @staticmethod
+    def for_virtual_paper(paper, has_full_text=False):
+        '''
+        Creates a row for a :class:`VirtualPaper` (i.e. a search result).
+        '''
+        if paper.source.publication_date.year:
+            year = unicode(paper.source.publication_date.year)
+        else:
+            year = ''
+        return PaperRow(paper.id, title=paper.title,
+                        authors=u', '.join([author.name for author in
+                                            paper.get_authors_in_order()]),
+                        journal=paper.source.name, year=year,
+                        created=paper.created, has_full_text=has_full_text)
+
+
+def get_paper_rows(paper_ids):
+    '''
+    Returns a dictionary mapping the given `paper_ids` to :class:`PaperRow`
+    objects, using two queries for every :data:`SQL_CHUNK_SIZE` papers.
+    '''
+    rows = {}
+    for chunk in chunks(paper_ids):
+        authors = {}
+        author_names = Paper.authors.through.objects.filter(paper__in=chunk)
+        for paper_id, name in author_names.order_by('id').values_list('paper',
+                                                                      'author__name'):
+            authors.setdefault(paper_id, []).append(name)
+
+        for values in Paper.objects.filter(id__in=chunk).values('id', 'title',
+                                                                 'rating', 'created',
+                                                                 'has_full_text',
+                                                                 'source__name',
+                                                                 'source__publication_date'):
+            if values['source__publication_date']:
+                year = unicode(values['source__publication_date'].year)
+            else:
+                year = ''
+            rows[values['id']] = PaperRow(values['id'], title=values['title'],
+                                          authors=u', '.join(authors.get(values['id'], [])),
+                                          journal=values['source__name'],
+                                          year=year, created=values['created'],
+                                          rating=values['rating'],
+                                          has_full_text=values['has_full_text'])
+    return rows
+
+
+###############################################################################
+# Tracking which papers have a document in the library
+###############################################################################
+
+def sync_has_full_text():
+    '''
+    Brings :attr:`Paper.has_full_text` in line with the files that actually
+    exist in the library (e.g. after files have been deleted while gPapers was
+    not running). Only lists the directories of the library instead of
+    checking every file separately. Returns the ids of all changed papers.
+    '''
+    existing = set()
+    papers_dir = os.path.join(settings.MEDIA_ROOT, 'papers')
+    for dirpath, dirnames, filenames in os.walk(papers_dir):
+        relative_dir = os.path.relpath(dirpath, settings.MEDIA_ROOT)
+        for filename in filenames:
+            existing.add(os.path.join(relative_dir, filename))
+
+    changed = {True: [], False: []}
+    for paper_id, full_text, has_full_text in Paper.objects.values_list('id',
+                                                                        'full_text',
+                                                                        'has_full_text'):
+        exists = bool(full_text) and full_text in existing
+        if exists != has_full_text:
+            changed[exists].append(paper_id)
+
+    for exists, paper_ids in changed.items():
+        for chunk in chunks(paper_ids):
+            Paper.objects.filter(id__in=chunk).update(has_full_text=exists)
+    if changed[True] or changed[False]:
+        log_info('Updated the document state of %d papers' %
+                 (len(changed[True]) + len(changed[False])))
+    return changed[True] + changed[False]
+
+
+def update_has_full_text(filename):
+    '''
+    Updates :attr:`Paper.has_full_text` for all papers using the file
+    `filename` (an absolute path), after it has been created or deleted.
+    Returns the ids of all changed papers.
+    '''
+    relative_name = os.path.relpath(filename, settings.MEDIA_ROOT)
+    exists = os.path.isfile(filename)
+    papers = Paper.objects.filter(full_text=relative_name).exclude(has_full_text=exists)
+    paper_ids = list(papers.values_list('id', flat=True))
+    if paper_ids:
+        Paper.objects.filter(id__in=paper_ids).update(has_full_text=exists)
+    return paper_ids
+
+
+###############################################################################
+# Finding documents that are already in the library
+###############################################################################
+
+# Number of bytes at the beginning of a document used for the prefix hash
+PREFIX_SIZE = 64 * 1024
+
+
+def prefix_md5(data):
+    return hashlib.md5(data[:PREFIX_SIZE]).hexdigest()
+
+
+def _read_document(full_text, size=-1):
+    fp = open(os.path.join(settings.MEDIA_ROOT, full_text), 'rb')
+    try:
+        return fp.read(size)
+    finally:
+        fp.close()
+
+
+def document_digests(data):
+    '''
+    Returns the size, the md5 sum of the first :data:`PREFIX_SIZE` bytes and
+    the md5 sum of the document `data`, as used by
+    :func:`find_paper_by_digests`.
+    '''
+    return len(data), prefix_md5(data), hashlib.md5(data).hexdigest()
+
+
+def has_documents_of_size(size):
+    '''
+    Returns whether any paper has a document of `size` bytes, i.e. whether a
+    document of this size can be a duplicate at all.
+    '''
+    return Paper.objects.filter(full_text_size=size,
+                                has_full_text=True).exists()
+
+
+def find_paper_by_content(size, get_prefix_md5, get_md5):
+    '''
+    Returns the id of a paper whose document is identical to a given document
+    or ``None``. The document is described by its `size` and the functions
+    `get_prefix_md5` (returning the md5 sum of its first :data:`PREFIX_SIZE`
+    bytes) and `get_md5` (returning the md5 sum of its complete content),
+    which are only called if papers with documents of the same size (and the
+    same prefix) exist. The hashes of documents imported by older versions
+    are computed when needed.
+    '''
+    candidates = list(Paper.objects.filter(full_text_size=size,
+                                           has_full_text=True).values_list('id',
+                                                                           'full_text',
+                                                                           'full_text_prefix_md5',
+                                                                           'full_text_md5'))
+    if not candidates:
+        return None
+    prefix = get_prefix_md5()
+    md5 = None
+    for paper_id, full_text, candidate_prefix, candidate_md5 in candidates:
+        if not candidate_prefix:
+            try:
+                candidate_prefix = prefix_md5(_read_document(full_text,
+                                                             PREFIX_SIZE))
+            except IOError:
+                continue
+            Paper.objects.filter(id=paper_id).update(full_text_prefix_md5=candidate_prefix)
+        if candidate_prefix != prefix:
+            continue
+        if md5 is None:
+            md5 = get_md5()
+        if not candidate_md5:
+            try:
+                candidate_md5 = hashlib.md5(_read_document(full_text)).hexdigest()
+            except IOError:
+                continue
+            Paper.objects.filter(id=paper_id).update(full_text_md5=candidate_md5)
+        if candidate_md5 == md5:
+            return paper_id
+    return None
+
+
+def find_paper_by_data(data):
+    '''
+    Returns the id of the paper whose document is identical to `data` or
+    ``None``.
+    '''
+    return find_paper_by_content(len(data), lambda: prefix_md5(data),
+                                 lambda: hashlib.md5(data).hexdigest())
+
+
+def find_paper_by_digests(size, prefix_digest, digest):
+    '''
+    Returns the id of the paper whose document has the given `size` and md5
+    sums (see :func:`document_digests`) or ``None``. The document itself is
+    not needed, so the digests can be computed elsewhere, e.g. in an
+    extraction process (see
+    :meth:`gpapers.importer.extraction.ExtractionService.submit_digest`).
+    '''
+    return find_paper_by_content(size, lambda: prefix_digest, lambda: digest)
+
+
+def find_papers_by_key(key, values):
+    '''
+    Returns a dictionary mapping those `values` of the paper attribute `key`
+    (e.g. ``'doi'`` or ``'pubmed_id'``) that belong to a paper in the library
+    to ``(id, created, updated, has_full_text)`` of the paper (the oldest one
+    if there are several), using one query for every :data:`SQL_CHUNK_SIZE`
+    values. DOIs are compared in their normalized form (see
+    :func:`normalize_doi`).
+    '''
+    # the value used in the query -> the given values
+    lookups = {}
+    for value in set(values):
+        if value:
+            lookup = normalize_doi(value) if key == 'doi' else value
+            lookups.setdefault(lookup, []).append(value)
+    if key == 'doi':
+        key = 'normalized_doi'
+    papers = {}
+    for chunk in chunks(lookups):
+        query = Paper.objects.filter(**{key + '__in': chunk}).order_by('-id')
+        for paper_id, lookup, created, updated, has_full_text in \
+                query.values_list('id', key, 'created', 'updated',
+                                  'has_full_text'):
+            for value in lookups[lookup]:
+                papers[value] = (paper_id, created, updated, has_full_text)
+    return papers
+
+
+def fill_full_text_sizes():
+    '''
+    Sets :attr:`Paper.full_text_size` for papers whose document was imported
+    by an older version of gPapers.
+    '''
+    papers = Paper.objects.filter(has_full_text=True, full_text_size=0)
+    for paper_id, full_text in papers.values_list('id', 'full_text'):
+        try:
+            size = os.path.getsize(os.path.join(settings.MEDIA_ROOT, full_text))
+        except OSError:
+            continue
+        Paper.objects.filter(id=paper_id).update(full_text_size=size)
+
+
+###############################################################################
+# Keep the full-text index (see :mod:`gpapers.gPapers.fulltext`) up to date
+###############################################################################
+
+def _papers_affected_by(instance):
+    '''
+    Returns the ids of all papers whose full-text index entry contains text
+    from the given model `instance`.
+    '''
+    if isinstance(instance, Paper):
+        return [instance.id]
+    elif isinstance(instance, (PaperText, Bookmark)):
+        return [instance.paper_id]
+    elif isinstance(instance, Reference):
+        return [instance.referencing_paper_id, instance.referenced_paper_id]
+    elif isinstance(instance, Publisher):
+        return list(Paper.objects.filter(source__publisher=instance).values_list('id', flat=True))
+    elif isinstance(instance, (Author, Source, Organization, Sponsor)):
+        return list(instance.paper_set.values_list('id', flat=True))
+    return []
+
+
+def _fulltext_post_save(sender, instance, **kwargs):
+    fulltext.index_papers(_papers_affected_by(instance))
+
+
+def _fulltext_pre_delete(sender, instance, **kwargs):
+    # the relations are gone after the deletion, remember the affected papers
+    instance._fulltext_paper_ids = _papers_affected_by(instance)
+
+
+def _fulltext_post_delete(sender, instance, **kwargs):
+    if isinstance(instance, Paper):
+        fulltext.unindex_paper(instance.id)
+    else:
+        fulltext.index_papers(getattr(instance, '_fulltext_paper_ids', []))
+
+
+def _fulltext_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._fulltext_paper_ids = _papers_affected_by(instance)
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        fulltext.index_papers([instance.id])
+    elif pk_set:
+        fulltext.index_papers(pk_set)
+    else:  # a "clear" from the other side of the relation
+        fulltext.index_papers(getattr(instance, '_fulltext_paper_ids', []))
+
+
+for _model in (Paper, PaperText, Author, Source, Organization, Sponsor,
+               Publisher, Reference, Bookmark):
+    post_save.connect(_fulltext_post_save, sender=_model)
+    pre_delete.connect(_fulltext_pre_delete, sender=_model)
+    post_delete.connect(_fulltext_post_delete, sender=_model)
+
+for _through in (Paper.authors.through, Paper.sponsors.through,
+                 Paper.organizations.through):
+    m2m_changed.connect(_fulltext_m2m_changed, sender=_through)
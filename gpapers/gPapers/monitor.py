@@ -0,0 +1,103 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Watches the documents in the library for changes that do not go through
+gPapers (e.g. files deleted in a file manager) and updates
+:attr:`gpapers.gPapers.models.Paper.has_full_text` accordingly.
+'''
+
+import os
+
+from django.conf import settings
+from gi.repository import Gio
+
+from gpapers.gPapers.models import update_has_full_text
+from gpapers.logger import log_debug, log_warn
+
+# The events after which the existence of a file has to be checked
+_FILE_EVENTS = (Gio.FileMonitorEvent.CREATED,
+                Gio.FileMonitorEvent.DELETED,
+                Gio.FileMonitorEvent.MOVED)
+
+
+class DocumentMonitor(object):
+    '''
+    Monitors the ``papers`` directory of the library and all its
+    subdirectories. `callback` is called with a list of paper ids whenever
+    the document of some papers appeared or disappeared.
+    '''
+
+    def __init__(self, callback):
+        self.callback = callback
+        # Gio cancels a monitor as soon as it is garbage collected, therefore
+        # all monitors are kept here (directory -> monitor)
+        self.monitors = {}
+
+    def start(self):
+        papers_dir = os.path.join(settings.MEDIA_ROOT, 'papers')
+        if not os.path.isdir(papers_dir):
+            os.makedirs(papers_dir)
+        for dirpath, dirnames, filenames in os.walk(papers_dir):
+            self.watch(dirpath)
+
+    def stop(self):
+        for monitor in self.monitors.values():
+            monitor.cancel()
+        self.monitors = {}
+
+    def watch(self, directory):
+        if directory in self.monitors:
+            return
+        try:
+            gfile = Gio.File.new_for_path(directory)
+            monitor = gfile.monitor_directory(Gio.FileMonitorFlags.SEND_MOVED,
+                                              None)
+        except Exception as ex:
+            log_warn('Cannot monitor %s: %s' % (directory, str(ex)))
+            return
+        monitor.connect('changed', self.changed)
+        self.monitors[directory] = monitor
+
+    def changed(self, monitor, gfile, other_gfile, event_type):
+        if event_type not in _FILE_EVENTS:
+            return
+        filenames = [gfile.get_path()]
+        if event_type == Gio.FileMonitorEvent.MOVED and other_gfile:
+            filenames.append(other_gfile.get_path())
+
+        paper_ids = []
+        for filename in filenames:
+            if os.path.isdir(filename):
+                # A new directory (e.g. for a new month): watch it and
+                # everything that has already been put into it
+                for dirpath, dirnames, contained in os.walk(filename):
+                    self.watch(dirpath)
+                    for name in contained:
+                        paper_ids.extend(update_has_full_text(os.path.join(dirpath,
+                                                                           name)))
+            else:
+                if filename in self.monitors:
+                    # a watched directory was deleted
+                    self.monitors.pop(filename).cancel()
+                paper_ids.extend(update_has_full_text(filename))
+
+        if paper_ids:
+            log_debug('Document state changed for papers %s' % str(paper_ids))
+            self.callback(paper_ids)
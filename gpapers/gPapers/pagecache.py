@@ -0,0 +1,234 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Caches for the PDF preview: :class:`PageCache` keeps the recently used
+``Poppler.Document`` objects open and stores rendered pages as cairo
+surfaces, so that a page is not rendered again for every ``draw`` signal.
+Pages that are likely to be shown next can be rendered in advance by a
+background thread.
+'''
+
+from collections import OrderedDict
+import math
+import os
+import threading
+import traceback
+
+import cairo
+from gi.repository import Poppler
+
+from gpapers.logger import log_debug, log_warn
+
+# The maximum number of bytes used for rendered pages
+MAX_SIZE = 64 * 1024 * 1024
+# The maximum number of open documents (per thread)
+MAX_DOCUMENTS = 4
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _open_document(documents, paper_id, path, max_documents):
+    '''
+    Returns the document for `paper_id` from the ordered dictionary
+    `documents`, opening `path` if it is not open yet or has changed on disk.
+    Returns ``(document, changed)``, `changed` states whether a previously
+    opened version of the document has changed.
+    '''
+    mtime = _mtime(path)
+    entry = documents.pop(paper_id, None)
+    changed = False
+    if entry is not None:
+        old_path, old_mtime, document = entry
+        if old_path == path and old_mtime == mtime:
+            documents[paper_id] = entry
+            return document, False
+        changed = True
+    document = Poppler.Document.new_from_file('file://' + path, None)
+    documents[paper_id] = (path, mtime, document)
+    while len(documents) > max_documents:
+        documents.popitem(last=False)
+    return document, changed
+
+
+def render_page(page, scale):
+    '''
+    Renders the ``Poppler.Page`` `page` on a white background and returns the
+    ``cairo.ImageSurface``.
+    '''
+    width, height = page.get_size()
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24,
+                                 max(1, int(math.ceil(width * scale))),
+                                 max(1, int(math.ceil(height * scale))))
+    cr = cairo.Context(surface)
+    cr.set_source_rgb(1, 1, 1)
+    cr.paint()
+    if scale != 1:
+        cr.scale(scale, scale)
+    page.render(cr)
+    return surface
+
+
+class PageCache(object):
+    '''
+    Stores rendered pages, keyed by ``(paper id, page number, scale)``, using
+    at most `max_size` bytes and removing the least recently used pages
+    first. All methods except the background rendering are called from the
+    GTK main loop.
+    '''
+
+    def __init__(self, max_size=MAX_SIZE, max_documents=MAX_DOCUMENTS):
+        self.max_size = max_size
+        self.max_documents = max_documents
+        # documents used by the main loop, paper id -> (path, mtime, document)
+        self.documents = OrderedDict()
+        # everything below is shared with the rendering thread
+        self.lock = threading.Condition()
+        self.surfaces = OrderedDict()
+        self.size = 0
+        # pages to render in the background: (paper id, path, page number,
+        # scale)
+        self.pending = []
+        self.thread = None
+        self.stopped = False
+
+    @staticmethod
+    def key(paper_id, page_number, scale):
+        # avoid cache misses due to rounding errors in the scale
+        return (paper_id, page_number, round(scale, 4))
+
+    def get_document(self, paper_id, path):
+        '''
+        Returns the open ``Poppler.Document`` for the paper, opening it if
+        necessary. If the file changed, the rendered pages are dropped.
+        '''
+        document, changed = _open_document(self.documents, paper_id, path,
+                                           self.max_documents)
+        if changed:
+            self.forget(paper_id)
+        return document
+
+    def get_surface(self, paper_id, page_number, scale):
+        '''
+        Returns the rendered page or ``None`` if it is not in the cache.
+        '''
+        key = self.key(paper_id, page_number, scale)
+        with self.lock:
+            surface = self.surfaces.pop(key, None)
+            if surface is not None:
+                self.surfaces[key] = surface
+            return surface
+
+    def render(self, paper_id, path, page_number, scale):
+        '''
+        Returns the rendered page, rendering it if it is not in the cache.
+        Returns ``None`` if the page does not exist.
+        '''
+        surface = self.get_surface(paper_id, page_number, scale)
+        if surface is not None:
+            return surface
+        page = self.get_document(paper_id, path).get_page(page_number)
+        if page is None:
+            return None
+        surface = render_page(page, scale)
+        self.store(self.key(paper_id, page_number, scale), surface)
+        return surface
+
+    def store(self, key, surface):
+        size = surface.get_stride() * surface.get_height()
+        with self.lock:
+            old = self.surfaces.pop(key, None)
+            if old is not None:
+                self.size -= old.get_stride() * old.get_height()
+            self.surfaces[key] = surface
+            self.size += size
+            while self.size > self.max_size and len(self.surfaces) > 1:
+                key, old = self.surfaces.popitem(last=False)
+                self.size -= old.get_stride() * old.get_height()
+
+    def forget(self, paper_id):
+        '''
+        Removes all rendered pages of a paper.
+        '''
+        with self.lock:
+            for key in [key for key in self.surfaces if key[0] == paper_id]:
+                surface = self.surfaces.pop(key)
+                self.size -= surface.get_stride() * surface.get_height()
+            self.pending = [job for job in self.pending if job[0] != paper_id]
+
+    def prerender(self, paper_id, path, page_numbers, scale):
+        '''
+        Renders the given pages in the background, replacing all earlier
+        requests.
+        '''
+        with self.lock:
+            self.pending = [(paper_id, path, page_number, scale)
+                            for page_number in page_numbers
+                            if not self.key(paper_id, page_number,
+                                            scale) in self.surfaces]
+            if not self.pending:
+                return
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._render_pending,
+                                               name='PageCache')
+                self.thread.daemon = True
+                self.thread.start()
+            self.lock.notify()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.pending = []
+            self.lock.notify()
+
+    def _render_pending(self):
+        # the thread uses its own documents, Poppler documents must not be
+        # used by several threads at once
+        documents = OrderedDict()
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopped:
+                    self.lock.wait()
+                if self.stopped:
+                    return
+                paper_id, path, page_number, scale = self.pending.pop(0)
+                key = self.key(paper_id, page_number, scale)
+                if key in self.surfaces:
+                    continue
+            try:
+                document = _open_document(documents, paper_id, path,
+                                          self.max_documents)[0]
+                page = document.get_page(page_number)
+                if page is None:
+                    continue
+                surface = render_page(page, scale)
+            except Exception:
+                log_warn('Could not render page %d of %s:\n%s' %
+                         (page_number, path, traceback.format_exc()))
+                continue
+            if _mtime(path) != documents[paper_id][1]:
+                continue  # the document changed in the meantime
+            self.store(key, surface)
+            log_debug('Prerendered page %d of paper %d' % (page_number,
+                                                           paper_id))
@@ -0,0 +1,274 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+The model behind the list of papers. For papers in the local library it only
+keeps the paper ids in memory, the displayed information
+(:class:`gpapers.gPapers.models.PaperRow`) is loaded in pages when the view
+asks for it and only a limited number of rows and papers is kept in memory.
+'''
+
+from collections import OrderedDict
+
+from gi.repository import GObject
+from gi.repository import Gtk
+
+from gpapers.gPapers.listmodel import ListModel
+from gpapers.gPapers.models import (Paper, PaperRow, SQL_CHUNK_SIZE,
+                                    get_paper_rows)
+
+# Number of rows loaded from the database at once
+PAGE_SIZE = 100
+# Maximum number of rows and paper objects kept in memory
+ROW_CACHE_SIZE = 10 * PAGE_SIZE
+PAPER_CACHE_SIZE = PAGE_SIZE
+
+# The field used for sorting by a column, the values for 'Authors' are
+# created from the through table
+SORT_FIELDS = {'Title': 'title',
+               'Journal': 'source__name',
+               'Year': 'source__publication_date',
+               'Created': 'created'}
+
+
+def paper_sort_keys(paper_ids, attribute):
+    '''
+    Returns a dictionary mapping the given `paper_ids` to the value used for
+    sorting them by the column `attribute`. Uses a single query: for long
+    lists of papers the values of all papers are fetched and filtered
+    afterwards.
+    '''
+    if attribute == 'Authors':
+        query = Paper.authors.through.objects.order_by('id')
+        fields = ('paper', 'author__name')
+        paper_field = 'paper__in'
+    else:
+        query = Paper.objects.all()
+        fields = ('id', SORT_FIELDS[attribute])
+        paper_field = 'id__in'
+    if len(paper_ids) <= SQL_CHUNK_SIZE:
+        query = query.filter(**{paper_field: paper_ids})
+
+    wanted = set(paper_ids)
+    if attribute == 'Authors':
+        authors = {}
+        for paper_id, name in query.values_list(*fields):
+            if paper_id in wanted:
+                authors.setdefault(paper_id, []).append(name)
+        return dict([(paper_id, u', '.join(names))
+                     for paper_id, names in authors.items()])
+    else:
+        return dict([(paper_id, value)
+                     for paper_id, value in query.values_list(*fields)
+                     if paper_id in wanted])
+
+
+class PaperListModel(ListModel):
+    '''
+    A list model with two columns: the paper object and the
+    :class:`PaperRow` displayed for it. It either shows the papers of the
+    library with the given `paper_ids` (loaded when needed) or the `papers`
+    given as a list of ``(paper, paper_row)`` tuples, e.g. search results of
+    a web search.
+
+    The order of the papers can be changed with :meth:`sort`. If the
+    `paper_ids` are already sorted (e.g. by the database query), `sort_order`
+    gives their order as for :meth:`sort`. For papers of the library,
+    :meth:`update_papers` adds and removes rows after the library has
+    changed, all other changes require a new model.
+    '''
+
+    column_types = (GObject.TYPE_PYOBJECT, GObject.TYPE_PYOBJECT)
+
+    def __init__(self, paper_ids=None, papers=None, sort_order=None):
+        ListModel.__init__(self)
+        if papers is not None:
+            self.papers = list(papers)
+            self.paper_ids = [paper.id for paper, row in self.papers]
+        else:
+            self.papers = None
+            self.paper_ids = list(paper_ids or [])
+        self.update_positions()
+        self.row_cache = OrderedDict()
+        self.paper_cache = OrderedDict()
+        # (attribute, descending) after sort was called (or for papers that
+        # were given sorted) and, for papers of the library, the values used
+        # for sorting (loaded when needed)
+        self.sort_order = sort_order
+        self.sort_keys = None
+
+    def update_positions(self):
+        self.positions = dict([(paper_id, index) for index, paper_id
+                               in enumerate(self.paper_ids)])
+
+    def __len__(self):
+        return len(self.paper_ids)
+
+    def get_paper_row(self, index):
+        if self.papers is not None:
+            return self.papers[index][1]
+        paper_id = self.paper_ids[index]
+        if paper_id in self.row_cache:
+            return self.row_cache[paper_id]
+
+        start = index - index % PAGE_SIZE
+        page = [page_id for page_id in self.paper_ids[start:start + PAGE_SIZE]
+                if not page_id in self.row_cache]
+        rows = get_paper_rows(page)
+        for page_id in page:
+            # papers might have been deleted in the meantime
+            self.row_cache[page_id] = rows.get(page_id, PaperRow(page_id))
+        while len(self.row_cache) > ROW_CACHE_SIZE:
+            self.row_cache.popitem(last=False)
+        return self.row_cache[paper_id]
+
+    def get_paper(self, index):
+        if self.papers is not None:
+            return self.papers[index][0]
+        paper_id = self.paper_ids[index]
+        if not paper_id in self.paper_cache:
+            try:
+                self.paper_cache[paper_id] = Paper.objects.get(id=paper_id)
+            except Paper.DoesNotExist:
+                return None
+            while len(self.paper_cache) > PAPER_CACHE_SIZE:
+                self.paper_cache.popitem(last=False)
+        return self.paper_cache[paper_id]
+
+    def sort(self, attribute, descending=False):
+        '''
+        Sorts the papers by the column `attribute`. The model has to be
+        detached from its view while it is sorted.
+        '''
+        if self.papers is not None:
+            if attribute == 'Created':
+                key = lambda (paper, row): row.created
+            else:
+                key = lambda (paper, row): getattr(row, attribute.lower())
+            self.papers.sort(key=key, reverse=descending)
+            self.paper_ids = [paper.id for paper, row in self.papers]
+        else:
+            self.sort_keys = paper_sort_keys(self.paper_ids, attribute)
+            self.paper_ids.sort(key=self.sort_keys.get, reverse=descending)
+        self.sort_order = (attribute, descending)
+        self.update_positions()
+
+    def sorted_position(self, key):
+        '''
+        Returns the index where a paper with the sort value `key` has to be
+        inserted to keep the papers sorted.
+        '''
+        descending = self.sort_order[1]
+        low, high = 0, len(self.paper_ids)
+        while low < high:
+            middle = (low + high) // 2
+            other = self.sort_keys.get(self.paper_ids[middle])
+            if (other >= key) if descending else (other <= key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def update_papers(self, paper_ids, changed_ids=()):
+        '''
+        Changes the papers of the library shown by the model to `paper_ids`,
+        removing and inserting only the rows that differ. The papers in
+        `changed_ids` that are still shown are reloaded (and moved if their
+        position in a sorted list changed). Does nothing for a model showing
+        a list of `papers`.
+        '''
+        if self.papers is not None:
+            return
+        wanted = set(paper_ids)
+        changed_ids = set(changed_ids)
+        moved = set()
+        if self.sort_order is not None and self.sort_keys is None:
+            # the papers were given sorted, the old values of the changed
+            # papers are lost: they are moved in any case
+            self.sort_keys = paper_sort_keys([paper_id for paper_id
+                                              in self.paper_ids
+                                              if not paper_id in changed_ids],
+                                             self.sort_order[0])
+        if self.sort_order is not None:
+            # papers that have to move to keep the list sorted
+            present = [paper_id for paper_id in changed_ids
+                       if paper_id in wanted and paper_id in self.positions]
+            if present:
+                keys = paper_sort_keys(present, self.sort_order[0])
+                moved = set([paper_id for paper_id in present
+                             if not paper_id in self.sort_keys or
+                             keys.get(paper_id) !=
+                             self.sort_keys.get(paper_id)])
+
+        # Remove rows from the end, so that the earlier indices stay valid
+        for index in xrange(len(self.paper_ids) - 1, -1, -1):
+            paper_id = self.paper_ids[index]
+            if paper_id in wanted and not paper_id in moved:
+                continue
+            del self.paper_ids[index]
+            self.row_cache.pop(paper_id, None)
+            self.paper_cache.pop(paper_id, None)
+            if self.sort_keys is not None:
+                self.sort_keys.pop(paper_id, None)
+            self.row_deleted(Gtk.TreePath((index, )))
+        self.update_positions()
+
+        new_ids = [paper_id for paper_id in paper_ids
+                   if not paper_id in self.positions]
+        if new_ids and self.sort_order is not None:
+            keys = paper_sort_keys(new_ids, self.sort_order[0])
+            for paper_id in new_ids:
+                key = keys.get(paper_id)
+                index = self.sorted_position(key)
+                self.sort_keys[paper_id] = key
+                self.insert_row(index, paper_id)
+        elif new_ids:
+            # keep the order of `paper_ids`, the papers that are already in
+            # the model are in the same order
+            new_ids = set(new_ids)
+            for index, paper_id in enumerate(paper_ids):
+                if paper_id in new_ids:
+                    self.insert_row(min(index, len(self.paper_ids)), paper_id)
+        self.update_positions()
+
+        self.refresh_papers(changed_ids - moved)
+
+    def insert_row(self, index, paper_id):
+        self.paper_ids.insert(index, paper_id)
+        path = Gtk.TreePath((index, ))
+        self.row_inserted(path, self.get_iter(path))
+
+    def refresh_papers(self, paper_ids):
+        '''
+        Reloads the papers with the given ids (if they are part of the model)
+        the next time they are displayed.
+        '''
+        for paper_id in paper_ids:
+            if not paper_id in self.positions or self.papers is not None:
+                continue
+            self.row_cache.pop(paper_id, None)
+            self.paper_cache.pop(paper_id, None)
+            path = Gtk.TreePath((self.positions[paper_id], ))
+            self.row_changed(path, self.get_iter(path))
+
+    def get_value_at(self, index, column):
+        if column == 0:
+            return self.get_paper(index)
+        else:
+            return self.get_paper_row(index)
@@ -0,0 +1,195 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Resolution of the references extracted from a document (see
+:mod:`gpapers.importer.references`) to papers in the library.
+:class:`PaperKeyIndex` keeps the DOIs, arXiv identifiers and titles of all
+papers in memory, so that the references of a document are resolved without
+a query per reference.
+'''
+
+import bisect
+import re
+
+from django.db import transaction
+
+from gpapers.gPapers import fulltext
+from gpapers.gPapers.models import (Paper, Reference, _insert_objects, chunks,
+                                    normalize_doi)
+from gpapers.logger import log_debug, log_info
+
+# The arXiv identifier in the import URL of a paper imported from arXiv
+p_arxiv_url = re.compile(r'arxiv\.org/(?:abs|pdf)/(.+?)(?:v\d+)?(?:\.pdf)?$',
+                         re.IGNORECASE)
+p_non_word = re.compile(r'\W+', re.UNICODE)
+# Sentences of a reference that are candidates for the title
+p_title_separator = re.compile(u'\\.\\s+|["\u201c\u201d]')
+
+# Shorter titles are not used for resolving references, they are too likely
+# to match by accident
+MIN_TITLE_WORDS = 4
+
+
+def normalize_title(title):
+    '''
+    Returns the lowercase words of `title`, separated by single spaces.
+    '''
+    return p_non_word.sub(' ', title.lower()).strip()
+
+
+def arxiv_id_from_url(url):
+    '''
+    Returns the arXiv identifier (without version) for an arXiv URL or
+    ``None``.
+    '''
+    match = p_arxiv_url.search(url or '')
+    if match is None:
+        return None
+    return match.group(1)
+
+
+class PaperKeyIndex(object):
+    '''
+    Maps normalized DOIs (see :func:`gpapers.gPapers.models.normalize_doi`),
+    arXiv identifiers and normalized titles (see :func:`normalize_title`) to
+    paper ids. If several papers share a key, the oldest one is used, the
+    others take its place when it is removed. The index is built with
+    :meth:`build` when it is used for the first time and kept up to date by
+    calling :meth:`update_papers` with the ids of changed papers.
+    '''
+
+    def __init__(self):
+        self.built = False
+        self.dois = {}
+        self.arxiv_ids = {}
+        self.titles = {}
+        # the dictionaries map a key to the sorted list of the paper ids with
+        # this key, paper id -> list of (dictionary, key) entries of the paper
+        self.keys = {}
+
+    def build(self):
+        '''
+        Reads the keys of all papers, using one query.
+        '''
+        self.dois.clear()
+        self.arxiv_ids.clear()
+        self.titles.clear()
+        self.keys.clear()
+        self._read(Paper.objects.all())
+        self.built = True
+        log_debug('Built key index for %d papers' % len(self.keys))
+
+    def _read(self, papers):
+        for paper_id, doi, import_url, title in papers.values_list(
+                'id', 'normalized_doi', 'import_url', 'title'):
+            keys = self.keys.setdefault(paper_id, [])
+            arxiv_id = arxiv_id_from_url(import_url)
+            title = normalize_title(title)
+            if len(title.split()) < MIN_TITLE_WORDS:
+                title = None
+            for dictionary, key in [(self.dois, doi),
+                                    (self.arxiv_ids, arxiv_id),
+                                    (self.titles, title)]:
+                if key:
+                    bisect.insort(dictionary.setdefault(key, []), paper_id)
+                    keys.append((dictionary, key))
+
+    def remove_paper(self, paper_id):
+        for dictionary, key in self.keys.pop(paper_id, ()):
+            paper_ids = dictionary.get(key, [])
+            if paper_id in paper_ids:
+                paper_ids.remove(paper_id)
+            if not paper_ids:
+                dictionary.pop(key, None)
+
+    def update_papers(self, changed_ids, removed_ids=()):
+        '''
+        Reads the keys of the papers with `changed_ids` again (new papers are
+        added) and removes the papers with `removed_ids`. Does nothing if the
+        index has not been built.
+        '''
+        if not self.built:
+            return
+        for paper_id in set(changed_ids) | set(removed_ids):
+            self.remove_paper(paper_id)
+        for chunk in chunks(set(changed_ids) - set(removed_ids)):
+            self._read(Paper.objects.filter(id__in=chunk))
+
+    def resolve(self, reference):
+        '''
+        Returns the id of the paper for a `reference` dictionary (see
+        :func:`gpapers.importer.references.extract_references`) or ``None``.
+        The DOI and the arXiv identifier are tried first, then every sentence
+        of the reference is compared to the titles of the papers.
+        '''
+        if not self.built:
+            self.build()
+        doi = normalize_doi(reference.get('doi'))
+        if doi in self.dois:
+            return self.dois[doi][0]
+        arxiv_id = reference.get('arxiv_id')
+        if arxiv_id and arxiv_id in self.arxiv_ids:
+            return self.arxiv_ids[arxiv_id][0]
+        for candidate in p_title_separator.split(reference.get('line', '')):
+            title = normalize_title(candidate)
+            if title in self.titles:
+                return self.titles[title][0]
+        return None
+
+
+def store_references(paper, references, key_index, citation_index=None):
+    '''
+    Creates a :class:`gpapers.gPapers.models.Reference` for each of the
+    `references` (dictionaries, see
+    :func:`gpapers.importer.references.extract_references`) of `paper`,
+    linking it to a paper in the library if the
+    :class:`PaperKeyIndex` `key_index` finds one. The references are
+    inserted without sending signals, the full-text index and the
+    :class:`gpapers.gPapers.citations.CitationIndex` `citation_index` (if
+    given) are updated once for all of them. Returns the number of resolved
+    references.
+    '''
+    objects = []
+    for reference in references:
+        referenced_id = key_index.resolve(reference)
+        if referenced_id == paper.id:
+            referenced_id = None
+        url = ''
+        if reference.get('arxiv_id'):
+            url = 'http://arxiv.org/abs/' + reference['arxiv_id']
+        elif reference.get('doi'):
+            url = 'http://dx.doi.org/' + reference['doi']
+        objects.append(Reference(referencing_paper=paper,
+                                 referenced_paper_id=referenced_id,
+                                 line_from_referencing_paper=reference['line'][:1024],
+                                 doi_from_referencing_paper=reference.get('doi', '')[:1024],
+                                 url_from_referencing_paper=url[:200]))
+    with transaction.commit_on_success():
+        _insert_objects(objects)
+    resolved_ids = set([obj.referenced_paper_id for obj in objects
+                        if obj.referenced_paper_id is not None])
+    fulltext.index_papers([paper.id] + list(resolved_ids))
+    if citation_index is not None:
+        citation_index.add_references(objects)
+    resolved = len([obj for obj in objects
+                    if obj.referenced_paper_id is not None])
+    log_info('Stored %d references of paper %d (%d in the library)' %
+             (len(references), paper.id, resolved))
+    return resolved
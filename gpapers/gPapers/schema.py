@@ -0,0 +1,219 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Additions to the database schema that ``syncdb`` does not take care of for
+existing databases (it only creates missing tables). :func:`upgrade_schema`
+is called on every start and only changes what is missing.
+'''
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from gpapers.gPapers.models import Paper, normalize_doi
+from gpapers.logger import log_info
+
+# Indexes on the foreign key columns that are used in joins and on the columns
+# used to look up papers, as (table, columns) tuples. ``syncdb`` already
+# indexes the foreign keys, but these indexes are lost when a table is rebuilt
+# (see :func:`rebuild_table`); indexes are only created for columns that are
+# not covered by an existing index.
+INDEXES = [('gPapers_source', ('publisher_id',)),
+           ('gPapers_paper', ('source_id',)),
+           ('gPapers_paper', ('full_text_size',)),
+           ('gPapers_paper', ('full_text_md5',)),
+           ('gPapers_paper', ('normalized_doi',)),
+           ('gPapers_paper', ('pubmed_id',)),
+           ('gPapers_paper', ('import_url',)),
+           ('gPapers_paper_authors', ('paper_id',)),
+           ('gPapers_paper_authors', ('author_id',)),
+           ('gPapers_paper_sponsors', ('paper_id',)),
+           ('gPapers_paper_sponsors', ('sponsor_id',)),
+           ('gPapers_paper_organizations', ('paper_id',)),
+           ('gPapers_paper_organizations', ('organization_id',)),
+           ('gPapers_author_organizations', ('author_id',)),
+           ('gPapers_author_organizations', ('organization_id',)),
+           ('gPapers_reference', ('referencing_paper_id',)),
+           ('gPapers_reference', ('referenced_paper_id',)),
+           ('gPapers_bookmark', ('paper_id',)),
+           ('gPapers_playlist_papers', ('playlist_id',)),
+           ('gPapers_playlist_papers', ('paper_id',))]
+
+# Indexes created by earlier versions that are no longer used (DOIs are looked
+# up by their normalized form)
+OBSOLETE_INDEXES = [('gPapers_paper', ('doi',))]
+
+# Columns added to existing tables, as (table, column, definition) tuples
+COLUMNS = [('gPapers_paper', 'has_full_text', 'bool NOT NULL DEFAULT 0'),
+           ('gPapers_paper', 'full_text_size', 'integer NOT NULL DEFAULT 0'),
+           ('gPapers_paper', 'full_text_prefix_md5',
+            "varchar(32) NOT NULL DEFAULT ''"),
+           ('gPapers_paper', 'normalized_doi',
+            "varchar(1024) NOT NULL DEFAULT ''")]
+
+
+def index_name(table, columns):
+    return '%s_%s_idx' % (table, '_'.join(columns))
+
+
+def table_indexes(table):
+    '''
+    Returns a dictionary mapping the names of the indexes of `table` to the
+    tuples of their columns.
+    '''
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA index_list("%s");' % table)
+    names = [row[1] for row in cursor.fetchall()]
+    indexes = {}
+    for name in names:
+        cursor.execute('PRAGMA index_info("%s");' % name)
+        indexes[name] = tuple([row[2] for row in
+                               sorted(cursor.fetchall())])
+    return indexes
+
+
+def create_indexes():
+    '''
+    Creates the indexes in :data:`INDEXES` for columns that are not the
+    leading columns of an existing index. Indexes created by earlier versions
+    that duplicate another index or are listed in :data:`OBSOLETE_INDEXES`
+    are dropped.
+    '''
+    cursor = connection.cursor()
+    indexes = {}
+    for table, columns in OBSOLETE_INDEXES:
+        if not table in indexes:
+            indexes[table] = table_indexes(table)
+        name = index_name(table, columns)
+        if name in indexes[table]:
+            log_info('Dropping unused index %s' % name)
+            cursor.execute('DROP INDEX "%s";' % name)
+            del indexes[table][name]
+    for table, columns in INDEXES:
+        if not table in indexes:
+            indexes[table] = table_indexes(table)
+        name = index_name(table, columns)
+        covered = [other for other, other_columns in indexes[table].items()
+                   if other != name and
+                   other_columns[:len(columns)] == columns]
+        if covered and name in indexes[table]:
+            log_info('Dropping duplicate index %s' % name)
+            cursor.execute('DROP INDEX "%s";' % name)
+            del indexes[table][name]
+        elif not covered and not name in indexes[table]:
+            log_info('Creating index %s' % name)
+            cursor.execute('CREATE INDEX "%s" ON "%s" (%s);' %
+                           (name, table, ', '.join(['"%s"' % column
+                                                    for column in columns])))
+            indexes[table][name] = columns
+    transaction.commit_unless_managed()
+
+
+def table_columns(table):
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA table_info("%s");' % table)
+    return [row[1] for row in cursor.fetchall()]
+
+
+def add_columns():
+    '''
+    Adds all columns in :data:`COLUMNS` that do not exist yet.
+    '''
+    cursor = connection.cursor()
+    for table, column, definition in COLUMNS:
+        if column in table_columns(table):
+            continue
+        log_info('Adding column %s.%s' % (table, column))
+        cursor.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s;' % (table, column,
+                                                                 definition))
+    transaction.commit_unless_managed()
+
+
+def rebuild_table(model):
+    '''
+    Recreates the table of `model` according to the current model definition,
+    keeping its content. Columns that are no longer part of the model are
+    dropped (SQLite cannot drop columns directly). The indexes of the table
+    are lost and have to be recreated afterwards.
+    '''
+    table = model._meta.db_table
+    new_table = table + '_new'
+    log_info('Rebuilding table %s' % table)
+    old_columns = table_columns(table)
+    columns = ', '.join(['"%s"' % field.column
+                         for field in model._meta.local_fields
+                         if field.column in old_columns])
+    statements, _ = connection.creation.sql_create_model(model, no_style())
+    cursor = connection.cursor()
+    cursor.execute('DROP TABLE IF EXISTS "%s";' % new_table)
+    for statement in statements:
+        cursor.execute(statement.replace('"%s"' % table, '"%s"' % new_table, 1))
+    cursor.execute('INSERT INTO "%s" (%s) SELECT %s FROM "%s";' % (new_table,
+                                                                   columns,
+                                                                   columns,
+                                                                   table))
+    cursor.execute('DROP TABLE "%s";' % table)
+    cursor.execute('ALTER TABLE "%s" RENAME TO "%s";' % (new_table, table))
+
+
+def move_extracted_text():
+    '''
+    Older versions stored the text extracted from the documents in the paper
+    table, move it to the separate table of
+    :class:`gpapers.gPapers.models.PaperText`.
+    '''
+    if not 'extracted_text' in table_columns('gPapers_paper'):
+        return
+    log_info('Moving extracted texts out of the paper table')
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO gPapers_papertext (paper_id, extracted_text) "
+                   "SELECT id, extracted_text FROM gPapers_paper "
+                   "WHERE extracted_text != '' AND id NOT IN "
+                   "(SELECT paper_id FROM gPapers_papertext);")
+    rebuild_table(Paper)
+    transaction.commit_unless_managed()
+
+
+def fill_normalized_dois():
+    '''
+    Sets the normalized DOI (see :func:`gpapers.gPapers.models.normalize_doi`)
+    of papers that were stored before it existed.
+    '''
+    papers = Paper.objects.exclude(doi='').filter(normalized_doi='')
+    dois = [(normalize_doi(doi), paper_id)
+            for paper_id, doi in papers.values_list('id', 'doi')]
+    dois = [(normalized, paper_id) for normalized, paper_id in dois
+            if normalized]
+    if not dois:
+        return
+    log_info('Normalizing the DOIs of %d papers' % len(dois))
+    cursor = connection.cursor()
+    cursor.executemany('UPDATE gPapers_paper SET normalized_doi = %s '
+                       'WHERE id = %s;', dois)
+    transaction.commit_unless_managed()
+
+
+def upgrade_schema():
+    '''
+    Brings the schema of an existing database up to date.
+    '''
+    add_columns()
+    move_extracted_text()
+    fill_normalized_dois()
+    create_indexes()
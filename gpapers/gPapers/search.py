@@ -0,0 +1,115 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Search in the local library. A search string is compiled into a single SQL
+statement, independent of the number of words in the search string or the
+number of matching objects: every word has to match (in any of the searched
+fields) for a paper to be part of the result.
+
+If the full-text index (:mod:`gpapers.gPapers.fulltext`) is available it is
+used instead, as it is much faster and ranks the results.
+'''
+
+from django.db import connection
+
+from gpapers.gPapers import fulltext
+
+# Columns of the paper table that are searched directly
+PAPER_COLUMNS = ('p.title', 'p.doi', 'p.source_session', 'p.abstract')
+
+# Objects related to a paper that are searched as well, as tuples of
+# (FROM clause, condition joining it to the paper p, searched columns)
+RELATED_TABLES = [
+    ('gPapers_paper_sponsors ps JOIN gPapers_sponsor sp ON sp.id = ps.sponsor_id',
+     'ps.paper_id = p.id', ('sp.name',)),
+    ('gPapers_paper_authors pa JOIN gPapers_author a ON a.id = pa.author_id',
+     'pa.paper_id = p.id', ('a.name', 'a.location')),
+    ('gPapers_source s LEFT JOIN gPapers_publisher pub ON pub.id = s.publisher_id',
+     's.id = p.source_id', ('s.name', 's.issue', 's.location', 'pub.name')),
+    ('gPapers_paper_organizations po JOIN gPapers_organization o ON o.id = po.organization_id',
+     'po.paper_id = p.id', ('o.name', 'o.location')),
+    ('gPapers_reference r1', 'r1.referencing_paper_id = p.id',
+     ('r1.line_from_referencing_paper', 'r1.doi_from_referencing_paper')),
+    ('gPapers_reference r2', 'r2.referenced_paper_id = p.id',
+     ('r2.line_from_referenced_paper', 'r2.doi_from_referenced_paper')),
+    ('gPapers_bookmark b', 'b.paper_id = p.id', ('b.notes',)),
+    ('gPapers_papertext t', 't.paper_id = p.id', ('t.extracted_text',)),
+]
+
+
+def _like(column):
+    return "%s LIKE %%s ESCAPE '\\'" % column
+
+
+def _like_pattern(word):
+    '''
+    Returns a LIKE pattern matching `word` anywhere in a string (equivalent to
+    Django's ``icontains``).
+    '''
+    word = word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + word + '%'
+
+
+def compile_search(search_text):
+    '''
+    Compiles `search_text` into a single SQL statement returning the ids of
+    all matching papers, ordered by title. Returns a tuple ``(sql, params)``
+    or ``None`` for an empty search.
+    '''
+    words = search_text.split()
+    if not words:
+        return None
+
+    conditions = []
+    params = []
+    for word in words:
+        pattern = _like_pattern(word)
+        alternatives = []
+        for column in PAPER_COLUMNS:
+            alternatives.append(_like(column))
+            params.append(pattern)
+        for from_clause, join_condition, columns in RELATED_TABLES:
+            alternatives.append('EXISTS (SELECT 1 FROM %s WHERE %s AND (%s))' %
+                                (from_clause, join_condition,
+                                 ' OR '.join([_like(column)
+                                              for column in columns])))
+            params.extend([pattern] * len(columns))
+        conditions.append('(%s)' % ' OR '.join(alternatives))
+
+    sql = ('SELECT p.id FROM gPapers_paper p WHERE %s ORDER BY p.title;' %
+           ' AND '.join(conditions))
+    return sql, params
+
+
+def search_paper_ids(search_text):
+    '''
+    Returns a list with the ids of all papers matching `search_text`, best
+    matches (or, without a full-text index, alphabetically by title) first.
+    '''
+    if fulltext.is_available():
+        return fulltext.search(search_text)
+
+    compiled = compile_search(search_text)
+    if compiled is None:
+        return []
+    sql, params = compiled
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return [row[0] for row in cursor.fetchall()]
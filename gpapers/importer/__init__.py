@@ -30,6 +30,7 @@ from gi.repository import Gio
 from gi.repository import Gdk
 from gi.repository import Gtk
 from gi.repository import Soup
+from django.conf import settings
 from django.template import defaultfilters
 import BeautifulSoup
 
@@ -37,13 +38,19 @@ import gpapers
 from gpapers_info import __version__
 from gpapers.logger import *
 from gpapers.gPapers.models import Paper
+from gpapers.importer.httpcache import CachingSession, HTTPCache
+from gpapers.importer.scheduler import RequestScheduler, BACKGROUND
 
 active_threads = None
 
 p_whitespace = re.compile('[\s]+')
 p_doi = re.compile('doi *: *(10.[a-z0-9]+/[a-z0-9.]+)', re.IGNORECASE)
 
-soup_session = Soup.SessionAsync()
+# All HTTP requests go through this session, answered from a persistent cache
+# where possible. The remaining requests are sent with limits per host.
+soup_session = CachingSession(RequestScheduler(Soup.SessionAsync()),
+                              HTTPCache(os.path.join(settings.DATA_DIR,
+                                                     'http_cache')))
 #arXiv disallows requests if no user-agent is set
 soup_session.set_property("user-agent", "gPapers/%s" % __version__)
 
@@ -82,13 +89,14 @@ def _substitute_entity(match):
             return match.group()
 
 
-def get_bibtex_for_doi(doi, callback):
+def get_bibtex_for_doi(doi, callback, priority=BACKGROUND):
     '''
     Asynchronously retrieves the bibtex data for a document with a given `doi`,
     querying the crossref service. The `callback` function will be called with
     two arguments, a string containing the bibtex data and the doi for which
     the data was retrieved. In case of a failed retrieval, callback will be
-    called with `None` for the bibtex data.
+    called with `None` for the bibtex data. By default, the request is sent
+    after all interactive requests (see :mod:`gpapers.importer.scheduler`).
     '''
     url = 'http://dx.doi.org/' + doi
     message = Soup.Message.new(method='GET', uri_string=url)
@@ -103,7 +111,7 @@ def get_bibtex_for_doi(doi, callback):
             callback(None, user_data)
 
     # Use the doi as user_data for the callback
-    soup_session.queue_message(message, mycallback, doi)
+    soup_session.queue_message(message, mycallback, doi, priority=priority)
 
 
 def determine_content_type(filename):
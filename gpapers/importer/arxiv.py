@@ -114,4 +114,15 @@ class ArxivSearch(WebSearchProvider):
             except Exception as ex:
                 log_error("arxiv: error while reading item: %s" % ex[0])
         
-        return papers
\ No newline at end of file
+        return papers
+
+    def dump_search_result(self, result):
+        # 'data' refers to the result itself
+        result = dict(result)
+        result.pop('data', None)
+        return WebSearchProvider.dump_search_result(self, result)
+
+    def load_search_result(self, value):
+        value = dict(value)
+        value['data'] = value
+        return value
@@ -18,164 +18,324 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
-#
-# This file is based on code by Matthew Brett (http://pastebin.com/ZzU19NLJ),
-# published under a simplified BSD license.
 
-# -- begin of pyparsing code
-#  Pyparsing parser for BibTeX files
-#
-#  A standalone parser using pyparsing.
-#
-#  pyparsing has a simple and expressive syntax so the grammar is easy to read and
-#  write.
-#
-#  Matthew Brett 2010
-#  Simplified BSD license
+'''
+Parsing of BibTeX data. The parser reads its input incrementally and returns
+one entry at a time (see :func:`iter_entries`), so that even very large files
+can be imported without reading them completely into memory.
+'''
+
+from collections import namedtuple
+import re
 
 from gpapers.logger import log_warn, log_info, log_debug
 
-from pyparsing import (Regex, Suppress, ZeroOrMore, Group, Optional, Forward,
-                       SkipTo, CaselessLiteral, Dict)
-
-
-class Macro(object):
-    """ Class to encapsulate undefined macro references """
-    def __init__(self, name):
-        self.name = name
-    def __repr__(self):
-        return 'Macro("%s")' % self.name
-    def __eq__(self, other):
-        return self.name == other.name
-    def __ne__(self, other):
-        return self.name != other.name
-
-
-# Character literals
-LCURLY = Suppress('{')
-RCURLY = Suppress('}')
-LPAREN = Suppress('(')
-RPAREN = Suppress(')')
-QUOTE = Suppress('"')
-COMMA = Suppress(',')
-AT = Suppress('@')
-EQUALS = Suppress('=')
-HASH = Suppress('#')
-
-
-def bracketed(expr):
-    """ Return matcher for `expr` between curly brackets or parentheses """
-    return (LPAREN + expr + RPAREN) | (LCURLY + expr + RCURLY)
-
-
-# Define parser components for strings (the hard bit)
-chars_no_curly = Regex(r"[^{}]+")
-chars_no_curly.leaveWhitespace()
-chars_no_quotecurly = Regex(r'[^"{}]+')
-chars_no_quotecurly.leaveWhitespace()
-# Curly string is some stuff without curlies, or nested curly sequences
-curly_string = Forward()
-curly_item = Group(curly_string) | chars_no_curly
-curly_string << LCURLY + ZeroOrMore(curly_item) + RCURLY
-# quoted string is either just stuff within quotes, or stuff within quotes, within
-# which there is nested curliness
-quoted_item = Group(curly_string) | chars_no_quotecurly
-quoted_string = QUOTE + ZeroOrMore(quoted_item) + QUOTE
-
-# Numbers can just be numbers. Only integers though.
-number = Regex('[0-9]+')
-
-# Basis characters (by exclusion) for variable / field names.  The following
-# list of characters is from the btparse documentation
-any_name = Regex('[^\s"#%\'(),={}]+')
-
-# btparse says, and the test bibs show by experiment, that macro and field names
-# cannot start with a digit.  In fact entry type names cannot start with a digit
-# either (see tests/bibs). Cite keys can start with a digit
-not_digname = Regex('[^\d\s"#%\'(),={}][^\s"#%\'(),={}]*')
-
-# Comment comments out to end of line
-comment = (AT + CaselessLiteral('comment') +
-           Regex("[\s{(].*").leaveWhitespace())
-
-# The name types with their digiteyness
-not_dig_lower = not_digname.copy().setParseAction(
-    lambda t: t[0].lower())
-macro_def = not_dig_lower.copy()
-macro_ref = not_dig_lower.copy().setParseAction(lambda t : Macro(t[0].lower()))
-field_name = not_dig_lower.copy()
-# Spaces in names mean they cannot clash with field names
-entry_type = not_dig_lower.setResultsName('entry type')
-cite_key = any_name.setResultsName('cite key')
-# Number has to be before macro name
-string = (number | macro_ref | quoted_string |
-          curly_string)
-
-# There can be hash concatenation
-field_value = string + ZeroOrMore(HASH + string)
-field_def = Group(field_name + EQUALS + field_value)
-entry_contents = Dict(ZeroOrMore(field_def + COMMA) + Optional(field_def))
-
-# Entry is surrounded either by parentheses or curlies
-entry = (AT + entry_type +
-         bracketed(cite_key + COMMA + entry_contents))
-
-# Preamble is a macro-like thing with no name
-preamble = AT + CaselessLiteral('preamble') + bracketed(field_value)
-
-# Macros (aka strings)
-macro_contents = macro_def + EQUALS + field_value
-macro = AT + CaselessLiteral('string') + bracketed(macro_contents)
-
-# entries are last in the list (other than the fallback) because they have
-# arbitrary start patterns that would match comments, preamble or macro
-definitions = Group(comment |
-                    preamble |
-                    macro |
-                    entry)
-
-# Start symbol
-bibfile = ZeroOrMore(definitions)
-
-
-def parse_str(str):
-    return bibfile.parseString(str)
-
-# -- end of pyparsing code
+# The size of the blocks read from a file
+CHUNK_SIZE = 64 * 1024
+# Blocks that are not closed within this many characters are considered to
+# have unbalanced brackets, parsing continues at the next line starting with
+# "@"
+MAX_BLOCK_SIZE = 1024 * 1024
+
+# Macros defined by the standard BibTeX styles
+MONTH_MACROS = {'jan': 'January', 'feb': 'February', 'mar': 'March',
+                'apr': 'April', 'may': 'May', 'jun': 'June', 'jul': 'July',
+                'aug': 'August', 'sep': 'September', 'oct': 'October',
+                'nov': 'November', 'dec': 'December'}
+
+BibTeXEntry = namedtuple('BibTeXEntry', ['entry_type', 'cite_key', 'fields',
+                                         'text'])
+
+# The start of an entry: "@", the entry type and the opening bracket. Names
+# may not contain the following characters (see the btparse documentation)
+_p_entry_start = re.compile(r'@\s*([^\s"#%\'(),={}@]*)\s*([{(]?)')
+_p_name = re.compile(r'[^\s"#%\'(),={}]+')
+_p_field_start = re.compile(r'[\s,]*([^\s"#%\'(),={}]+)\s*=\s*')
+_p_separator = re.compile(r'[\s,]*')
+_p_whitespace = re.compile(r'\s*')
+_p_braces = re.compile(r'[{}]')
+_p_braces_quote = re.compile(r'[{}"]')
+_p_braces_quote_paren = re.compile(r'[{}")]')
+_p_author_separator = re.compile(r'[{}]|\s+and\s+', re.IGNORECASE)
+_p_line_start = re.compile(r'\n[ \t]*@')
+_p_open_line = re.compile(r'\n[ \t]*\Z')
+
+
+def _find_closing(text, start, pattern, closing):
+    '''
+    Returns the index of the character `closing` that ends the block starting
+    at `start` (directly after the opening character) or -1 if the block is
+    incomplete. Only the characters matched by `pattern` are considered,
+    `closing` only counts outside of nested braces (and outside of quotes if
+    the pattern matches them).
+    '''
+    depth = 0
+    in_quotes = False
+    for match in pattern.finditer(text, start):
+        char = match.group()
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            if depth == 0 and closing == '}':
+                return match.start()
+            depth -= 1
+        elif depth == 0:
+            if char == closing and not in_quotes:
+                return match.start()
+            if char == '"':
+                in_quotes = not in_quotes
+    return -1
+
+
+def _parse_value(body, pos, macros):
+    '''
+    Parses the value starting at `pos`, consisting of quoted strings, braced
+    strings, numbers and macro names, possibly concatenated with "#". Returns
+    the value and the position after it.
+    '''
+    parts = []
+    while True:
+        pos = _p_whitespace.match(body, pos).end()
+        char = body[pos:pos + 1]
+        if char == '{':
+            end = _find_closing(body, pos + 1, _p_braces, '}')
+            if end < 0:
+                raise ValueError('Unbalanced braces')
+            parts.append(body[pos + 1:end])
+            pos = end + 1
+        elif char == '"':
+            end = _find_closing(body, pos + 1, _p_braces_quote, '"')
+            if end < 0:
+                raise ValueError('Unterminated string')
+            parts.append(body[pos + 1:end])
+            pos = end + 1
+        else:
+            match = _p_name.match(body, pos)
+            if match is None:
+                raise ValueError('Expected a value at "%s"' %
+                                 body[pos:pos + 20])
+            word = match.group()
+            if word.isdigit():
+                parts.append(word)
+            elif word.lower() in macros:
+                parts.append(macros[word.lower()])
+            else:
+                log_debug('Undefined BibTeX macro "%s"' % word)
+                parts.append(word)
+            pos = match.end()
+        pos = _p_whitespace.match(body, pos).end()
+        if body[pos:pos + 1] != '#':
+            return ''.join(parts), pos
+        pos += 1
+
+
+def _parse_fields(body, pos, macros):
+    '''
+    Parses the comma-separated ``name = value`` pairs in `body`, starting at
+    `pos`. Returns a dictionary with the lower-case names as keys.
+    '''
+    fields = {}
+    while True:
+        pos = _p_separator.match(body, pos).end()
+        if pos >= len(body):
+            return fields
+        match = _p_field_start.match(body, pos)
+        if match is None:
+            raise ValueError('Expected a field at "%s"' % body[pos:pos + 20])
+        value, pos = _parse_value(body, match.end(), macros)
+        fields[match.group(1).lower()] = value
+
+
+class BibTeXReader(object):
+    '''
+    Reads the BibTeX entries from `source`, a string or a file object. Use
+    :meth:`entries` (or :func:`iter_entries`) to get the entries. Macros
+    defined with ``@string`` are expanded, `macros` can be used to give
+    additional predefined macros. ``<br>`` tags (added by IEEE Xplore) are
+    read as line breaks.
+    '''
+
+    def __init__(self, source, macros=None, chunk_size=CHUNK_SIZE,
+                 max_block_size=MAX_BLOCK_SIZE):
+        if isinstance(source, basestring):
+            self.buffer = source.replace('<br>', '\n')
+            self.file = None
+        else:
+            self.buffer = ''
+            self.file = source
+        # the end of the last block read, if it might be the start of a tag
+        self.tail = ''
+        self.chunk_size = chunk_size
+        self.max_block_size = max_block_size
+        self.pos = 0
+        self.macros = dict(MONTH_MACROS)
+        if macros is not None:
+            self.macros.update(macros)
+
+    def fill(self):
+        '''
+        Reads the next block of the file, dropping the part of the buffer
+        before the current position. Returns whether any data was read.
+        '''
+        if self.file is None:
+            return False
+        data = self.file.read(self.chunk_size)
+        if data:
+            data = self.tail + data
+            self.tail = ''
+            for length in (3, 2, 1):
+                if data.endswith('<br>'[:length]):
+                    data, self.tail = data[:-length], data[-length:]
+                    break
+        else:
+            self.file = None
+            data, self.tail = self.tail, ''
+            if not data:
+                return False
+        self.buffer = self.buffer[self.pos:] + data.replace('<br>', '\n')
+        self.pos = 0
+        return True
+
+    def blocks(self):
+        '''
+        Generator yielding ``(block_type, body, text)`` for every ``@`` block,
+        where `block_type` is in lower case, `body` is the text between the
+        brackets and `text` is the complete block. ``@comment`` blocks are
+        skipped. A block whose brackets are not closed (at the end of the
+        data or within :data:`MAX_BLOCK_SIZE` characters) is skipped up to
+        the next line starting with ``@``.
+        '''
+        resync = False
+        while True:
+            if resync:
+                match = _p_line_start.search(self.buffer, self.pos)
+                if match is None:
+                    # keep a line break at the end, the next line might
+                    # start with "@"
+                    match = _p_open_line.search(self.buffer, self.pos)
+                    if match is not None:
+                        self.pos = match.start()
+                    else:
+                        self.pos = len(self.buffer)
+                    if not self.fill():
+                        return
+                    continue
+                self.pos = match.end() - 1
+                resync = False
+
+            start = self.buffer.find('@', self.pos)
+            if start < 0:
+                self.pos = len(self.buffer)
+                if not self.fill():
+                    return
+                continue
+            self.pos = start
+            match = _p_entry_start.match(self.buffer, start)
+            if match.end() == len(self.buffer) and self.fill():
+                continue  # the start of the block might be incomplete
+
+            block_type, opening = match.groups()
+            block_type = block_type.lower()
+            if not block_type or not opening:
+                # text between entries is ignored
+                self.pos = match.end()
+                continue
+
+            if opening == '{':
+                end = _find_closing(self.buffer, match.end(), _p_braces, '}')
+            else:
+                end = _find_closing(self.buffer, match.end(),
+                                    _p_braces_quote_paren, ')')
+            if end < 0:
+                if (len(self.buffer) - start <= self.max_block_size and
+                        self.fill()):
+                    continue
+                log_warn('Unbalanced brackets in BibTeX entry, skipping it:\n'
+                         '%s' % self.buffer[start:start + 200])
+                self.pos = start + 1
+                resync = True
+                continue
+            self.pos = end + 1
+            if block_type == 'comment':
+                continue
+            yield (block_type, self.buffer[match.end():end],
+                   self.buffer[start:end + 1])
+
+    def entries(self):
+        '''
+        Generator yielding a :class:`BibTeXEntry` for every entry. Entries
+        that cannot be parsed are skipped.
+        '''
+        for block_type, body, text in self.blocks():
+            try:
+                if block_type == 'preamble':
+                    continue
+                elif block_type == 'string':
+                    self.macros.update(_parse_fields(body, 0, self.macros))
+                    continue
+                key_end = body.find(',')
+                if key_end < 0:
+                    key_end = len(body)
+                fields = _parse_fields(body, key_end, self.macros)
+                yield BibTeXEntry(block_type, body[:key_end].strip(), fields,
+                                  text)
+            except ValueError as ex:
+                log_warn('Could not parse BibTeX entry: %s\n%s' % (str(ex),
+                                                                  text[:200]))
+
+
+def iter_entries(source, macros=None):
+    '''
+    Returns an iterator over the :class:`BibTeXEntry` objects in `source`, a
+    string or a file object.
+    '''
+    return BibTeXReader(source, macros).entries()
+
 
 def latex2unicode(s):
     """
-    Not useful at the moment.    
+    Not useful at the moment.
     """
     # TODO: expand this to really work
     return s
 
 
-def paper_info_from_bibtex(data):
-    
-    if data is None:
-        return {}
-
-    # ieee puts <br>s in their bibtex
-    data = data.replace('<br>', '\n')
-
+def _clean_value(value):
+    # remove braces and superfluous spaces (including newlines)
+    return ' '.join(value.replace('{', '').replace('}', '').split())
+
+
+def _split_authors(value):
+    # "and" inside of braces does not separate names, e.g. {Barnes and Noble}
+    authors = []
+    depth = 0
+    start = 0
+    for match in _p_author_separator.finditer(value):
+        if match.group() == '{':
+            depth += 1
+        elif match.group() == '}':
+            depth -= 1
+        elif depth == 0:
+            authors.append(value[start:match.start()])
+            start = match.end()
+    authors.append(value[start:])
+    return [_clean_value(author) for author in authors if author.strip()]
+
+
+def paper_info_from_entry(entry):
+    '''
+    Converts a :class:`BibTeXEntry` into a ``paper_info`` dictionary.
+    '''
+    bibtex = entry.fields
     paper_info = {}
 
-    result = parse_str(data)
-    if len(result) == 0:
-        log_warn('Could not parse BibTeX data')
-        return {}
-    
-    bibtex = {}
-    # FIXME: This does not handle special cases well...
-    for i, r in enumerate(result[0][2:]):
-        bibtex[r[0].lower()] = ''.join([str(r_part) for r_part in r[1:]])
-
     # fix for ACM's doi retardedness
-    if bibtex.get('doi', '').startswith('http://dx.doi.org/'):
-        bibtex['doi'] = bibtex['doi'][ len('http://dx.doi.org/'): ]
-    if bibtex.get('doi', '').startswith('http://doi.acm.org/'):
-        bibtex['doi'] = bibtex['doi'][ len('http://doi.acm.org/'): ]
+    doi = bibtex.get('doi', '')
+    for prefix in ('http://dx.doi.org/', 'http://doi.acm.org/'):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    if doi:
+        bibtex = dict(bibtex, doi=doi)
 
     # Mappings from BibTeX to our keys
     # TODO: Handle more fields
@@ -190,18 +350,40 @@ def paper_info_from_bibtex(data):
 
     for bibtex_key, our_key in mappings.items():
         if bibtex_key in bibtex:
-            log_debug('Have key %s' % bibtex_key)
-            # replace newlines with spaces and remove superfluous spaces
-            paper_info[our_key] = bibtex[bibtex_key].replace('\n', ' ').strip()
+            paper_info[our_key] = _clean_value(bibtex[bibtex_key])
 
     # TODO: Handle editors, etc.?
     if 'author' in bibtex:
-        if ' AND ' in bibtex['author']:
-            paper_info['authors'] = bibtex['author'].split(' AND ')
-        else:
-            paper_info['authors'] = bibtex['author'].split(' and ')
+        paper_info['authors'] = _split_authors(bibtex['author'])
 
-    paper_info['bibtex'] = data
-    log_info('imported paper_info: %s\nFrom bibtex: %s' % (str(paper_info), str(bibtex)))
+    paper_info['bibtex'] = entry.text
+    log_debug('imported paper_info: %s\nFrom bibtex: %s' % (str(paper_info),
+                                                            str(bibtex)))
 
     return paper_info
+
+
+def paper_infos_from_bibtex(source):
+    '''
+    Generator yielding a ``paper_info`` dictionary for every entry in the
+    BibTeX `source` (a string or a file object).
+    '''
+    for entry in iter_entries(source):
+        yield paper_info_from_entry(entry)
+
+
+def paper_info_from_bibtex(data):
+    '''
+    Returns a ``paper_info`` dictionary for the first entry in the BibTeX
+    `data` or an empty dictionary if it does not contain any entries.
+    '''
+    if data is None:
+        return {}
+
+    for entry in iter_entries(data):
+        paper_info = paper_info_from_entry(entry)
+        log_info('imported paper_info: %s' % str(paper_info))
+        return paper_info
+
+    log_warn('Could not parse BibTeX data')
+    return {}
@@ -0,0 +1,217 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Extraction of metadata and text from PDF documents (and of the hashes used
+to find duplicates) in a pool of worker processes, so that importing many
+documents does not block the user interface. All methods of
+:class:`ExtractionService` have to be called from the GTK main loop, the
+callbacks are called there as well.
+'''
+
+from collections import deque
+import multiprocessing
+import traceback
+
+from gi.repository import GObject
+
+from gpapers.gPapers.models import document_digests
+from gpapers.importer import pdf_file
+from gpapers.logger import log_debug, log_error, log_warn
+
+# The key used for the status in the `active_threads` dictionary
+STATUS_KEY = 'pdf_extraction'
+
+
+def _read(data, filename):
+    if data is None:
+        fp = open(filename, 'rb')
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+    return data
+
+
+def _extract(data, filename):
+    '''
+    Runs in a worker process. Returns a tuple ``(True, paper_info)`` or
+    ``(False, error_message)``, as exceptions cannot be passed to a callback.
+    '''
+    try:
+        return (True, pdf_file.get_paper_info_from_pdf(_read(data, filename)))
+    except Exception:
+        return (False, traceback.format_exc())
+
+
+def _digest(data, filename):
+    '''
+    Runs in a worker process. Returns a tuple ``(True, digests)`` (see
+    :func:`gpapers.gPapers.models.document_digests`) or
+    ``(False, error_message)``.
+    '''
+    try:
+        return (True, document_digests(_read(data, filename)))
+    except Exception:
+        return (False, traceback.format_exc())
+
+
+class ExtractionService(object):
+    '''
+    Extracts ``paper_info`` dictionaries (see
+    :func:`gpapers.importer.pdf_file.get_paper_info_from_pdf`) from PDF
+    documents, using `workers` processes (by default one per core). At most
+    `max_queued` documents can wait for their extraction. If `status` is
+    given (usually the `active_threads` dictionary of the main window), it is
+    used to show the number of running and waiting jobs.
+    '''
+
+    def __init__(self, status=None, workers=None, max_queued=256):
+        if workers is None:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        self.workers = workers
+        self.max_queued = max_queued
+        self.status = status
+        self.pool = None
+        self.next_job_id = 0
+        # job ids and arguments of jobs not yet handed to the pool
+        self.waiting = deque()
+        # callbacks of the jobs currently processed by the pool
+        self.running = {}
+
+    def submit(self, callback, data=None, filename=None, error_callback=None,
+               cancel_callback=None):
+        '''
+        Queues the extraction of the PDF given as raw `data` or as a
+        `filename`. When the extraction has finished, ``callback(paper_info)``
+        or, in case of an error, ``error_callback(message)`` is called. If the
+        job is cancelled (see :meth:`cancel`), ``cancel_callback()`` is called
+        instead. Returns an id for the job (that can be used for
+        :meth:`cancel`) or ``None`` if the queue is full.
+        '''
+        return self.queue_job(_extract, callback, data, filename,
+                              error_callback, cancel_callback)
+
+    def submit_digest(self, callback, data=None, filename=None,
+                      error_callback=None, cancel_callback=None):
+        '''
+        Queues the computation of the size and the md5 sums of a document
+        (see :func:`gpapers.gPapers.models.document_digests`), given as for
+        :meth:`submit`. ``callback((size, prefix_md5, md5))`` is called with
+        the result, the other callbacks and the return value are the same as
+        for :meth:`submit`.
+        '''
+        return self.queue_job(_digest, callback, data, filename,
+                              error_callback, cancel_callback)
+
+    def queue_job(self, function, callback, data, filename, error_callback,
+                  cancel_callback):
+        assert data is not None or filename is not None
+        if len(self.waiting) + len(self.running) >= self.max_queued:
+            log_warn('Too many documents waiting for extraction, ignoring %s' %
+                     (filename or 'document'))
+            return None
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        self.waiting.append((job_id, function, data, filename, callback,
+                             error_callback, cancel_callback))
+        self.start_jobs()
+        return job_id
+
+    def cancel(self, job_id):
+        '''
+        Cancels the job with the given id and calls its `cancel_callback`. A
+        job that is already being processed is finished, but its result is
+        discarded.
+        '''
+        for job in self.waiting:
+            if job[0] == job_id:
+                self.waiting.remove(job)
+                cancel_callback = job[6]
+                break
+        else:
+            if not job_id in self.running:
+                return
+            cancel_callback = self.running[job_id][2]
+            # the worker is still busy with the job
+            self.running[job_id] = (None, None, None)
+        self.update_status()
+        if cancel_callback is not None:
+            try:
+                cancel_callback()
+            except:
+                traceback.print_exc()
+
+    def shutdown(self):
+        '''
+        Cancels all jobs (without calling their callbacks) and stops the
+        worker processes.
+        '''
+        self.waiting.clear()
+        self.running.clear()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        self.update_status()
+
+    def start_jobs(self):
+        # Only hand as many jobs to the pool as there are workers, the others
+        # stay in our own queue where they can be cancelled
+        while self.waiting and len(self.running) < self.workers:
+            if self.pool is None:
+                log_debug('Starting %d extraction processes' % self.workers)
+                self.pool = multiprocessing.Pool(self.workers)
+            (job_id, function, data, filename, callback, error_callback,
+             cancel_callback) = self.waiting.popleft()
+            self.running[job_id] = (callback, error_callback, cancel_callback)
+            # the pool calls the callback in a separate thread
+            self.pool.apply_async(function, (data, filename),
+                                  callback=lambda result, job_id=job_id:
+                                    GObject.idle_add(self.job_finished, job_id,
+                                                     result))
+        self.update_status()
+
+    def job_finished(self, job_id, result):
+        if job_id in self.running:
+            callback, error_callback, _ = self.running.pop(job_id)
+            success, value = result
+            try:
+                if success and callback is not None:
+                    callback(value)
+                elif not success:
+                    log_error('Processing PDF failed: %s' % value)
+                    if error_callback is not None:
+                        error_callback(value)
+            except:
+                traceback.print_exc()
+        self.start_jobs()
+        return False  # do not call again (idle callback)
+
+    def update_status(self):
+        if self.status is None:
+            return
+        if self.running or self.waiting:
+            self.status[STATUS_KEY] = ('Extracting data from PDFs '
+                                       '(%d running, %d waiting)' %
+                                       (len(self.running), len(self.waiting)))
+        elif STATUS_KEY in self.status:
+            del self.status[STATUS_KEY]
@@ -117,6 +117,19 @@ class GoogleScholarSearch(WebSearchProvider):
 
         return papers
 
+    def dump_search_result(self, result):
+        # store the HTML of the search result instead of the parsed tree
+        result = dict(result)
+        if 'data' in result:
+            result['data'] = unicode(result['data'])
+        return WebSearchProvider.dump_search_result(self, result)
+
+    def load_search_result(self, value):
+        value = dict(value)
+        if 'data' in value:
+            value['data'] = BeautifulSoup.BeautifulSoup(value['data'])
+        return value
+
     def _got_bibtex(self, message, callback, user_data):
         if message.status_code == Soup.KnownStatusCode.OK:
             bibtex_data = message.response_body.flatten().get_data()
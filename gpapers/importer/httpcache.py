@@ -0,0 +1,333 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+A persistent cache for HTTP responses. :class:`HTTPCache` stores responses on
+disk and decides whether they can be reused, following the ``Cache-Control``,
+``Expires``, ``ETag`` and ``Last-Modified`` headers; it does not depend on
+libsoup. :class:`CachingSession` wraps a ``Soup.Session`` and answers
+``GET`` requests from the cache where possible, stale entries are revalidated
+with a conditional request.
+'''
+
+from email.utils import parsedate_tz, mktime_tz
+import hashlib
+import json
+import os
+import time
+
+from gi.repository import GObject
+from gi.repository import Soup
+
+from gpapers.logger import log_debug, log_warn
+
+# Response headers that are stored with the cached body
+STORED_HEADERS = ('content-type', 'etag', 'last-modified', 'cache-control',
+                  'expires', 'date')
+
+# Request headers that change the response (e.g. content negotiation for DOIs)
+KEY_HEADERS = ('accept', 'cookie')
+
+
+def parse_cache_control(value):
+    '''
+    Returns a dictionary with the directives of a ``Cache-Control`` header,
+    directives without a value are mapped to ``True``.
+    '''
+    directives = {}
+    for directive in (value or '').split(','):
+        directive = directive.strip().lower()
+        if not directive:
+            continue
+        if '=' in directive:
+            name, argument = directive.split('=', 1)
+            directives[name.strip()] = argument.strip().strip('"')
+        else:
+            directives[directive] = True
+    return directives
+
+
+def parse_http_date(value):
+    if not value:
+        return None
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return mktime_tz(parsed)
+
+
+def freshness_lifetime(headers):
+    '''
+    Returns the number of seconds a response with the given `headers` (a
+    dictionary with lower-case names) may be used without revalidation.
+    '''
+    cache_control = parse_cache_control(headers.get('cache-control'))
+    if 'no-cache' in cache_control:
+        return 0
+    if 'max-age' in cache_control:
+        try:
+            return max(0, int(cache_control['max-age']))
+        except ValueError:
+            return 0
+    date = parse_http_date(headers.get('date')) or time.time()
+    expires = parse_http_date(headers.get('expires'))
+    if expires is not None:
+        return max(0, expires - date)
+    last_modified = parse_http_date(headers.get('last-modified'))
+    if last_modified is not None:
+        # heuristic freshness (RFC 2616, 13.2.4), at most a day
+        return min(max(0, (date - last_modified) / 10), 24 * 3600)
+    return 0
+
+
+class HTTPCache(object):
+    '''
+    Stores HTTP responses in `directory`, using at most `max_size` bytes. If
+    the cache gets too large, the least recently used entries are removed.
+    '''
+
+    def __init__(self, directory, max_size=50 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        # key -> (size, last use), read from the directory on first use
+        self._entries = None
+
+    def key(self, method, uri, request_headers):
+        '''
+        Returns the key for a request, `request_headers` is a dictionary with
+        lower-case header names.
+        '''
+        parts = [method, uri] + [request_headers.get(name) or ''
+                                 for name in KEY_HEADERS]
+        return hashlib.sha1('\n'.join(parts)).hexdigest()
+
+    def is_cacheable(self, method, status, headers):
+        if method != 'GET' or status != 200:
+            return False
+        cache_control = parse_cache_control(headers.get('cache-control'))
+        if 'no-store' in cache_control:
+            return False
+        return (freshness_lifetime(headers) > 0 or 'etag' in headers or
+                'last-modified' in headers)
+
+    def entries(self):
+        if self._entries is None:
+            self._entries = {}
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith('.tmp'):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                self._entries[name] = (stat.st_size, stat.st_mtime)
+        return self._entries
+
+    def lookup(self, key):
+        '''
+        Returns ``(headers, body, fresh)`` for a cached response or ``None``.
+        `fresh` states whether the response can be used without
+        revalidation.
+        '''
+        if not key in self.entries():
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            fp = open(path, 'rb')
+            try:
+                meta = json.loads(fp.readline())
+                body = fp.read()
+            finally:
+                fp.close()
+        except (IOError, ValueError) as ex:
+            log_warn('Removing broken cache entry %s: %s' % (key, str(ex)))
+            self.remove(key)
+            return None
+        now = time.time()
+        self._entries[key] = (self._entries[key][0], now)
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        headers = meta['headers']
+        fresh = now - meta['stored'] < freshness_lifetime(headers)
+        return headers, body, fresh
+
+    def store(self, key, headers, body):
+        '''
+        Stores a response with the given `headers` (only those in
+        :data:`STORED_HEADERS` are kept) and `body`.
+        '''
+        self.entries()
+        headers = dict([(name, value) for name, value in headers.items()
+                        if name in STORED_HEADERS and value is not None])
+        path = os.path.join(self.directory, key)
+        try:
+            fp = open(path + '.tmp', 'wb')
+            try:
+                fp.write(json.dumps({'headers': headers,
+                                     'stored': time.time()}) + '\n')
+                fp.write(body)
+            finally:
+                fp.close()
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError) as ex:
+            log_warn('Could not write cache entry %s: %s' % (key, str(ex)))
+            return
+        self._entries[key] = (os.path.getsize(path), time.time())
+        self.evict()
+
+    def refresh(self, key, headers):
+        '''
+        Updates a cached response after a successful revalidation (a "304 Not
+        Modified" response with the given `headers`).
+        '''
+        cached = self.lookup(key)
+        if cached is None:
+            return
+        cached_headers, body, fresh = cached
+        cached_headers.update(dict([(name, value)
+                                    for name, value in headers.items()
+                                    if value is not None]))
+        self.store(key, cached_headers, body)
+
+    def remove(self, key):
+        self.entries().pop(key, None)
+        try:
+            os.remove(os.path.join(self.directory, key))
+        except OSError:
+            pass
+
+    def evict(self):
+        entries = self.entries()
+        total = sum([size for size, last_used in entries.values()])
+        if total <= self.max_size:
+            return
+        for key in sorted(entries, key=lambda key: entries[key][1]):
+            if total <= self.max_size:
+                break
+            total -= entries[key][0]
+            log_debug('Evicting %s from the HTTP cache' % key)
+            self.remove(key)
+
+
+def _get_headers(message_headers, names):
+    return dict([(name, message_headers.get_one(name)) for name in names])
+
+
+class CachingSession(object):
+    '''
+    Wraps the ``Soup.Session`` `session`, answering requests from the
+    :class:`HTTPCache` `cache` where possible. All other attributes are
+    passed on to the session. The `session` can also be a
+    :class:`gpapers.importer.scheduler.RequestScheduler`, additional keyword
+    arguments of :meth:`queue_message` (e.g. the priority) are passed on to
+    it.
+    '''
+
+    def __init__(self, session, cache):
+        self.session = session
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def queue_message(self, message, callback, user_data, **options):
+        method = message.method
+        uri = message.get_uri().to_string(False)
+        if method != 'GET':
+            return self.session.queue_message(message, callback, user_data,
+                                              **options)
+
+        key = self.cache.key(method, uri, self.key_headers(message))
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            headers, body, fresh = cached
+            if fresh:
+                log_debug('Using cached response for %s' % uri)
+                self.fill_message(message, headers, body)
+
+                def cached_response():
+                    callback(self.session, message, user_data)
+                    return False  # do not call again
+
+                # keep the callback asynchronous
+                GObject.idle_add(cached_response)
+                return
+            # ask the server whether the cached response is still valid
+            if headers.get('etag'):
+                message.request_headers.replace('If-None-Match',
+                                                headers['etag'])
+            if headers.get('last-modified'):
+                message.request_headers.replace('If-Modified-Since',
+                                                headers['last-modified'])
+
+        def response_received(session, message, data):
+            try:
+                status = message.status_code
+                headers = _get_headers(message.response_headers,
+                                       STORED_HEADERS)
+                if status == Soup.KnownStatusCode.NOT_MODIFIED and cached:
+                    log_debug('Cached response for %s is still valid' % uri)
+                    self.cache.refresh(key, headers)
+                    cached_headers, body, fresh = cached
+                    cached_headers.update(dict([(name, value) for name, value
+                                                in headers.items() if value]))
+                    self.fill_message(message, cached_headers, body)
+                elif self.cache.is_cacheable(method, status, headers):
+                    # the headers as they were sent
+                    sent_headers = _get_headers(message.request_headers,
+                                                KEY_HEADERS)
+                    self.cache.store(self.cache.key(method, uri, sent_headers),
+                                     headers,
+                                     message.response_body.flatten().get_data())
+            except Exception as ex:
+                log_warn('HTTP cache error for %s: %s' % (uri, str(ex)))
+            callback(session, message, data)
+
+        self.session.queue_message(message, response_received, user_data,
+                                   **options)
+
+    def key_headers(self, message):
+        '''
+        Returns the headers in :data:`KEY_HEADERS` as they will be sent for
+        `message`. A cookie jar of the session only sets the ``Cookie``
+        header when the message is sent, replacing any header set before.
+        '''
+        headers = _get_headers(message.request_headers, KEY_HEADERS)
+        jar = self.session.get_feature(Soup.CookieJar)
+        if jar is not None:
+            headers['cookie'] = jar.get_cookies(message.get_uri(), True)
+        return headers
+
+    def fill_message(self, message, headers, body):
+        '''
+        Turns `message` into a successful response with the given cached
+        `headers` and `body`.
+        '''
+        message.set_status(Soup.KnownStatusCode.OK)
+        for name, value in headers.items():
+            if name != 'content-type':
+                message.response_headers.replace(name, value)
+        message.set_response(headers.get('content-type') or
+                             'application/octet-stream', Soup.MemoryUse.COPY,
+                             body)
+        # makes the body available as `response_body.data`
+        message.response_body.flatten()
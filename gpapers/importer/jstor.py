@@ -101,3 +101,16 @@ class JSTORSearch(WebSearchProvider):
             papers.append(paper)
 
         return papers
+
+    def dump_search_result(self, result):
+        # store the XML of the search result instead of the parsed tree
+        result = dict(result)
+        if 'data' in result:
+            result['data'] = unicode(result['data'])
+        return WebSearchProvider.dump_search_result(self, result)
+
+    def load_search_result(self, value):
+        value = dict(value)
+        if 'data' in value:
+            value['data'] = BeautifulStoneSoup(value['data'])
+        return value
@@ -26,6 +26,7 @@ from pdfminer.pdfinterp import PDFResourceManager, process_pdf
 from pdfminer.layout import LAParams
 from pdfminer.converter import TextConverter
 
+from gpapers.importer.references import extract_references
 from gpapers.logger import log_debug
 
 # A DOI consists of a numeric prefix starting with "10." followed by "/" and
@@ -91,6 +92,11 @@ def get_paper_info_from_pdf(data):
             log_debug('Found a DOI: %s' % doi)
             paper_info['doi'] = doi
 
+    references = extract_references(paper_info['extracted_text'])
+    if references:
+        log_debug('Found %d references' % len(references))
+        paper_info['references'] = references
+
     device.close()
     content.close()
 
@@ -0,0 +1,272 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Import of documents from the file system. The documents pass through the
+stages walk (finding the files), duplicate check (documents are only hashed,
+in an extraction process, if the library contains a document of the same
+size, see :func:`gpapers.gPapers.models.find_paper_by_digests`), read,
+extract (see :mod:`gpapers.importer.extraction`) and persist. Only a limited
+number of documents is between the read and the persist stage at any time,
+the next file is only read when a document has left the pipeline. Importing
+a large directory therefore needs a constant amount of memory.
+
+:class:`MetadataImport` imports papers without documents (e.g. all entries
+of a BibTeX file) in batches, see
+:func:`gpapers.gPapers.models.bulk_import_papers`.
+'''
+
+import itertools
+import mimetypes
+import os
+
+from gi.repository import Gio
+from gi.repository import GObject
+
+from gpapers.gPapers.models import (find_paper_by_digests,
+                                    has_documents_of_size)
+from gpapers.logger import log_debug, log_info, log_warn
+
+_pipeline_ids = itertools.count()
+
+
+def walk_documents(filenames):
+    '''
+    Generator yielding all PDF files in the given list of files and
+    directories (searched recursively).
+    '''
+    for filename in filenames:
+        if os.path.isdir(filename):
+            for dirpath, dirnames, contained in os.walk(filename):
+                dirnames.sort()
+                for name in sorted(contained):
+                    path = os.path.join(dirpath, name)
+                    if mimetypes.guess_type(path)[0] == 'application/pdf':
+                        yield path
+        elif mimetypes.guess_type(filename)[0] == 'application/pdf':
+            #TODO: Also allow other file types like ps.gz
+            yield filename
+
+
+class ImportPipeline(object):
+    '''
+    Imports all PDF documents in `filenames` (files or directories). The
+    metadata is extracted with the
+    :class:`gpapers.importer.extraction.ExtractionService` `extraction_service`
+    and ``store_callback(paper_info, paper_data)`` is called for every
+    document that is not yet part of the library. The callback returns
+    ``(paper, created)``, with `created` being ``False`` if the document
+    turned out to be a duplicate after all (e.g. if `filenames` contains the
+    same document twice). At most `max_in_flight`
+    documents are processed at the same time (by default twice the number of
+    extraction processes). The progress is shown in the `status` dictionary
+    (the `active_threads` of the main window).
+    '''
+
+    def __init__(self, filenames, store_callback, extraction_service,
+                 status=None, max_in_flight=None):
+        self.documents = walk_documents(filenames)
+        self.store_callback = store_callback
+        self.extraction_service = extraction_service
+        self.status = status
+        if max_in_flight is None:
+            max_in_flight = 2 * extraction_service.workers
+        self.max_in_flight = max_in_flight
+        self.status_key = 'import_pipeline_%d' % _pipeline_ids.next()
+        self.in_flight = 0
+        self.finished = False
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    def start(self):
+        log_info('Starting import pipeline %s' % self.status_key)
+        self.fill()
+
+    def fill(self):
+        # walk: take new files from the generator as long as there is room
+        while not self.finished and self.in_flight < self.max_in_flight:
+            try:
+                filename = self.documents.next()
+            except StopIteration:
+                self.finished = True
+                break
+            except OSError as ex:
+                log_warn('Cannot list documents: %s' % str(ex))
+                continue
+            self.in_flight += 1
+            self.check_duplicate(filename)
+        self.update_status()
+
+    def check_duplicate(self, filename):
+        # only documents with the size of a document in the library have to
+        # be hashed
+        try:
+            size = os.path.getsize(filename)
+        except OSError as ex:
+            log_warn('Could not read %s: %s' % (filename, str(ex)))
+            self.document_done(failed=True)
+            return
+        if not has_documents_of_size(size):
+            self.read(filename)
+            return
+
+        def digested(digests):
+            paper_id = find_paper_by_digests(*digests)
+            if paper_id is not None:
+                log_info('%s is already in the library (paper %d), skipping '
+                         'it' % (filename, paper_id))
+                self.document_done(duplicate=True)
+            else:
+                self.read(filename)
+
+        def digest_failed(message):
+            self.document_done(failed=True)
+
+        job = self.extraction_service.submit_digest(
+            digested, filename=filename, error_callback=digest_failed,
+            cancel_callback=lambda: self.job_cancelled(filename))
+        if job is None:
+            self.document_done(failed=True)
+
+    def job_cancelled(self, filename):
+        log_info('Processing of %s was cancelled' % filename)
+        self.document_done(failed=True)
+
+    def read(self, filename):
+        gfile = Gio.File.new_for_path(filename)
+        # first argument is the `cancellable` object
+        gfile.load_contents_async(None, self.file_read, filename)
+
+    def file_read(self, gfile, result, filename):
+        try:
+            paper_data = gfile.load_contents_finish(result)[1]
+        except Exception as ex:
+            log_warn('Could not read %s: %s' % (filename, str(ex)))
+            self.document_done(failed=True)
+            return
+
+        # extract
+        def extracted(paper_info):
+            self.persist(paper_info, paper_data)
+
+        def extraction_failed(message):
+            # Still import the document, with the info we have
+            self.persist({}, paper_data)
+
+        job = self.extraction_service.submit(
+            extracted, data=paper_data, error_callback=extraction_failed,
+            cancel_callback=lambda: self.job_cancelled(filename))
+        if job is None:
+            self.document_done(failed=True)
+
+    def persist(self, paper_info, paper_data):
+        try:
+            paper, created = self.store_callback(paper_info, paper_data)
+        except Exception as ex:
+            log_warn('Could not store document: %s' % str(ex))
+            self.document_done(failed=True)
+        else:
+            self.document_done(duplicate=not created)
+
+    def document_done(self, duplicate=False, failed=False):
+        self.in_flight -= 1
+        if duplicate:
+            self.duplicates += 1
+        elif failed:
+            self.failed += 1
+        else:
+            self.imported += 1
+        self.fill()
+        if self.finished and not self.in_flight:
+            log_info('Import pipeline %s finished: %d imported, '
+                     '%d duplicates, %d failed' % (self.status_key,
+                                                   self.imported,
+                                                   self.duplicates,
+                                                   self.failed))
+
+    def update_status(self):
+        if self.status is None:
+            return
+        if self.in_flight or not self.finished:
+            done = self.imported + self.duplicates + self.failed
+            self.status[self.status_key] = ('Importing documents (%d done, '
+                                            '%d in progress)' %
+                                            (done, self.in_flight))
+        elif self.status_key in self.status:
+            del self.status[self.status_key]
+        log_debug('Import pipeline %s: %d in flight' % (self.status_key,
+                                                        self.in_flight))
+
+
+class MetadataImport(object):
+    '''
+    Stores the ``paper_info`` dictionaries in the iterable `paper_infos`
+    (e.g. the generator returned by
+    :func:`gpapers.importer.bibtex.paper_infos_from_bibtex`) in batches of
+    `batch_size` papers, calling ``store_callback(batch)`` with a list of
+    dictionaries from an idle callback, so that the user interface stays
+    responsive. The callback returns the ids of the new papers. When all
+    papers are stored, ``finished_callback(paper_ids)`` is called if it is
+    given. The progress is shown in the `status` dictionary.
+    '''
+
+    def __init__(self, paper_infos, store_callback, status=None,
+                 batch_size=500, finished_callback=None):
+        self.paper_infos = iter(paper_infos)
+        self.store_callback = store_callback
+        self.status = status
+        self.batch_size = batch_size
+        self.finished_callback = finished_callback
+        self.status_key = 'metadata_import_%d' % _pipeline_ids.next()
+        self.paper_ids = []
+        self.failed = 0
+
+    def start(self):
+        log_info('Starting metadata import %s' % self.status_key)
+        GObject.idle_add(self.import_batch)
+
+    def import_batch(self):
+        try:
+            batch = list(itertools.islice(self.paper_infos, self.batch_size))
+        except (IOError, OSError) as ex:
+            log_warn('Could not read papers: %s' % str(ex))
+            batch = []
+        if batch:
+            try:
+                self.paper_ids.extend(self.store_callback(batch))
+            except Exception as ex:
+                log_warn('Could not store %d papers: %s' % (len(batch),
+                                                             str(ex)))
+                self.failed += len(batch)
+
+        if len(batch) == self.batch_size:
+            if self.status is not None:
+                self.status[self.status_key] = ('Importing papers (%d done)' %
+                                                (len(self.paper_ids) +
+                                                 self.failed))
+            return True  # continue with the next batch
+
+        log_info('Metadata import %s finished: %d imported, %d failed' %
+                 (self.status_key, len(self.paper_ids), self.failed))
+        if self.status is not None and self.status_key in self.status:
+            del self.status[self.status_key]
+        if self.finished_callback is not None:
+            self.finished_callback(self.paper_ids)
+        return False  # do not call again
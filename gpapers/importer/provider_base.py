@@ -20,11 +20,16 @@
 '''
 This module contains the base class for all search providers
 '''
+import os
+import time
+
+from django.conf import settings
 from gi.repository import Soup
 
-from gpapers.logger import log_info, log_debug
+from gpapers.logger import log_info, log_debug, log_error
 from gpapers.importer import soup_session
 from gpapers.importer import active_threads
+from gpapers.importer.search_cache import SearchCache, plain_value
 
 class WebSearchProvider(object):
     '''
@@ -51,6 +56,11 @@ class WebSearchProvider(object):
         database. For a PubMED search, for example, this should be
         'pubmed_id'. If the unique key is not set, 'doi' is used
         as a default.
+    `cache_ttl`
+        The number of seconds for which search results are reused (one day
+        by default). Results are cached in memory and in a file per search
+        provider, searches that only differ in whitespace or case share their
+        results.
 
     In the simplest case (for the search, a single request to a website is 
     sufficient and that is all the data that is needed for an import), it is
@@ -88,21 +98,36 @@ class WebSearchProvider(object):
     :meth:`import_papers_after_search` which otherwise will call
     :meth:`import_paper_after_search` for each paper.
     
+    If the search results contain objects in their 'data' entry that cannot
+    be saved to disk (e.g. parsed HTML), :meth:`dump_search_result` and
+    :meth:`load_search_result` should be overwritten, otherwise the results
+    are only cached in memory.
+
     Note that if the subclass overwrites the :meth:`__init__` method, it has
     to call the :meth:`__init__` of its superclass.        
     '''
 
     unique_key = 'doi'
+    cache_ttl = 24 * 3600
 
-    def __init__(self):
+    def __init__(self, search_cache=None):
         '''
         Initializes the cache for previous search results (should be called
-        by overriding implementations in subclasses).
+        by overriding implementations in subclasses). Instead of the default
+        :class:`gpapers.importer.search_cache.SearchCache`, any object with
+        the same `get`, `put` and `remove` methods can be given as
+        `search_cache`.
         '''
         # Remember previous search results so that no new search is necessary.
         # Useful especially if switching between libraries/searches in the left
-        # pane
-        self.search_cache = {}
+        # pane and for saved searches after a restart
+        if search_cache is None:
+            filename = os.path.join(settings.DATA_DIR, 'search_cache',
+                                    self.label)
+            search_cache = SearchCache(ttl=self.cache_ttl, filename=filename,
+                                       dump_result=self.dump_search_result,
+                                       load_result=self.load_search_result)
+        self.search_cache = search_cache
 
     def __str__(self):
         '''
@@ -114,8 +139,22 @@ class WebSearchProvider(object):
         '''
         Delete search results for `text` from the cache.
         '''
-        if text in self.search_cache:
-            del self.search_cache[text]
+        self.search_cache.remove(text)
+
+    def dump_search_result(self, result):
+        '''
+        Converts a single search result (see :meth:`search_async`) into an
+        object consisting only of basic Python types, so that it can be saved
+        to disk. Raises an exception if this is not possible.
+        '''
+        return plain_value(result)
+
+    def load_search_result(self, value):
+        '''
+        Restores a search result saved with :meth:`dump_search_result`. Must
+        not change `value` but return a new object if necessary.
+        '''
+        return value
 
     def search_async(self, search_string, callback, error_callback):
         '''
@@ -167,9 +206,10 @@ class WebSearchProvider(object):
             callback(user_data, [])
             return
 
-        if search_string in self.search_cache:
+        cached_results = self.search_cache.get(search_string)
+        if cached_results is not None:
             log_debug('Result for "%s" already in cache.' % search_string)
-            callback(user_data, self.search_cache[search_string])
+            callback(user_data, cached_results)
             return
 
         log_info('Search for "%s" is not cached by this provider, starting new search' % search_string)
@@ -182,7 +222,7 @@ class WebSearchProvider(object):
                 provider) to the call.
                 '''
                 log_debug('Saving %s in cache for "%s"' % (search_results, search_string))
-                self.search_cache[search_string] = search_results
+                self.search_cache.put(search_string, search_results)
                 callback(user_data, search_results)
 
             self.search_async(search_string, callback_wrapper, error_callback)
@@ -0,0 +1,154 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Extraction of the references from the text of a paper: the bibliography is
+located by its heading, split into entries (numbered entries like ``[1]`` or
+``1.``, otherwise paragraphs) and the DOIs and arXiv identifiers of every
+entry are extracted. Used by
+:func:`gpapers.importer.pdf_file.get_paper_info_from_pdf`, this module only
+works on text and does not access the database.
+'''
+
+import re
+
+# Headings that start the bibliography, on a line of their own
+p_heading = re.compile(r'^\s*(?:[0-9IVX]+\.?\s*)?(references|bibliography|'
+                       r'literature cited|works cited|references and notes|'
+                       r'cited literature)\s*:?\s*$',
+                       re.IGNORECASE | re.MULTILINE)
+# Headings that end the bibliography
+p_end_heading = re.compile(r'^\s*(?:[A-Z0-9]+\.?\s*)?(appendix|appendices|'
+                           r'supplementary (?:material|information))\b.{0,40}$',
+                           re.IGNORECASE | re.MULTILINE)
+# Start of a numbered entry: "[12]" or "12." at the start of a line
+p_bracket_number = re.compile(r'^\s*\[(\d{1,3})\]\s*', re.MULTILINE)
+p_dot_number = re.compile(r'^\s*(\d{1,3})\.\s+(?=\S)', re.MULTILINE)
+# A DOI in a reference, possibly written as an URL
+p_doi = re.compile(r'(?:doi\s*:?\s*|doi\.org/)?(10\.\d{4,9}/[^\s"<>]+)',
+                   re.IGNORECASE)
+# New style (1234.5678, optionally with version) and old style
+# (hep-th/9901001) arXiv identifiers
+p_arxiv = re.compile(r'arxiv\s*(?:\.org/abs/|:)?\s*'
+                     r'(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})'
+                     r'(?:v\d+)?', re.IGNORECASE)
+# A word broken at the end of a line
+p_hyphenation = re.compile(r'(\w)-\n(\w)', re.UNICODE)
+
+# Entries longer than this are most likely not references
+MAX_ENTRY_LENGTH = 1000
+MIN_ENTRY_LENGTH = 20
+
+
+def find_bibliography(text):
+    '''
+    Returns the part of `text` after the last bibliography heading (up to an
+    appendix or similar heading), or ``None`` if there is no such heading.
+    '''
+    start = None
+    for match in p_heading.finditer(text):
+        start = match.end()
+    if start is None:
+        return None
+    section = text[start:]
+    end = p_end_heading.search(section)
+    if end is not None:
+        section = section[:end.start()]
+    return section
+
+
+def _split_numbered(section, pattern):
+    matches = list(pattern.finditer(section))
+    # the numbers have to increase (mostly) to count as numbered entries
+    numbers = [int(match.group(1)) for match in matches]
+    increasing = sum(1 for first, second in zip(numbers, numbers[1:])
+                     if second == first + 1)
+    if len(matches) < 2 or increasing < (len(matches) - 1) / 2.0:
+        return None
+    entries = []
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        end = next_match.start() if next_match is not None else len(section)
+        entries.append(section[match.end():end])
+    return entries
+
+
+def split_references(section):
+    '''
+    Splits the text of a bibliography into its entries.
+    '''
+    for pattern in (p_bracket_number, p_dot_number):
+        entries = _split_numbered(section, pattern)
+        if entries is not None:
+            break
+    else:
+        # no numbering: entries are separated by empty lines
+        entries = re.split(r'\n\s*\n', section)
+    result = []
+    for entry in entries:
+        entry = p_hyphenation.sub(r'\1\2', entry.strip())
+        entry = ' '.join(entry.split())
+        if MIN_ENTRY_LENGTH <= len(entry) <= MAX_ENTRY_LENGTH:
+            result.append(entry)
+    return result
+
+
+def find_doi(text):
+    '''
+    Returns the first DOI in `text` (without trailing punctuation) or
+    ``None``.
+    '''
+    match = p_doi.search(text)
+    if match is None:
+        return None
+    return match.group(1).rstrip('.,;:)]}')
+
+
+def find_arxiv_id(text):
+    '''
+    Returns the first arXiv identifier (without version) in `text` or
+    ``None``.
+    '''
+    match = p_arxiv.search(text)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def extract_references(text):
+    '''
+    Returns a list of dictionaries for the references in the `text` of a
+    paper, with the keys ``'line'`` (the text of the entry) and, if they were
+    found, ``'doi'`` and ``'arxiv_id'``.
+    '''
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    section = find_bibliography(text)
+    if section is None:
+        return []
+    references = []
+    for entry in split_references(section):
+        reference = {'line': entry}
+        doi = find_doi(entry)
+        if doi is not None:
+            reference['doi'] = doi
+        arxiv_id = find_arxiv_id(entry)
+        if arxiv_id is not None:
+            reference['arxiv_id'] = arxiv_id
+        references.append(reference)
+    return references
@@ -0,0 +1,277 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Scheduling of HTTP requests. :class:`RequestScheduler` wraps a
+``Soup.Session`` and limits the number of requests sent to each host, both
+the number of concurrent requests and the request rate (with a
+:class:`TokenBucket`). Requests are sent in the order of their priority
+(:data:`INTERACTIVE` before :data:`BACKGROUND`), requests for the same
+resource are only sent once and requests that failed temporarily are
+repeated after a growing delay.
+'''
+
+import heapq
+import itertools
+import time
+import traceback
+
+from gi.repository import GObject
+from gi.repository import Soup
+
+from gpapers.importer.httpcache import KEY_HEADERS
+from gpapers.logger import log_debug, log_info, log_warn
+
+# Priorities of requests, lower values are sent first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Limits per host: (concurrent requests, requests per second, burst size)
+DEFAULT_LIMITS = (4, 5.0, 10)
+HOST_LIMITS = {'dx.doi.org': (2, 2.0, 5)}
+
+# Status codes of temporary failures: could not resolve/connect, I/O error,
+# "try again" and the HTTP status codes for timeouts and overload
+RETRY_STATUS = frozenset([2, 4, 7, 9, 408, 429, 502, 503, 504])
+# Status codes that tell us to slow down
+THROTTLE_STATUS = frozenset([429, 503])
+
+
+class TokenBucket(object):
+    '''
+    Allows `rate` requests per second on average and up to `capacity`
+    requests at once.
+    '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        '''
+        Returns the number of seconds until the next request is allowed.
+        '''
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0)
+
+
+def copy_message(message):
+    '''
+    Returns a new ``Soup.Message`` for the same (body-less) request, a
+    message can only be sent once.
+    '''
+    copy = Soup.Message.new(method=message.method,
+                            uri_string=message.get_uri().to_string(False))
+    message.request_headers.foreach(lambda name, value, data:
+                                        copy.request_headers.append(name,
+                                                                    value),
+                                    None)
+    return copy
+
+
+class _Request(object):
+
+    def __init__(self, message, key, priority):
+        self.message = message
+        self.key = key
+        self.priority = priority
+        self.host = message.get_uri().host
+        self.callbacks = []
+        self.attempts = 0
+        self.waiting = True
+
+
+class RequestScheduler(object):
+    '''
+    Wraps the ``Soup.Session`` `session`, all attributes except
+    :meth:`queue_message` are passed on to the session. `host_limits` maps
+    host names to their limits, other hosts use `default_limits` (see
+    :data:`HOST_LIMITS` and :data:`DEFAULT_LIMITS`). Temporary failures are
+    retried `max_retries` times, after `backoff` seconds, twice that time,
+    etc. (or the time the server asks for).
+    '''
+
+    def __init__(self, session, host_limits=None,
+                 default_limits=DEFAULT_LIMITS, max_retries=3, backoff=1.0):
+        self.session = session
+        if host_limits is None:
+            host_limits = HOST_LIMITS
+        self.host_limits = host_limits
+        self.default_limits = default_limits
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # heap of (priority, sequence number, request), entries whose request
+        # has been sent or got a higher priority are skipped
+        self.pending = []
+        self.sequence = itertools.count()
+        # key -> request, for requests that are waiting or running
+        self.requests = {}
+        self.running = {}
+        self.buckets = {}
+        self.timer = None
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def queue_message(self, message, callback, user_data,
+                      priority=INTERACTIVE):
+        '''
+        Queues `message` like ``Soup.Session.queue_message``, sending it
+        according to its `priority` and the limits for its host. If a
+        ``GET`` request for the same resource is already queued, no new
+        request is sent -- the `callback` then receives the message of the
+        earlier request.
+        '''
+        if message.method == 'GET':
+            key = (message.method, message.get_uri().to_string(False)) + \
+                tuple([message.request_headers.get_one(name) or ''
+                       for name in KEY_HEADERS])
+        else:
+            key = None
+
+        request = self.requests.get(key) if key is not None else None
+        if request is not None:
+            log_debug('Request for %s is already queued' % key[1])
+            request.callbacks.append((callback, user_data))
+            if request.waiting and priority < request.priority:
+                request.priority = priority
+                heapq.heappush(self.pending, (priority, self.sequence.next(),
+                                              request))
+                self.dispatch()
+            return
+
+        request = _Request(message, key, priority)
+        request.callbacks.append((callback, user_data))
+        if key is not None:
+            self.requests[key] = request
+        heapq.heappush(self.pending, (priority, self.sequence.next(),
+                                      request))
+        self.dispatch()
+
+    def get_limits(self, host):
+        return self.host_limits.get(host, self.default_limits)
+
+    def get_bucket(self, host):
+        if not host in self.buckets:
+            concurrent, rate, burst = self.get_limits(host)
+            self.buckets[host] = TokenBucket(rate, burst)
+        return self.buckets[host]
+
+    def dispatch(self):
+        '''
+        Sends all requests that are allowed by the limits of their host.
+        '''
+        now = time.time()
+        postponed = []
+        wait = None
+        while self.pending:
+            entry = heapq.heappop(self.pending)
+            priority, sequence, request = entry
+            if not request.waiting or priority != request.priority:
+                continue  # outdated entry
+            concurrent = self.get_limits(request.host)[0]
+            if priority != INTERACTIVE:
+                # keep a connection free for interactive requests
+                concurrent = max(1, concurrent - 1)
+            if self.running.get(request.host, 0) >= concurrent:
+                postponed.append(entry)
+                continue
+            bucket = self.get_bucket(request.host)
+            delay = bucket.wait_time(now)
+            if delay > 0:
+                postponed.append(entry)
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            bucket.consume(now)
+            self.send(request)
+
+        for entry in postponed:
+            heapq.heappush(self.pending, entry)
+        if wait is not None:
+            self.dispatch_later(wait)
+
+    def dispatch_later(self, delay):
+        if self.timer is not None:
+            GObject.source_remove(self.timer)
+        self.timer = GObject.timeout_add(int(delay * 1000) + 1,
+                                         self.timer_expired)
+
+    def timer_expired(self):
+        self.timer = None
+        self.dispatch()
+        return False  # do not call again
+
+    def send(self, request):
+        request.waiting = False
+        self.running[request.host] = self.running.get(request.host, 0) + 1
+        self.session.queue_message(request.message, self.response_received,
+                                   request)
+
+    def response_received(self, session, message, request):
+        self.running[request.host] -= 1
+        status = message.status_code
+        if status in THROTTLE_STATUS:
+            self.get_bucket(request.host).drain()
+
+        if (status in RETRY_STATUS and request.key is not None and
+                request.attempts < self.max_retries):
+            delay = self.backoff * 2 ** request.attempts
+            retry_after = message.response_headers.get_one('Retry-After')
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            request.attempts += 1
+            log_info('Request for %s failed with status %d, trying again in '
+                     '%.1fs' % (request.key[1], status, delay))
+            request.message = copy_message(message)
+            GObject.timeout_add(int(delay * 1000), self.retry, request)
+        else:
+            if status in RETRY_STATUS:
+                log_warn('Request for %s failed with status %d' %
+                         (message.get_uri().to_string(False), status))
+            if request.key is not None:
+                del self.requests[request.key]
+            for callback, user_data in request.callbacks:
+                try:
+                    callback(session, message, user_data)
+                except:
+                    traceback.print_exc()
+        self.dispatch()
+
+    def retry(self, request):
+        request.waiting = True
+        heapq.heappush(self.pending, (request.priority, self.sequence.next(),
+                                      request))
+        self.dispatch()
+        return False  # do not call again
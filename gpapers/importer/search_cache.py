@@ -0,0 +1,204 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+A cache for the results of web searches, used by
+:class:`gpapers.importer.provider_base.WebSearchProvider`. The cache holds a
+limited number of searches (and bytes), removing the least recently used ones
+first, and search results expire after a given time. If a filename is given,
+the searches are also saved to disk so that they are still available after a
+restart.
+'''
+
+from collections import OrderedDict
+import cPickle as pickle
+import datetime
+import os
+import time
+
+from gpapers.logger import log_debug, log_warn
+
+
+def normalize_search(search_string):
+    '''
+    Returns the key used for `search_string`: searches that only differ in
+    whitespace or case share their results.
+    '''
+    return u' '.join(search_string.lower().split())
+
+
+def plain_value(value):
+    '''
+    Returns a copy of `value` that only consists of basic Python types (e.g.
+    converting BeautifulSoup's ``NavigableString`` to ``unicode``), raises a
+    ``TypeError`` for any other object.
+    '''
+    if value is None or isinstance(value, (bool, int, long, float,
+                                           datetime.date)):
+        return value
+    if isinstance(value, unicode):
+        return unicode(value)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [plain_value(item) for item in value]
+    if isinstance(value, dict):
+        return dict([(plain_value(key), plain_value(item))
+                     for key, item in value.items()])
+    raise TypeError('Cannot store objects of type %s' % type(value).__name__)
+
+
+class SearchCache(object):
+    '''
+    Stores search results for at most `max_entries` searches, using roughly
+    `max_size` bytes. Results older than `ttl` seconds are not returned any
+    more (``None`` means they never expire). If `filename` is given, the
+    cache is read from and written to this file.
+
+    `dump_result` and `load_result` convert a single search result to an
+    object that can be pickled and back again (see
+    :meth:`gpapers.importer.provider_base.WebSearchProvider.dump_search_result`).
+    Searches with results that cannot be converted are only kept in memory.
+    '''
+
+    def __init__(self, max_entries=50, max_size=5 * 1024 * 1024,
+                 ttl=24 * 3600, filename=None, dump_result=plain_value,
+                 load_result=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.ttl = ttl
+        self.filename = filename
+        self.dump_result = dump_result
+        self.load_result = load_result
+        # key -> (time stored, size, search results, dumped search results),
+        # the least recently used search comes first. Read from the file on
+        # first use.
+        self._entries = None
+
+    def entries(self):
+        if self._entries is None:
+            self._entries = OrderedDict()
+            if self.filename is not None and os.path.exists(self.filename):
+                self.load()
+        return self._entries
+
+    def get(self, search_string):
+        '''
+        Returns the cached results for `search_string` or ``None``.
+        '''
+        entries = self.entries()
+        key = normalize_search(search_string)
+        if not key in entries:
+            return None
+        stored, size, results, dumped = entries.pop(key)
+        if self.ttl is not None and time.time() - stored > self.ttl:
+            log_debug('Cached results for "%s" have expired' % key)
+            self.save()
+            return None
+        if results is None:
+            # loaded from disk, convert only when needed
+            try:
+                results = [self.load_result(result) if self.load_result
+                           else result for result in dumped]
+            except Exception as ex:
+                log_warn('Cannot use stored results for "%s": %s' % (key,
+                                                                     str(ex)))
+                self.save()
+                return None
+        entries[key] = (stored, size, results, dumped)
+        return results
+
+    def put(self, search_string, results):
+        '''
+        Stores `results` (a list of dictionaries) for `search_string`.
+        '''
+        entries = self.entries()
+        key = normalize_search(search_string)
+        entries.pop(key, None)
+        try:
+            dumped = [self.dump_result(result) for result in results]
+            size = len(pickle.dumps(dumped, pickle.HIGHEST_PROTOCOL))
+        except Exception as ex:
+            log_debug('Search results for "%s" are only kept in memory: %s' %
+                      (key, str(ex)))
+            dumped = None
+            # a rough estimate
+            size = sum([len(repr(result)) for result in results])
+        if size > self.max_size:
+            log_debug('Search results for "%s" are too large to be cached' %
+                      key)
+            self.save()
+            return
+        entries[key] = (time.time(), size, results, dumped)
+        self.evict()
+        self.save()
+
+    def remove(self, search_string):
+        if self.entries().pop(normalize_search(search_string), None):
+            self.save()
+
+    def clear(self):
+        self.entries().clear()
+        self.save()
+
+    def evict(self):
+        entries = self.entries()
+        total = sum([entry[1] for entry in entries.values()])
+        while entries and (len(entries) > self.max_entries or
+                           total > self.max_size):
+            key, entry = entries.popitem(last=False)
+            total -= entry[1]
+            log_debug('Evicting search "%s" from the cache' % key)
+
+    def load(self):
+        try:
+            fp = open(self.filename, 'rb')
+            try:
+                stored_entries = pickle.load(fp)
+            finally:
+                fp.close()
+        except Exception as ex:
+            log_warn('Cannot read search cache %s: %s' % (self.filename,
+                                                          str(ex)))
+            return
+        now = time.time()
+        for key, stored, size, dumped in stored_entries:
+            if self.ttl is None or now - stored <= self.ttl:
+                self._entries[key] = (stored, size, None, dumped)
+        self.evict()
+
+    def save(self):
+        if self.filename is None:
+            return
+        stored_entries = [(key, stored, size, dumped) for key,
+                          (stored, size, results, dumped)
+                          in self.entries().items() if dumped is not None]
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            fp = open(self.filename + '.tmp', 'wb')
+            try:
+                pickle.dump(stored_entries, fp, pickle.HIGHEST_PROTOCOL)
+            finally:
+                fp.close()
+            os.rename(self.filename + '.tmp', self.filename)
+        except (IOError, OSError) as ex:
+            log_warn('Could not write search cache %s: %s' % (self.filename,
+                                                              str(ex)))
@@ -0,0 +1,124 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Tests for :mod:`gpapers.importer.bibtex`. Run with
+``python -m unittest discover tests`` from the top-level directory.
+'''
+
+from StringIO import StringIO
+import unittest
+
+from gpapers.importer.bibtex import (BibTeXReader, paper_info_from_bibtex,
+                                     paper_infos_from_bibtex)
+
+IEEE_BIBTEX = '@article{x,<br>title={T},<br>author={A and B}<br>}'
+
+
+def read_entries(data, **options):
+    '''
+    Returns the cite keys of the entries in `data`, read from a string and
+    from a file object with a small chunk size.
+    '''
+    from_string = [entry.cite_key
+                   for entry in BibTeXReader(data, **options).entries()]
+    from_file = [entry.cite_key
+                 for entry in BibTeXReader(StringIO(data), chunk_size=3,
+                                           **options).entries()]
+    return from_string, from_file
+
+
+class BibTeXTest(unittest.TestCase):
+
+    def assertEntries(self, data, keys, **options):
+        from_string, from_file = read_entries(data, **options)
+        self.assertEqual(from_string, keys)
+        self.assertEqual(from_file, keys)
+
+    def test_fields_and_macros(self):
+        data = ('@string{pnas = "Proc. Natl. Acad. Sci."}\n'
+                '@article{key1,\n'
+                '  author = {Smith, John and {Barnes and Noble}},\n'
+                '  title = {A {DNA} study},\n'
+                '  journal = pnas,\n'
+                '  year = 2001,\n'
+                '  doi = {http://dx.doi.org/10.1000/xyz}\n'
+                '}\n')
+        paper_info = paper_info_from_bibtex(data)
+        self.assertEqual(paper_info['title'], 'A DNA study')
+        self.assertEqual(paper_info['authors'], ['Smith, John',
+                                                 'Barnes and Noble'])
+        self.assertEqual(paper_info['journal'], 'Proc. Natl. Acad. Sci.')
+        self.assertEqual(paper_info['year'], '2001')
+        self.assertEqual(paper_info['doi'], '10.1000/xyz')
+
+    def test_all_entries(self):
+        self.assertEntries('@book{a, title={A}}\n@misc(b, title="B")\n'
+                           '@article{c, title={C}}', ['a', 'b', 'c'])
+
+    def test_ieee_line_breaks(self):
+        for infos in [list(paper_infos_from_bibtex(IEEE_BIBTEX)),
+                      list(paper_infos_from_bibtex(StringIO(IEEE_BIBTEX)))]:
+            self.assertEqual(len(infos), 1)
+            self.assertEqual(infos[0]['title'], 'T')
+            self.assertEqual(infos[0]['authors'], ['A', 'B'])
+        self.assertEqual(paper_info_from_bibtex(IEEE_BIBTEX)['title'], 'T')
+        # a tag split between two reads of the file
+        for chunk_size in range(1, 10):
+            entries = list(BibTeXReader(StringIO(IEEE_BIBTEX),
+                                        chunk_size=chunk_size).entries())
+            self.assertEqual([entry.fields['author'] for entry in entries],
+                             ['A and B'])
+
+    def test_unbalanced_entry_is_skipped(self):
+        data = ('@misc{k1, title={One}}\n'
+                '@misc{k2, title={Two}\n'
+                '@misc{k3, title={Unbalanced}\n'
+                '  @article{k4, title={Four}}\n'
+                '@article{k5, title={Five}}\n')
+        self.assertEntries(data, ['k1', 'k4', 'k5'])
+
+    def test_unbalanced_entry_reads_bounded_data(self):
+        data = ('@misc{k1, title={' + 'x' * 1000 + '\n' +
+                '@misc{k2, title={Two}}\n')
+        self.assertEntries(data, ['k2'], max_block_size=100)
+
+        class Reader(BibTeXReader):
+            largest_buffer = 0
+
+            def fill(self):
+                result = BibTeXReader.fill(self)
+                self.largest_buffer = max(self.largest_buffer,
+                                          len(self.buffer))
+                return result
+
+        reader = Reader(StringIO(data), chunk_size=10, max_block_size=100)
+        self.assertEqual([entry.cite_key for entry in reader.entries()],
+                         ['k2'])
+        self.assertTrue(reader.largest_buffer <= 110)
+
+    def test_comments_are_skipped(self):
+        data = ('@comment{@article{hidden, title={Hidden}}}\n'
+                '@comment this text is ignored as well\n'
+                '@article{visible, title={Visible}}\n')
+        self.assertEntries(data, ['visible'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Tests for :mod:`gpapers.importer.httpcache`, sending requests through a
+:class:`CachingSession` to a local HTTP server. Run with
+``python -m unittest discover tests`` from the top-level directory.
+'''
+
+import BaseHTTPServer
+import shutil
+import tempfile
+import threading
+import unittest
+
+from gi.repository import GLib
+from gi.repository import Soup
+
+from gpapers.importer.httpcache import CachingSession, HTTPCache
+
+LAST_MODIFIED = 'Sat, 01 Jan 2011 00:00:00 GMT'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Answers ``GET /<kind>/<name>`` with a body that counts the requests for
+    the path. `kind` selects the caching headers of the response.
+    '''
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers.items())))
+        kind = self.path.split('/')[1]
+        headers = {'Content-Type': 'text/plain'}
+        if kind == 'max-age':
+            headers['Cache-Control'] = 'max-age=3600'
+        elif kind == 'etag':
+            headers['Cache-Control'] = 'no-cache'
+            headers['ETag'] = '"v1"'
+            if self.headers.get('If-None-Match') == '"v1"':
+                return self.reply(304, headers, '')
+        elif kind == 'last-modified':
+            headers['Cache-Control'] = 'max-age=0'
+            headers['Last-Modified'] = LAST_MODIFIED
+            if self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+                return self.reply(304, headers, '')
+        elif kind == 'no-store':
+            headers['Cache-Control'] = 'no-store, max-age=3600'
+        elif kind == 'large':
+            headers['Cache-Control'] = 'max-age=3600'
+            return self.reply(200, headers, 'x' * 800)
+        count = len([path for path, _ in server.requests if path == self.path])
+        self.reply(200, headers, '%s %d' % (self.path, count))
+
+    def reply(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CachingSessionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_port
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests = []
+        self.directory = tempfile.mkdtemp()
+        self.cache = HTTPCache(self.directory, max_size=2000)
+        self.session = CachingSession(Soup.SessionAsync(), self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fetch(self, path):
+        '''
+        Sends a GET request for `path` and returns the status and the body of
+        the response.
+        '''
+        loop = GLib.MainLoop()
+        result = []
+
+        def received(session, message, user_data):
+            result.append((message.status_code,
+                           message.response_body.flatten().get_data()))
+            loop.quit()
+
+        message = Soup.Message.new('GET', self.url + path)
+        self.session.queue_message(message, received, None)
+        timeout = GLib.timeout_add_seconds(10, loop.quit)
+        loop.run()
+        GLib.source_remove(timeout)
+        self.assertTrue(result, 'No response for %s' % path)
+        return result[0]
+
+    def server_requests(self, path):
+        return [headers for request_path, headers in self.server.requests
+                if request_path == path]
+
+    def test_fresh_response_is_reused(self):
+        self.assertEqual(self.fetch('/max-age/a'), (200, '/max-age/a 1'))
+        self.assertEqual(self.fetch('/max-age/a'), (200, '/max-age/a 1'))
+        self.assertEqual(len(self.server_requests('/max-age/a')), 1)
+
+    def test_revalidation_with_etag(self):
+        self.assertEqual(self.fetch('/etag/a'), (200, '/etag/a 1'))
+        # the server answers "304 Not Modified", the cached body is used
+        self.assertEqual(self.fetch('/etag/a'), (200, '/etag/a 1'))
+        requests = self.server_requests('/etag/a')
+        self.assertEqual(len(requests), 2)
+        self.assertFalse('if-none-match' in requests[0])
+        self.assertEqual(requests[1].get('if-none-match'), '"v1"')
+
+    def test_revalidation_with_last_modified(self):
+        self.assertEqual(self.fetch('/last-modified/a'),
+                         (200, '/last-modified/a 1'))
+        self.assertEqual(self.fetch('/last-modified/a'),
+                         (200, '/last-modified/a 1'))
+        requests = self.server_requests('/last-modified/a')
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[1].get('if-modified-since'), LAST_MODIFIED)
+
+    def test_no_store(self):
+        self.assertEqual(self.fetch('/no-store/a'), (200, '/no-store/a 1'))
+        self.assertEqual(self.fetch('/no-store/a'), (200, '/no-store/a 2'))
+        self.assertEqual(self.cache.entries(), {})
+
+    def test_least_recently_used_entry_is_evicted(self):
+        # every entry takes a bit more than 800 bytes, the cache holds two
+        for name in ['a', 'b', 'a', 'c']:
+            self.fetch('/large/' + name)
+        self.assertEqual(len(self.server_requests('/large/a')), 1)
+        self.assertEqual(len(self.cache.entries()), 2)
+        self.assertTrue(sum([size for size, last_used
+                             in self.cache.entries().values()]) <= 2000)
+        # "b" was evicted, "a" and "c" are still cached
+        self.fetch('/large/b')
+        self.assertEqual(len(self.server_requests('/large/b')), 2)
+        self.fetch('/large/c')
+        self.assertEqual(len(self.server_requests('/large/c')), 1)
+
+    def test_cookies_of_the_session_are_part_of_the_key(self):
+        jar = Soup.CookieJar()
+        self.session.add_feature(jar)
+        uri = Soup.URI.new(self.url + '/')
+        jar.set_cookie(uri, 'user=first')
+        self.assertEqual(self.fetch('/max-age/a'), (200, '/max-age/a 1'))
+        jar.set_cookie(uri, 'user=second')
+        self.assertEqual(self.fetch('/max-age/a'), (200, '/max-age/a 2'))
+        self.assertEqual(self.fetch('/max-age/a'), (200, '/max-age/a 2'))
+        jar.set_cookie(uri, 'user=first')
+        self.assertEqual(self.fetch('/max-age/a'), (200, '/max-age/a 1'))
+        requests = self.server_requests('/max-age/a')
+        self.assertEqual([headers.get('cookie') for headers in requests],
+                         ['user=first', 'user=second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
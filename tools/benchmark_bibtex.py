@@ -0,0 +1,119 @@
+#! /usr/bin/python
+
+#    gPapers
+#    Copyright (C) 2007-2009 Derek Anderson
+#                  2012      Derek Anderson and Marcel Stimberg
+#
+# This file is part of gPapers.
+#
+#    gPapers is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    gPapers is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with gPapers.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark for the BibTeX parser (:mod:`gpapers.importer.bibtex`). Generates a
+file with 10000 entries (using macros, nested braces and quoted strings) and
+measures the time for parsing the first 100, 1000 and all entries; all
+entries are read from the file, the others from a string.
+
+To compare with the pyparsing grammar used before the streaming parser,
+extract the old module from the parent of the commit that replaced the
+pyparsing grammar and pass it with ``--pyparsing``, e.g.::
+
+    COMMIT=$(git log --format=%h -1 -S pyparsing -- gpapers/importer/bibtex.py)
+    git show $COMMIT^:gpapers/importer/bibtex.py > /tmp/bibtex_pyparsing.py
+    python tools/benchmark_bibtex.py --pyparsing /tmp/bibtex_pyparsing.py
+
+The old module needs pyparsing. Run the script from the top-level directory.
+'''
+
+import imp
+import optparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpapers.importer import bibtex
+
+ENTRY = '''@article{key%(index)d,
+  author = {Smith, John and M{\\"u}ller, Hans and {Barnes and Noble}},
+  title = {A {DNA} study of thing number %(index)d},
+  journal = pnas,
+  year = %(year)d,
+  month = jan,
+  volume = "12",
+  pages = {100--%(last_page)d},
+  doi = {10.1000/xyz.%(index)d},
+  abstract = "Some text with {braces} and {"}quotes{"} maybe, and more text
+              to make it longer, %(lorem)s"
+}
+
+'''
+
+
+def generate(count):
+    parts = ['@string{pnas = "Proceedings of the National Academy of '
+             'Sciences"}\n', '@comment this is ignored\n']
+    for index in xrange(count):
+        parts.append(ENTRY % {'index': index, 'year': 1990 + index % 30,
+                              'last_page': 100 + index,
+                              'lorem': 'lorem ipsum ' * 10})
+    return ''.join(parts)
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [--pyparsing MODULE]')
+    parser.add_option('--pyparsing', metavar='MODULE',
+                      help='the old bibtex.py module, based on pyparsing')
+    options, args = parser.parse_args()
+    old = None
+    if options.pyparsing:
+        old = imp.load_source('bibtex_pyparsing', options.pyparsing)
+
+    data = generate(10000)
+    fd, filename = tempfile.mkstemp(suffix='.bib')
+    os.write(fd, data)
+    os.close(fd)
+    try:
+        print 'Generated %d entries (%.1f MB)' % (10000, len(data) / 1e6)
+        for count in (100, 1000, 10000):
+            if count < 10000:
+                source = data[:data.index('@article{key%d,' % count)]
+            else:
+                source = open(filename, 'rb')
+            new_time, infos = timed(list,
+                                    bibtex.paper_infos_from_bibtex(source))
+            assert len(infos) == count
+            if count == 10000:
+                source.close()
+            line = '%6d entries: new %.3fs' % (count, new_time)
+            if old is not None:
+                if count == 10000:
+                    source = data
+                old_time, definitions = timed(old.parse_str, source)
+                line += ', pyparsing %.2fs' % old_time
+            print line
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()